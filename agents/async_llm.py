@@ -0,0 +1,114 @@
+# agents/async_llm.py
+import asyncio
+import threading
+import uuid
+from typing import AsyncIterator, Callable, List, Optional
+
+from vllm import AsyncEngineArgs, AsyncLLMEngine, SamplingParams
+from config import Config
+
+_STREAM_END = object()
+
+
+class AsyncLLMEngineRunner:
+    """在独立线程的事件循环中运行唯一的vLLM异步引擎，批量生成与流式生成共用同一份权重和KV缓存
+
+    引擎的后台循环绑定在创建它的事件循环上，所以所有请求都投递到该循环执行：
+    批处理线程经 generate_batch 同步等待，流式请求经队列把增量转交给调用方的事件循环。
+    两类请求在引擎内部由连续批处理一起调度。
+    """
+
+    def __init__(self, config: Config, dtype: str = "float16"):
+        self.config = config
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='vllm-engine-loop', daemon=True)
+        self._thread.start()
+        engine_args = AsyncEngineArgs(
+            model=config.LLM_MODEL_PATH,
+            trust_remote_code=True,
+            max_model_len=config.MAX_MODEL_LEN,
+            gpu_memory_utilization=config.GPU_MEMORY_UTILIZATION,
+            quantization="AWQ",
+            dtype=dtype,
+            enable_prefix_caching=config.ENABLE_PREFIX_CACHING
+        )
+        try:
+            self.engine = self._call(self._create_engine(engine_args))
+        except Exception:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            raise
+
+    async def _create_engine(self, engine_args):
+        return AsyncLLMEngine.from_engine_args(engine_args)
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _generate(self, prompt: str, sampling_params: SamplingParams):
+        request_id = f"batch-{uuid.uuid4().hex}"
+        final = None
+        try:
+            async for output in self.engine.generate(prompt, sampling_params, request_id):
+                final = output
+            return final
+        finally:
+            if final is None or not final.finished:
+                await self.engine.abort(request_id)
+
+    async def _generate_all(self, prompts: List[str], sampling_params: List[SamplingParams]):
+        return await asyncio.gather(*(self._generate(prompt, params)
+                                      for prompt, params in zip(prompts, sampling_params)))
+
+    def generate_batch(self, prompts: List[str], sampling_params: List[SamplingParams]) -> list:
+        """同步批量生成（供批处理线程调用），返回与输入顺序一致的最终RequestOutput"""
+        return self._call(self._generate_all(prompts, sampling_params))
+
+    async def _produce(self, prompt: str, sampling_params: SamplingParams, emit: Callable):
+        """在引擎循环中运行：把累积文本转换为增量交给emit；被取消（调用方提前退出）时中止请求释放KV缓存"""
+        request_id = f"stream-{uuid.uuid4().hex}"
+        sent = 0
+        finished = False
+        try:
+            async for output in self.engine.generate(prompt, sampling_params, request_id):
+                text = output.outputs[0].text
+                if len(text) > sent:
+                    emit(text[sent:])
+                    sent = len(text)
+                finished = output.finished
+                if finished:
+                    emit(output)
+        finally:
+            if not finished:
+                try:
+                    await self.engine.abort(request_id)
+                except Exception as e:
+                    print(f"⚠️ 中止流式请求失败: {e}")
+
+    async def stream(self, prompt: str, sampling_params: SamplingParams,
+                     on_finish: Optional[Callable] = None) -> AsyncIterator[str]:
+        """在调用方的事件循环中逐步产出新增的文本片段
+
+        on_finish 在请求完成时以最终的RequestOutput调用（用于统计）。
+        """
+        caller_loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def emit(item):
+            caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        future = asyncio.run_coroutine_threadsafe(self._produce(prompt, sampling_params, emit), self.loop)
+        future.add_done_callback(lambda _: emit(_STREAM_END))
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, str):
+                    yield item
+                elif on_finish is not None:
+                    on_finish(item)
+            # 引擎侧的异常在这里抛给调用方
+            future.result()
+        finally:
+            if not future.done():
+                future.cancel()
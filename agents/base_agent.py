@@ -1,23 +1,85 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any
-from .llm_wrapper import get_llm
-from rag.retriever import HybridRetriever
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+from .llm_wrapper import get_llm, aget_llm
+from .prompts import build_agent_prompt, render_rag_context
+from .token_budget import get_token_budget
 from config import Config
 
 class BaseAgent(ABC):
+    # 角色要求与结尾引导语是静态文本，位于提示词前部以便前缀缓存复用
+    instructions = ""
+    closing = "请提供你的专业分析："
+    # 目标生成长度，实际值受剩余上下文窗口限制
+    max_output_tokens = 200
+    # 是否复用LLM响应缓存；需要每次重新生成的创作类Agent关闭
+    use_response_cache = True
+    
     def __init__(self, name: str, role: str):
         self.name = name
         self.role = role
-        self.llm = get_llm()
+        self.config = Config()
+    
+    @property
+    def llm(self):
+        """首次生成时才加载LLM"""
+        return get_llm()
+    
+    def context_sections(self, context: dict) -> List[Tuple[str, str, int]]:
+        """提示词中的上下文段落 [(标题, 内容, 优先级)]，超出窗口时优先级低的先被裁剪，子类可追加"""
+        return [("相关知识库信息", render_rag_context(context.get('rag_context', [])), 1)]
+    
+    def plan_prompt(self, task: str, context: dict) -> Tuple[str, Optional[int]]:
+        """构建提示词（系统提示 → 角色要求 → 上下文 → 用户需求）并确定本次生成上限"""
+        sections = self.context_sections(context)
+        if not self.config.TOKEN_BUDGET_ENABLED:
+            prompt = build_agent_prompt(
+                self.name, self.role, self.instructions,
+                [(title, body) for title, body, _ in sections], task, self.closing
+            )
+            return prompt, None
+        
+        fixed_text = build_agent_prompt(self.name, self.role, self.instructions, [], task, self.closing)
+        plan = get_token_budget(self.config).plan(fixed_text, sections, self.max_output_tokens)
+        if plan.trimmed_tokens:
+            print(f"✂️ {self.name}提示词超出窗口，裁剪上下文 {plan.trimmed_tokens} tokens")
+        prompt = build_agent_prompt(self.name, self.role, self.instructions, plan.sections, task, self.closing)
+        return prompt, plan.max_tokens
+    
+    def build_prompt(self, task: str, context: dict) -> str:
+        return self.plan_prompt(task, context)[0]
     
-    def generate_response(self, prompt: str) -> str:
+    def generate_response(self, prompt: str, use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
         """使用vLLM生成响应"""
-        # 构建更清晰的系统提示
-        system_prompt = f"你是一名{self.role}，名叫{self.name}。请基于你的专业领域提供详细、准确的分析和建议。\n\n"
-        full_prompt = system_prompt + f"任务：{prompt}\n\n请提供你的专业分析："
-        return self.llm.generate(full_prompt)
+        return self.llm.generate(prompt, use_cache=use_cache, max_tokens=max_tokens)
+    
+    def _use_cache(self, use_cache: Optional[bool]) -> bool:
+        return self.use_response_cache if use_cache is None else use_cache
+    
+    def process_task(self, task: str, context: dict, use_cache: Optional[bool] = None) -> dict:
+        """处理任务：构建提示词 → 生成 → 整理结果；use_cache为空时按Agent的 use_response_cache"""
+        prompt, max_tokens = self.plan_prompt(task, context)
+        analysis = self.generate_response(prompt, use_cache=self._use_cache(use_cache), max_tokens=max_tokens)
+        return self.finalize(task, context, analysis)
+    
+    async def aprocess_task(self, task: str, context: dict, use_cache: Optional[bool] = None) -> dict:
+        """异步处理任务：生成请求进入批处理队列，等待期间不占用事件循环"""
+        prompt, max_tokens = self.plan_prompt(task, context)
+        llm = await aget_llm()
+        analysis = await llm.agenerate(prompt, use_cache=self._use_cache(use_cache), max_tokens=max_tokens)
+        return self.finalize(task, context, analysis)
+    
+    async def astream_task(self, task: str, context: dict,
+                           use_cache: Optional[bool] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """流式处理任务：逐个产出 ('token', 文本增量)，最后产出 ('result', 结果字典)"""
+        prompt, max_tokens = self.plan_prompt(task, context)
+        llm = await aget_llm()
+        chunks = []
+        async for delta in llm.astream(prompt, use_cache=self._use_cache(use_cache), max_tokens=max_tokens):
+            chunks.append(delta)
+            yield 'token', delta
+        yield 'result', self.finalize(task, context, llm.clean_response(''.join(chunks)))
     
     @abstractmethod
-    def process_task(self, task: str, context: dict) -> dict:
-        """处理任务抽象方法"""
-        pass
\ No newline at end of file
+    def finalize(self, task: str, context: dict, analysis: str) -> Dict[str, Any]:
+        """根据生成的分析整理结果与路由信息"""
+        pass
@@ -1,17 +1,9 @@
 from .base_agent import BaseAgent
+from .router import PrototypeRouter
 from typing import Dict, Any
 
 class CoordinatorAgent(BaseAgent):
-    def __init__(self):
-        super().__init__("协调员", "总指挥和任务分配")
-        
-    def process_task(self, task: str, context: dict) -> Dict[str, Any]:
-        """协调员处理任务 - 分析和分配"""
-        prompt = f"""作为协调员，你需要分析用户需求并决定如何分配任务。
-
-用户需求: {task}
-当前上下文: {context.get('rag_context', [])}
-
+    instructions = """作为协调员，你需要分析用户需求并决定如何分配任务。
 请分析这个需求涉及哪些方面，并决定需要哪些专家参与。可能的参与方包括：
 - 业务专家：处理客户关系、行业知识、业务流程
 - 技术专家：处理产品技术细节、解决方案设计  
@@ -21,22 +13,26 @@ class CoordinatorAgent(BaseAgent):
 1. 需求分析
 2. 需要参与的专家类型
 3. 下一步行动建议"""
-
-        analysis = self.generate_response(prompt)
+    closing = "请给出你的分析和分配建议："
+    
+    def __init__(self, router=None):
+        super().__init__("协调员", "总指挥和任务分配")
+        # 未指定路由器时只使用关键词规则
+        self.router = router or PrototypeRouter()
         
-        # 决策逻辑
-        task_lower = task.lower()
-        if any(keyword in task_lower for keyword in ['客户', '业务', '行业', '市场', '销售']):
-            next_agent = "business_expert"
-        elif any(keyword in task_lower for keyword in ['技术', '产品', '实现', '开发', '代码']):
-            next_agent = "tech_expert" 
-        elif any(keyword in task_lower for keyword in ['项目', '计划', '时间', '资源', '管理']):
-            next_agent = "project_manager"
-        else:
-            next_agent = "business_expert"  # 默认
-            
+    def route(self, task: str, context: dict) -> Dict[str, Any]:
+        """快速路由：不调用LLM，只根据任务向量/关键词决定下一步"""
+        decision = self.router.route(task)
         return {
-            'analysis': analysis,
-            'next_agent': next_agent,
-            'recommendations': f"建议由{next_agent}处理此任务"
-        }
\ No newline at end of file
+            'analysis': '',
+            'next_agent': decision.route,
+            'route_confidence': decision.confidence,
+            'route_method': decision.method,
+            'recommendations': f"建议由{decision.route}处理此任务"
+        }
+        
+    def finalize(self, task: str, context: dict, analysis: str) -> Dict[str, Any]:
+        """协调员整理分析结果并决定下一步"""
+        result = self.route(task, context)
+        result['analysis'] = analysis
+        return result
@@ -0,0 +1,191 @@
+# agents/llm_backend.py
+import asyncio
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional
+
+from config import Config
+
+
+class LLMBackend(ABC):
+    """LLM推理后端接口：只负责原始文本生成，批处理、缓存和后处理由LLMWrapper统一完成"""
+
+    name = "base"
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.model_id = ""         # 参与响应缓存键
+        self.sampling_params = None
+
+    @abstractmethod
+    def generate_batch(self, prompts: List[str], max_tokens: List[Optional[int]] = None) -> List[str]:
+        """批量生成原始文本，输出与输入顺序一致；max_tokens逐条指定生成上限，None使用默认值"""
+        pass
+
+    def supports_streaming(self) -> bool:
+        return False
+
+    async def stream(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """逐步产出原始文本增量"""
+        raise NotImplementedError
+        yield
+
+    def warmup(self):
+        pass
+
+    def get_stats(self) -> Dict:
+        return {}
+
+
+class VLLMBackend(LLMBackend):
+    """vLLM异步引擎：批处理队列送来的批次与流式请求由同一个引擎连续批处理，只加载一份权重"""
+
+    name = "vllm"
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        # vllm导入耗时数秒，只在真正创建引擎时导入
+        from vllm import SamplingParams
+        from agents.async_llm import AsyncLLMEngineRunner
+
+        self.model_id = config.LLM_MODEL_PATH
+        self.engine = AsyncLLMEngineRunner(config)
+        # 优化采样参数以获得更简洁的回答
+        self.sampling_params = SamplingParams(
+            temperature=0.1,           # 降低温度，减少随机性
+            top_p=0.9,                 # 使用nucleus sampling
+            top_k=50,                  # 限制候选token数量
+            repetition_penalty=1.3,    # 增加重复惩罚
+            max_tokens=200,            # 大幅限制生成长度
+            skip_special_tokens=True,  # 跳过特殊token
+            stop=[".", "。", "!", "！", "?", "？"]  # 添加停止词
+        )
+        # 前缀缓存命中统计（来自vLLM输出的num_cached_tokens）
+        self._prefix_lock = threading.Lock()
+        self.prefix_stats = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0}
+
+    def _sampling_params_for(self, max_tokens: Optional[int]):
+        if not max_tokens or max_tokens == self.sampling_params.max_tokens:
+            return self.sampling_params
+        params = self.sampling_params.clone()
+        params.max_tokens = max_tokens
+        return params
+
+    def generate_batch(self, prompts: List[str], max_tokens: List[Optional[int]] = None) -> List[str]:
+        max_tokens = max_tokens or [None] * len(prompts)
+        sampling_params = [self._sampling_params_for(limit) for limit in max_tokens]
+        outputs = self.engine.generate_batch(prompts, sampling_params)
+        for output in outputs:
+            self.record_prefix_usage(output)
+        return [output.outputs[0].text for output in outputs]
+
+    def supports_streaming(self) -> bool:
+        return True
+
+    async def stream(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        async for delta in self.engine.stream(prompt, self._sampling_params_for(max_tokens),
+                                              on_finish=self.record_prefix_usage):
+            yield delta
+
+    def warmup(self):
+        """预热：执行一次极短的生成，触发CUDA图捕获和内核编译，避免首个用户请求变慢"""
+        from vllm import SamplingParams
+        try:
+            self.engine.generate_batch(["你好"], [SamplingParams(max_tokens=1)])
+        except Exception as e:
+            print(f"⚠️ LLM预热失败: {e}")
+
+    def record_prefix_usage(self, output):
+        """累计提示词token数与命中前缀缓存的token数"""
+        prompt_tokens = len(output.prompt_token_ids or [])
+        cached_tokens = getattr(output, 'num_cached_tokens', None) or 0
+        with self._prefix_lock:
+            self.prefix_stats['requests'] += 1
+            self.prefix_stats['prompt_tokens'] += prompt_tokens
+            self.prefix_stats['cached_tokens'] += cached_tokens
+
+    def get_stats(self) -> Dict:
+        with self._prefix_lock:
+            stats = dict(self.prefix_stats)
+        stats['hit_rate'] = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        return {'prefix_cache': stats}
+
+
+class StubLLMBackend(LLMBackend):
+    """确定性CPU桩后端：按模板返回文本，并按配置的延迟和token速率模拟生成耗时
+
+    用于在无GPU环境下压测编排、检索和API开销。一个批次的耗时与单个请求相同，
+    近似vLLM连续批处理的行为。
+    """
+
+    name = "stub"
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self.latency = config.STUB_LLM_LATENCY_MS / 1000
+        self.tokens_per_sec = max(config.STUB_LLM_TOKENS_PER_SEC, 1e-6)
+        self.output_tokens = config.STUB_LLM_OUTPUT_TOKENS
+        self.template = config.STUB_LLM_RESPONSE
+        self.model_id = "stub"
+        self.sampling_params = (self.template, self.output_tokens)
+        self.stats = {'requests': 0, 'batches': 0}
+        self._lock = threading.Lock()
+
+    def _render(self, prompt: str) -> str:
+        # 只取最后一行（用户任务/问题），避免整个提示词被回显
+        last_line = prompt.strip().splitlines()[-1] if prompt.strip() else ""
+        return self.template.format(
+            digest=hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8],
+            prompt_chars=len(prompt),
+            tail=last_line[:30]
+        )
+
+    def _output_tokens(self, max_tokens: Optional[int]) -> int:
+        return min(self.output_tokens, max_tokens) if max_tokens else self.output_tokens
+
+    def generate_batch(self, prompts: List[str], max_tokens: List[Optional[int]] = None) -> List[str]:
+        # 一个批次的耗时取决于最长的输出
+        longest = max(self._output_tokens(limit) for limit in (max_tokens or [None]))
+        time.sleep(self.latency + longest / self.tokens_per_sec)
+        with self._lock:
+            self.stats['requests'] += len(prompts)
+            self.stats['batches'] += 1
+        return [self._render(prompt) for prompt in prompts]
+
+    def supports_streaming(self) -> bool:
+        return True
+
+    async def stream(self, prompt: str, max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        text = self._render(prompt)
+        output_tokens = self._output_tokens(max_tokens)
+        await asyncio.sleep(self.latency)
+        # 把文本均分为最多output_tokens段，总耗时与非流式生成一致
+        pieces = max(min(output_tokens, len(text)), 1)
+        step = len(text) / pieces
+        interval = output_tokens / self.tokens_per_sec / pieces
+        for i in range(pieces):
+            await asyncio.sleep(interval)
+            yield text[int(i * step):int((i + 1) * step)]
+        with self._lock:
+            self.stats['requests'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {'stub': dict(self.stats)}
+
+
+LLM_BACKENDS = {
+    VLLMBackend.name: VLLMBackend,
+    StubLLMBackend.name: StubLLMBackend
+}
+
+
+def create_llm_backend(config: Config) -> LLMBackend:
+    """按Config.LLM_BACKEND创建推理后端"""
+    backend_cls = LLM_BACKENDS.get(config.LLM_BACKEND)
+    if backend_cls is None:
+        raise ValueError(f"未知的LLM后端: {config.LLM_BACKEND}（可选: {', '.join(LLM_BACKENDS)}）")
+    print(f"🔧 使用LLM后端: {backend_cls.name}")
+    return backend_cls(config)
@@ -1,37 +1,159 @@
 # agents/llm_wrapper.py
-from vllm import LLM, SamplingParams
 from config import Config
-import torch
+from agents.request_batcher import RequestBatcher
+from agents.response_cache import ResponseCache, make_cache_key
+from agents.llm_backend import LLMBackend, create_llm_backend
+from agents.token_budget import get_token_budget
+from model_registry import get_model_registry
+from tracing import record_span, span, tracing_active
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import threading
+import time
 
-class vLLMWrapper:
-    def __init__(self, config: Config):
+class LLMWrapper:
+    """统一的LLM入口：响应缓存 → 动态批处理 → 推理后端 → 回答清理"""
+    
+    def __init__(self, config: Config, backend: LLMBackend = None):
         self.config = config
-        self.llm = LLM(
-            model=config.LLM_MODEL_PATH,
-            trust_remote_code=True,
-            max_model_len=config.MAX_MODEL_LEN,
-            gpu_memory_utilization=config.GPU_MEMORY_UTILIZATION,
-            quantization="AWQ",
-            dtype=torch.float16
-        )
-        # 优化采样参数以获得更简洁的回答
-        self.sampling_params = SamplingParams(
-            temperature=0.1,           # 降低温度，减少随机性
-            top_p=0.9,                 # 使用nucleus sampling
-            top_k=50,                  # 限制候选token数量
-            repetition_penalty=1.3,    # 增加重复惩罚
-            max_tokens=200,            # 大幅限制生成长度
-            skip_special_tokens=True,  # 跳过特殊token
-            stop=[".", "。", "!", "！", "?", "？"]  # 添加停止词
-        )
-
-    def generate(self, prompt: str) -> str:
-        outputs = self.llm.generate([prompt], self.sampling_params)
-        response = outputs[0].outputs[0].text
+        self.backend = backend or create_llm_backend(config)
+        # 并发请求经批处理队列合并，充分利用vLLM的连续批处理
+        self.batcher = None
+        if config.LLM_BATCHING_ENABLED:
+            self.batcher = RequestBatcher(
+                self.generate_batch,
+                max_batch_size=config.LLM_MAX_BATCH_SIZE,
+                max_wait_ms=config.LLM_BATCH_WAIT_MS
+            )
+        # 响应缓存：采样近似确定，相同提示词直接复用上次的回答
+        self.response_cache = None
+        if config.RESPONSE_CACHE_ENABLED:
+            try:
+                self.response_cache = ResponseCache(
+                    config.RESPONSE_CACHE_PATH,
+                    max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                    ttl=config.RESPONSE_CACHE_TTL
+                )
+            except Exception as e:
+                print(f"⚠️ 响应缓存初始化失败，不使用缓存: {e}")
+
+    def generate(self, prompt: str, use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
+        """生成回答；use_cache=False 时跳过响应缓存（需要多样性的调用），max_tokens为空时使用后端默认值"""
+        with span("llm.generate", backend=self.backend.name) as trace:
+            key = self._cache_key(prompt, max_tokens) if use_cache else None
+            cached = self._cache_get(key)
+            if cached is not None:
+                trace.set(cached=True)
+                return cached
+            
+            if self.batcher is not None:
+                future = self.batcher.submit(prompt, max_tokens)
+                response = future.result()
+                self._trace_batch(trace, future)
+            else:
+                response = self.generate_batch([prompt], [max_tokens])[0]
+                trace.set(batch_size=1)
+            self._trace_tokens(trace, prompt, response)
+            self._cache_put(key, response)
+            return response
+    
+    async def agenerate(self, prompt: str, use_cache: bool = True, max_tokens: Optional[int] = None) -> str:
+        """异步生成：经批处理队列，不阻塞事件循环"""
+        if self.batcher is None:
+            return await asyncio.to_thread(self.generate, prompt, use_cache, max_tokens)
+        with span("llm.generate", backend=self.backend.name) as trace:
+            key = self._cache_key(prompt, max_tokens) if use_cache else None
+            cached = self._cache_get(key)
+            if cached is not None:
+                trace.set(cached=True)
+                return cached
+            future = self.batcher.submit(prompt, max_tokens)
+            response = await asyncio.wrap_future(future)
+            self._trace_batch(trace, future)
+            self._trace_tokens(trace, prompt, response)
+            self._cache_put(key, response)
+            return response
+    
+    def _trace_batch(self, trace, future):
+        trace.set(batch_size=getattr(future, 'batch_size', 1), queue_ms=round(getattr(future, 'wait_ms', 0.0), 3))
+    
+    def _trace_tokens(self, trace, prompt: str, response: str):
+        """只在记录区间时统计token数（需要额外分词）"""
+        if trace.recording:
+            counter = get_token_budget(self.config).counter
+            trace.set(prompt_tokens=counter.count(prompt), output_tokens=counter.count(response))
+    
+    def _cache_key(self, prompt: str, max_tokens: Optional[int] = None):
+        if self.response_cache is None:
+            return None
+        return make_cache_key(self.backend.model_id, prompt, (self.backend.sampling_params, max_tokens))
+    
+    def _cache_get(self, key):
+        if key is None:
+            return None
+        try:
+            return self.response_cache.get(key)
+        except Exception as e:
+            print(f"⚠️ 读取响应缓存失败: {e}")
+            return None
+    
+    def _cache_put(self, key, response: str):
+        if key is None:
+            return
+        try:
+            self.response_cache.put(key, response)
+        except Exception as e:
+            print(f"⚠️ 写入响应缓存失败: {e}")
+    
+    def generate_batch(self, prompts: List[str], max_tokens: List[Optional[int]] = None) -> List[str]:
+        """一次后端调用处理多个提示，输出与输入顺序一致"""
+        outputs = self.backend.generate_batch(prompts, max_tokens)
         # 后处理：清理回答
-        return self._clean_response(response)
+        return [self.clean_response(output) for output in outputs]
+    
+    async def astream(self, prompt: str, use_cache: bool = True,
+                      max_tokens: Optional[int] = None) -> AsyncIterator[str]:
+        """流式生成：后端支持时逐步产出原始文本增量，否则（或命中缓存时）一次产出完整回答"""
+        if not self.backend.supports_streaming():
+            yield await self.agenerate(prompt, use_cache, max_tokens)
+            return
+        
+        key = self._cache_key(prompt, max_tokens) if use_cache else None
+        cached = self._cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+        
+        # 生成器会跨多次恢复执行，区间在结束时一次性记录
+        start = time.perf_counter()
+        first_token_ms = None
+        chunks = []
+        async for delta in self.backend.stream(prompt, max_tokens):
+            if first_token_ms is None:
+                first_token_ms = round((time.perf_counter() - start) * 1000, 3)
+            chunks.append(delta)
+            yield delta
+        response = self.clean_response(''.join(chunks))
+        if tracing_active():
+            counter = get_token_budget(self.config).counter
+            record_span("llm.stream", start, backend=self.backend.name, batch_size=1,
+                        first_token_ms=first_token_ms, prompt_tokens=counter.count(prompt),
+                        output_tokens=counter.count(response))
+        self._cache_put(key, response)
+    
+    def get_stats(self) -> Dict:
+        stats = {
+            'backend': self.backend.name,
+            'batching': self.batcher.get_stats() if self.batcher is not None else {},
+            'response_cache': self.response_cache.get_stats() if self.response_cache is not None else {}
+        }
+        stats.update(self.backend.get_stats())
+        return stats
     
-    def _clean_response(self, text: str) -> str:
+    def warmup(self):
+        self.backend.warmup()
+    
+    def clean_response(self, text: str) -> str:
         """清理回答，移除多余内容"""
         # 移除重复的句子
         sentences = text.split('。')
@@ -55,9 +177,53 @@ class vLLMWrapper:
         
         return cleaned
 
-# 全局实例
+# 兼容旧名称
+vLLMWrapper = LLMWrapper
+
+# 全局实例：首次使用时才创建
 _config = Config()
-_llm_wrapper = vLLMWrapper(_config)
+_llm_wrapper = None
+_llm_lock = threading.Lock()
+
+def _load_llm() -> LLMWrapper:
+    wrapper = LLMWrapper(_config)
+    if _config.LLM_WARMUP:
+        wrapper.warmup()
+    return wrapper
+
+def get_llm() -> LLMWrapper:
+    """获取全局LLM，首次调用时加载引擎（线程安全，并发调用者等待同一次加载）"""
+    global _llm_wrapper
+    if _llm_wrapper is None:
+        with _llm_lock:
+            if _llm_wrapper is None:
+                start = time.time()
+                # 经模型注册表加载，统一报告显存占用
+                _llm_wrapper = get_model_registry().get_or_load(
+                    f"llm:{_config.LLM_BACKEND}", _config.LLM_MODEL_PATH, _load_llm
+                )
+                print(f"✅ LLM加载完成，用时 {time.time() - start:.1f}s")
+    return _llm_wrapper
+
+async def aget_llm() -> LLMWrapper:
+    """异步获取全局LLM：尚未加载时在线程中加载，不阻塞事件循环"""
+    if _llm_wrapper is not None:
+        return _llm_wrapper
+    return await asyncio.to_thread(get_llm)
+
+def is_llm_loaded() -> bool:
+    return _llm_wrapper is not None
+
+def _preload():
+    try:
+        get_llm()
+    except Exception as e:
+        print(f"⚠️ LLM预加载失败，将在首次使用时重试: {e}")
 
-def get_llm() -> vLLMWrapper:
-    return _llm_wrapper
\ No newline at end of file
+def preload_llm(background: bool = True):
+    """预加载LLM；background=True 时在后台线程加载并立即返回线程对象"""
+    if not background:
+        return get_llm()
+    thread = threading.Thread(target=_preload, name='llm-preload', daemon=True)
+    thread.start()
+    return thread
\ No newline at end of file
@@ -1,33 +1,32 @@
 from .base_agent import BaseAgent
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+from .prompts import render_previous_results
 
 class ProjectManagerAgent(BaseAgent):
-    def __init__(self):
-        super().__init__("项目经理", "负责内部流程推进")
-        
-    def process_task(self, task: str, context: dict) -> Dict[str, Any]:
-        """项目经理处理任务"""
-        rag_context = context.get('rag_context', [])
-        rag_info = "\n".join([doc['content'] for doc in rag_context]) if rag_context else "暂无相关信息"
-        
-        prompt = f"""作为项目经理，你负责项目规划和执行。
-
-用户需求: {task}
-相关知识库信息: {rag_info}
-之前的分析结果: {context.get('previous_results', {})}
-
+    instructions = """作为项目经理，你负责项目规划和执行。
 请制定详细的项目计划，包括：
 1. 项目目标和关键成果
 2. 时间线和里程碑设置
 3. 资源分配和团队组建
 4. 风险评估和应对策略
 5. 预算和成本估算
-6. 质量保证措施
-
-请提供完整的项目执行计划："""
-
-        analysis = self.generate_response(prompt)
+6. 质量保证措施"""
+    closing = "请提供完整的项目执行计划："
+    max_output_tokens = 300
+    # 项目计划属于创作类输出，每次重新生成，不复用响应缓存
+    use_response_cache = False
+    
+    def __init__(self):
+        super().__init__("项目经理", "负责内部流程推进")
         
+    def context_sections(self, context: dict) -> List[Tuple[str, str, int]]:
+        """知识库信息之后追加之前的分析结果（优先级高于知识库，窗口不足时先裁知识库）"""
+        return super().context_sections(context) + [
+            ("之前的分析结果", render_previous_results(context.get('previous_results', {})), 2)
+        ]
+    
+    def finalize(self, task: str, context: dict, analysis: str) -> Dict[str, Any]:
+        """项目经理整理项目计划结果"""
         return {
             'role': 'project_manager',
             'analysis': analysis,
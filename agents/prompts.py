@@ -0,0 +1,44 @@
+# agents/prompts.py
+# 提示词按"静态在前、可变在后"拼装，让vLLM自动前缀缓存复用KV：
+# 系统提示（所有Agent共享）→ 角色与要求（同一Agent跨请求共享）→ 知识库上下文（固定排序）
+# → 之前的分析 → 用户需求（每次都不同，放在最后）
+from typing import Dict, List, Tuple
+
+SYSTEM_PROMPT = """你是企业多Agent协同任务系统中的一名专家成员，与协调员、业务专家、技术专家、项目经理共同完成用户需求。
+请基于你的专业领域和提供的知识库信息，给出准确、具体、可执行的分析和建议；知识库没有的信息不要编造。"""
+
+
+def _context_sort_key(doc: Dict) -> tuple:
+    metadata = doc.get('metadata') or {}
+    parent = str(metadata.get('parent_id') or metadata.get('doc_id') or '')
+    return (parent, metadata.get('chunk_index', 0), doc.get('content', ''))
+
+
+def render_rag_context(rag_context: List[Dict]) -> str:
+    """渲染知识库上下文：按文档和块序固定排序，同一批文档总是得到相同文本"""
+    if not rag_context:
+        return "暂无相关信息"
+    docs = sorted(rag_context, key=_context_sort_key)
+    return "\n".join(f"- {doc['content']}" for doc in docs)
+
+
+def render_previous_results(previous_results: Dict) -> str:
+    """渲染之前各Agent的分析，按执行顺序"""
+    if not previous_results:
+        return "暂无"
+    return "\n".join(
+        f"- {agent}：{result.get('analysis', '')}" if isinstance(result, dict) else f"- {agent}：{result}"
+        for agent, result in previous_results.items()
+    )
+
+
+def build_agent_prompt(name: str, role: str, instructions: str,
+                       sections: List[Tuple[str, str]], task: str, closing: str) -> str:
+    """拼装Agent提示词，sections为 [(标题, 内容)]，按给定顺序放在角色要求之后、任务之前"""
+    parts = [
+        SYSTEM_PROMPT,
+        f"你是一名{role}，名叫{name}。\n{instructions}"
+    ]
+    parts.extend(f"【{title}】\n{body}" for title, body in sections)
+    parts.append(f"【用户需求】\n{task}\n\n{closing}")
+    return "\n\n".join(parts)
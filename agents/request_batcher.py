@@ -0,0 +1,133 @@
+# agents/request_batcher.py
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Dict, List, Optional
+
+
+class _Request:
+    __slots__ = ('prompt', 'max_tokens', 'future', 'enqueued_at')
+
+    def __init__(self, prompt: str, max_tokens: Optional[int] = None):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class RequestBatcher:
+    """动态批处理队列：把时间窗口内到达的请求合并为一次批量生成
+
+    后台单线程消费队列：取到第一个请求后，最多再等待 max_wait_ms 或凑满
+    max_batch_size，然后一次调用 batch_fn。上一批生成期间到达的请求会在
+    下一批中一起处理，底层模型调用也因此被串行化。
+    """
+
+    def __init__(self, batch_fn: Callable[[List[str], List[Optional[int]]], List[str]],
+                 max_batch_size: int = 16, max_wait_ms: float = 10):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'cancelled': 0,
+            'batches': 0,
+            'failed_batches': 0,
+            'max_batch_size': 0,
+            'total_wait': 0.0,
+            'total_batch_time': 0.0
+        }
+        self._worker = threading.Thread(target=self._run, name='llm-request-batcher', daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, max_tokens: Optional[int] = None) -> Future:
+        request = _Request(prompt, max_tokens)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        """同步接口：提交请求并阻塞等待本请求的结果"""
+        return self.submit(prompt, max_tokens).result()
+
+    async def agenerate(self, prompt: str, max_tokens: Optional[int] = None) -> str:
+        """异步接口：不阻塞事件循环"""
+        return await asyncio.wrap_future(self.submit(prompt, max_tokens))
+
+    def _collect(self) -> List[_Request]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # 单个批次的任何异常都不能让后台线程退出，否则之后的请求会永久阻塞
+        while True:
+            try:
+                self._run_batch(self._collect())
+            except Exception as e:
+                print(f"❌ 批处理线程异常: {e}")
+
+    @staticmethod
+    def _resolve(future: Future, result=None, error: BaseException = None):
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def _run_batch(self, batch: List[_Request]):
+        # 跳过已被取消的请求（如客户端断开、异步调用方被取消），其余请求标记为运行中后不可再取消
+        pending = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        cancelled = len(batch) - len(pending)
+        started = time.monotonic()
+        error = None
+        outputs = []
+        if pending:
+            try:
+                outputs = list(self.batch_fn(
+                    [request.prompt for request in pending],
+                    [request.max_tokens for request in pending]
+                ))
+                if len(outputs) < len(pending):
+                    error = RuntimeError(f"批量生成返回 {len(outputs)} 条结果，少于请求数 {len(pending)}")
+            except Exception as e:
+                print(f"❌ 批量生成失败: {e}")
+                error = e
+        for index, request in enumerate(pending):
+            # 供调用方的追踪区间记录批大小与排队时间
+            request.future.batch_size = len(pending)
+            request.future.wait_ms = (started - request.enqueued_at) * 1000
+            if index < len(outputs):
+                self._resolve(request.future, result=outputs[index])
+            else:
+                self._resolve(request.future, error=error)
+
+        with self._lock:
+            self.stats['requests'] += len(pending)
+            self.stats['cancelled'] += cancelled
+            if pending:
+                self.stats['batches'] += 1
+                self.stats['failed_batches'] += int(error is not None)
+                self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(pending))
+                self.stats['total_wait'] += sum(started - request.enqueued_at for request in pending)
+                self.stats['total_batch_time'] += time.monotonic() - started
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_batch_size'] = stats['requests'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_wait_ms'] = stats['total_wait'] / stats['requests'] * 1000 if stats['requests'] else 0.0
+        stats['avg_batch_ms'] = stats['total_batch_time'] / stats['batches'] * 1000 if stats['batches'] else 0.0
+        return stats
@@ -0,0 +1,158 @@
+# agents/router.py
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import Config
+
+# 各专家的标注示例任务，向量均值作为该路由的原型
+ROUTE_EXAMPLES = {
+    "business_expert": [
+        "分析某制造业客户的行业背景和市场需求",
+        "帮客户梳理销售流程并提出优化建议",
+        "评估进入零售行业的业务风险和机会",
+        "客户希望提升会员复购率，给出业务方案",
+        "分析竞争对手的市场策略和客户群体",
+        "为金融客户设计新的业务合作模式",
+    ],
+    "tech_expert": [
+        "设计一个高并发订单系统的技术架构",
+        "评估微服务改造的技术方案和实现难度",
+        "产品需要接入第三方支付接口，如何开发实现",
+        "数据库查询很慢，给出性能优化方案",
+        "选择合适的技术栈开发移动端应用",
+        "排查线上服务内存泄漏的代码问题",
+    ],
+    "project_manager": [
+        "制定一个三个月的项目实施计划",
+        "协调开发和测试资源，安排项目里程碑",
+        "项目进度延期，如何调整时间和人员",
+        "评估项目预算和资源投入",
+        "组织项目启动会并明确各方职责",
+        "管理多个并行项目的优先级和风险",
+    ],
+}
+
+# 关键词规则：按顺序匹配，未命中时默认交给业务专家
+KEYWORD_RULES = [
+    ("business_expert", ['客户', '业务', '行业', '市场', '销售']),
+    ("tech_expert", ['技术', '产品', '实现', '开发', '代码']),
+    ("project_manager", ['项目', '计划', '时间', '资源', '管理']),
+]
+DEFAULT_ROUTE = "business_expert"
+
+
+def keyword_route(task: str) -> str:
+    task_lower = task.lower()
+    for route, keywords in KEYWORD_RULES:
+        if any(keyword in task_lower for keyword in keywords):
+            return route
+    return DEFAULT_ROUTE
+
+
+class RouteDecision:
+    """一次路由结果：目标Agent、置信度、决策方式（embedding / keyword）"""
+
+    __slots__ = ('route', 'confidence', 'method', 'scores')
+
+    def __init__(self, route: str, confidence: float, method: str, scores: Dict[str, float] = None):
+        self.route = route
+        self.confidence = confidence
+        self.method = method
+        self.scores = scores or {}
+
+
+class PrototypeRouter:
+    """按任务向量与各路由原型向量的余弦相似度分派任务
+
+    任务向量与检索使用同一个嵌入模型：协调员路由前检索已编码过同一任务文本，
+    经嵌入缓存直接命中，路由本身只是一次小矩阵乘法。原型在首次路由时编码
+    一次示例任务得到。无嵌入模型、原型构建失败或置信度不足时回退关键词规则。
+    """
+
+    def __init__(self, embedding_model=None, examples: Dict[str, List[str]] = None,
+                 min_confidence: float = 0.5, temperature: float = 0.05):
+        self.embedding_model = embedding_model
+        self.examples = examples or ROUTE_EXAMPLES
+        self.min_confidence = min_confidence
+        self.temperature = temperature
+        self._routes = list(self.examples)
+        self._prototypes = None
+        self._prototypes_failed = embedding_model is None
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'embedding': 0, 'keyword': 0, 'total_time': 0.0}
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _get_prototypes(self) -> Optional[np.ndarray]:
+        if self._prototypes is not None or self._prototypes_failed:
+            return self._prototypes
+        with self._lock:
+            if self._prototypes is None and not self._prototypes_failed:
+                try:
+                    texts = [text for route in self._routes for text in self.examples[route]]
+                    vectors = self._normalize(np.asarray(self.embedding_model.encode(texts), dtype=np.float32))
+                    prototypes, start = [], 0
+                    for route in self._routes:
+                        count = len(self.examples[route])
+                        prototypes.append(vectors[start:start + count].mean(axis=0))
+                        start += count
+                    self._prototypes = self._normalize(np.stack(prototypes))
+                    print(f"✅ 路由原型构建完成（{len(self._routes)} 个路由，{len(texts)} 条示例）")
+                except Exception as e:
+                    print(f"⚠️ 路由原型构建失败，使用关键词路由: {e}")
+                    self._prototypes_failed = True
+        return self._prototypes
+
+    def route(self, task: str, query_vector: np.ndarray = None) -> RouteDecision:
+        """query_vector 为空时用嵌入模型编码任务（通常命中检索时写入的嵌入缓存）"""
+        start = time.perf_counter()
+        decision = None
+        confidence = 0.0
+        prototypes = self._get_prototypes()
+        if prototypes is not None:
+            try:
+                if query_vector is None:
+                    query_vector = self.embedding_model.encode([task])[0]
+                vector = self._normalize(np.asarray(query_vector, dtype=np.float32))
+                similarities = prototypes @ vector
+                logits = (similarities - similarities.max()) / self.temperature
+                probs = np.exp(logits) / np.exp(logits).sum()
+                best = int(np.argmax(probs))
+                confidence = float(probs[best])
+                if confidence >= self.min_confidence:
+                    decision = RouteDecision(
+                        self._routes[best], confidence, 'embedding',
+                        {route: float(score) for route, score in zip(self._routes, similarities)}
+                    )
+            except Exception as e:
+                print(f"⚠️ 向量路由失败，使用关键词路由: {e}")
+        if decision is None:
+            # 关键词路由的置信度记为向量路由的最高概率（未计算时为0）
+            decision = RouteDecision(keyword_route(task), confidence, 'keyword')
+
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[decision.method] += 1
+            self.stats['total_time'] += time.perf_counter() - start
+        return decision
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['avg_route_us'] = stats['total_time'] / stats['requests'] * 1e6 if stats['requests'] else 0.0
+        return stats
+
+
+def create_router(config: Config, embedding_model=None) -> PrototypeRouter:
+    """ROUTER_ENABLED关闭时只使用关键词规则"""
+    return PrototypeRouter(
+        embedding_model if config.ROUTER_ENABLED else None,
+        min_confidence=config.ROUTER_MIN_CONFIDENCE
+    )
@@ -0,0 +1,184 @@
+# agents/token_budget.py
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from config import Config
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+# 近似计数：中文每字约1个token，其余按每4个字符1个token
+_CJK_CHAR = re.compile(r'[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]')
+
+
+def get_tokenizer(model_path: str):
+    """按模型路径缓存tokenizer，加载失败时返回None（使用近似计数）"""
+    with _tokenizers_lock:
+        if model_path not in _tokenizers:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizers[model_path] = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+            except Exception as e:
+                print(f"⚠️ 加载LLM tokenizer失败，使用近似token计数: {e}")
+                _tokenizers[model_path] = None
+        return _tokenizers[model_path]
+
+
+class TokenCounter:
+    """带LRU缓存的token计数：系统提示、角色要求等重复文本只编码一次"""
+
+    def __init__(self, tokenizer=None, cache_size: int = 4096):
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        with self._lock:
+            cached = self._cache.get(text)
+            if cached is not None:
+                self._cache.move_to_end(text)
+                return cached
+        count = self._count(text)
+        with self._lock:
+            self._cache[text] = count
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        cjk = len(_CJK_CHAR.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断到不超过max_tokens个token"""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)
+            return text if len(ids) <= max_tokens else self.tokenizer.decode(ids[:max_tokens])
+        # 近似计数下按比例截断后逐步收缩
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        cut = text[:max(int(len(text) * max_tokens / total), 1)]
+        while cut and self.count(cut) > max_tokens:
+            cut = cut[:-max(len(cut) // 10, 1)]
+        return cut
+
+    def trim(self, text: str, max_tokens: int) -> str:
+        """按行保留最长前缀，首行本身超预算时按token截断"""
+        if self.count(text) <= max_tokens:
+            return text
+        kept = []
+        used = 0
+        for line in text.split('\n'):
+            cost = self.count(line) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        if kept:
+            return '\n'.join(kept)
+        return self.truncate(text, max_tokens)
+
+
+class PromptPlan:
+    """一次生成调用的预算结果"""
+
+    __slots__ = ('sections', 'prompt_tokens', 'max_tokens', 'trimmed_tokens')
+
+    def __init__(self, sections: List[Tuple[str, str]], prompt_tokens: int, max_tokens: int, trimmed_tokens: int):
+        self.sections = sections
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.trimmed_tokens = trimmed_tokens
+
+
+class TokenBudgetManager:
+    """在MAX_MODEL_LEN窗口内分配提示词与生成长度
+
+    固定部分（系统提示、角色要求、任务）必须保留；可变段落按优先级从低到高裁剪，
+    直到 提示词 + 目标生成长度 放得下；生成长度取目标值与剩余窗口的较小者。
+    """
+
+    def __init__(self, counter: TokenCounter, max_model_len: int, safety_margin: int = 32,
+                 min_output_tokens: int = 32):
+        self.counter = counter
+        self.max_model_len = max_model_len
+        self.safety_margin = safety_margin
+        self.min_output_tokens = min_output_tokens
+        self._lock = threading.Lock()
+        self.stats = {'plans': 0, 'trimmed_plans': 0, 'trimmed_tokens': 0, 'shrunk_outputs': 0}
+
+    def plan(self, fixed_text: str, sections: List[Tuple[str, str, int]], target_output: int) -> PromptPlan:
+        """sections 为 [(标题, 内容, 优先级)]，优先级越大越晚被裁剪；返回的段落保持原顺序"""
+        window = self.max_model_len - self.safety_margin
+        fixed_tokens = self.counter.count(fixed_text)
+        # 每个段落的标题行与分隔空行按常数计入
+        costs = [self.counter.count(body) + self.counter.count(title) + 4 for title, body, _ in sections]
+        bodies = [body for _, body, _ in sections]
+
+        input_budget = max(window - target_output, window // 2)
+        overflow = fixed_tokens + sum(costs) - input_budget
+        trimmed = 0
+        if overflow > 0:
+            for index in sorted(range(len(sections)), key=lambda i: sections[i][2]):
+                if overflow <= 0:
+                    break
+                body_tokens = costs[index] - self.counter.count(sections[index][0]) - 4
+                keep = max(body_tokens - overflow, 0)
+                new_body = self.counter.trim(bodies[index], keep) if keep else ""
+                saved = body_tokens - (self.counter.count(new_body) if new_body else 0)
+                bodies[index] = new_body
+                trimmed += saved
+                # 整段被裁空时连同标题一起去掉
+                released = costs[index] if not new_body else saved
+                costs[index] -= released
+                overflow -= released
+
+        prompt_tokens = fixed_tokens + sum(costs)
+        max_tokens = min(target_output, window - prompt_tokens)
+        max_tokens = max(max_tokens, self.min_output_tokens)
+
+        with self._lock:
+            self.stats['plans'] += 1
+            if trimmed:
+                self.stats['trimmed_plans'] += 1
+                self.stats['trimmed_tokens'] += trimmed
+            if max_tokens < target_output:
+                self.stats['shrunk_outputs'] += 1
+
+        kept_sections = [(title, body) for (title, _, _), body in zip(sections, bodies) if body]
+        return PromptPlan(kept_sections, prompt_tokens, max_tokens, trimmed)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+_budget_manager = None
+_budget_manager_lock = threading.Lock()
+
+
+def get_token_budget(config: Config) -> TokenBudgetManager:
+    """进程内共享的预算管理器，首次使用时加载tokenizer"""
+    global _budget_manager
+    with _budget_manager_lock:
+        if _budget_manager is None:
+            tokenizer = get_tokenizer(config.LLM_MODEL_PATH) if config.LLM_BACKEND == 'vllm' else None
+            _budget_manager = TokenBudgetManager(
+                TokenCounter(tokenizer),
+                max_model_len=config.MAX_MODEL_LEN,
+                safety_margin=config.PROMPT_SAFETY_MARGIN,
+                min_output_tokens=config.MIN_OUTPUT_TOKENS
+            )
+        return _budget_manager
+
+
+def peek_token_budget():
+    """已创建时返回预算管理器，否则返回None（不触发tokenizer加载）"""
+    return _budget_manager
@@ -26,6 +26,11 @@ def init_system():
         from services.concise_response import ConciseResponseService
         quick_service = ConciseResponseService(config)
         
+        # LLM在后台加载，页面先可用
+        if config.LLM_PRELOAD:
+            from agents.llm_wrapper import preload_llm
+            preload_llm(background=True)
+        
         orchestrator = None  # 延迟初始化
         
         return {
@@ -143,7 +148,8 @@ def display_deep_analysis_results(result: dict, original_task: str):
     if "coordinator" in results:
         st.subheader("🎯 任务分析与分配")
         coord_result = results["coordinator"]
-        st.info(coord_result["analysis"])
+        if coord_result.get("analysis"):
+            st.info(coord_result["analysis"])
         st.metric("执行专家", coord_result["next_agent"].replace("_", " ").title())
     
     # 业务专家分析
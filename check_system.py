@@ -1,6 +1,6 @@
 # check_system.py
 from config import Config
-from rag.vector_store import MilvusVectorStore
+from rag.vector_store import create_vector_store
 from rag.retriever import HybridRetriever
 import sys
 
@@ -13,7 +13,7 @@ def check_system():
     
     # 检查Milvus连接
     try:
-        vector_store = MilvusVectorStore(config)
+        vector_store = create_vector_store(config)
         print("✅ Milvus连接正常")
         
         # 测试搜索
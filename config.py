@@ -20,8 +20,118 @@ class Config:
     # RAG配置
     COLLECTION_NAME = os.getenv('COLLECTION_NAME', "enterprise_knowledge")
     
+    # Reranker批量打分大小
+    RERANK_BATCH_SIZE = int(os.getenv('RERANK_BATCH_SIZE', '16'))
+    
+    # 自适应重排序：按向量距离间隔跳过/只重排模糊区间/截掉远距离尾部（距离为归一化向量的平方L2）
+    RERANK_POLICY_ENABLED = os.getenv('RERANK_POLICY_ENABLED', 'true').lower() == 'true'
+    RERANK_SKIP_MARGIN = float(os.getenv('RERANK_SKIP_MARGIN', '0.15'))  # 领先下一名至少该间隔视为已确定
+    RERANK_CUT_MARGIN = float(os.getenv('RERANK_CUT_MARGIN', '0.5'))     # 比最优结果远出该间隔的候选直接丢弃
+    
+    # 上下文压缩：去掉近重复块，按与任务的相似度挑选句子装入token预算（所有Agent共享）
+    CONTEXT_PACKING_ENABLED = os.getenv('CONTEXT_PACKING_ENABLED', 'true').lower() == 'true'
+    CONTEXT_MAX_TOKENS = int(os.getenv('CONTEXT_MAX_TOKENS', '1024'))
+    CONTEXT_DEDUP_THRESHOLD = float(os.getenv('CONTEXT_DEDUP_THRESHOLD', '0.8'))
+    # 写入时为每个块的句子编码并存入旁路存储（不进入向量库metadata），压缩时按句子向量打分（关闭或旧数据使用词重叠打分）
+    CONTEXT_SENTENCE_VECTORS = os.getenv('CONTEXT_SENTENCE_VECTORS', 'true').lower() == 'true'
+    SENTENCE_VECTOR_DIR = os.getenv('SENTENCE_VECTOR_DIR', './data/sentence_vectors')
+    
+    # 检索结果缓存（集合写入后自动失效）
+    RETRIEVAL_CACHE_ENABLED = os.getenv('RETRIEVAL_CACHE_ENABLED', 'true').lower() == 'true'
+    RETRIEVAL_CACHE_SIZE = int(os.getenv('RETRIEVAL_CACHE_SIZE', '1024'))
+    RETRIEVAL_CACHE_TTL = float(os.getenv('RETRIEVAL_CACHE_TTL', '600'))
+    # 集合版本文件目录：任何进程写入集合后递增版本号，检索缓存、BM25索引和本地向量库据此刷新
+    COLLECTION_VERSION_DIR = os.getenv('COLLECTION_VERSION_DIR', './data/collection_versions')
+    COLLECTION_VERSION_CHECK_INTERVAL = float(os.getenv('COLLECTION_VERSION_CHECK_INTERVAL', '1.0'))  # 秒，Milvus实体数检查间隔
+    # 异步工作流中检索（嵌入、向量搜索、重排序）使用的线程数上限
+    RETRIEVAL_WORKERS = int(os.getenv('RETRIEVAL_WORKERS', '4'))
+    
+    # BM25关键词索引与混合召回（RRF融合）
+    LEXICAL_INDEX_ENABLED = os.getenv('LEXICAL_INDEX_ENABLED', 'true').lower() == 'true'
+    LEXICAL_ONLY_ENABLED = os.getenv('LEXICAL_ONLY_ENABLED', 'true').lower() == 'true'  # 精确词命中时跳过向量检索
+    LEXICAL_ONLY_MARGIN = float(os.getenv('LEXICAL_ONLY_MARGIN', '1.5'))  # 跳过向量检索要求首条BM25得分至少为第二条的倍数
+    BM25_K1 = float(os.getenv('BM25_K1', '1.2'))
+    BM25_B = float(os.getenv('BM25_B', '0.75'))
+    RRF_K = int(os.getenv('RRF_K', '60'))
+    
+    # 向量库后端：milvus（远程Zilliz）或 local（进程内，可离线运行）
+    VECTOR_STORE_BACKEND = os.getenv('VECTOR_STORE_BACKEND', 'milvus')
+    LOCAL_STORE_DIR = os.getenv('LOCAL_STORE_DIR', './data/vector_store')
+    LOCAL_INDEX_TYPE = os.getenv('LOCAL_INDEX_TYPE', 'flat')        # flat（精确）或 hnsw（近似）
+    LOCAL_VECTOR_DTYPE = os.getenv('LOCAL_VECTOR_DTYPE', 'float32')  # float32 或 float16
+    HNSW_M = int(os.getenv('HNSW_M', '16'))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '200'))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+    
+    # 嵌入模型配置
+    EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+    EMBEDDING_MAX_LENGTH = int(os.getenv('EMBEDDING_MAX_LENGTH', '512'))
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '256'))
+    
+    # 写入前按句子边界和token预算切块
+    CHUNKING_ENABLED = os.getenv('CHUNKING_ENABLED', 'true').lower() == 'true'
+    CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '256'))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv('CHUNK_OVERLAP_TOKENS', '32'))
+    
+    # 嵌入缓存配置（模型路径变化时磁盘缓存自动失效）
+    EMBEDDING_CACHE_ENABLED = os.getenv('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true'
+    EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', './data/embedding_cache')
+    EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv('EMBEDDING_CACHE_MEMORY_SIZE', '10000'))
+    EMBEDDING_CACHE_DISK_SIZE = int(os.getenv('EMBEDDING_CACHE_DISK_SIZE', '200000'))
+    
+    # LLM推理后端：vllm（GPU）或 stub（确定性CPU桩，用于无GPU压测）
+    LLM_BACKEND = os.getenv('LLM_BACKEND', 'vllm')
+    STUB_LLM_LATENCY_MS = float(os.getenv('STUB_LLM_LATENCY_MS', '50'))        # 首token前的固定延迟
+    STUB_LLM_TOKENS_PER_SEC = float(os.getenv('STUB_LLM_TOKENS_PER_SEC', '50'))  # 模拟的生成速率
+    STUB_LLM_OUTPUT_TOKENS = int(os.getenv('STUB_LLM_OUTPUT_TOKENS', '64'))     # 每个回答模拟的token数
+    STUB_LLM_RESPONSE = os.getenv('STUB_LLM_RESPONSE', '这是模拟回答（{digest}），针对：{tail}。')  # 可用 {digest} {prompt_chars} {tail}
+    
     # vLLM配置
     MAX_MODEL_LEN = int(os.getenv('MAX_MODEL_LEN', '8192'))
     GPU_MEMORY_UTILIZATION = float(os.getenv('GPU_MEMORY_UTILIZATION', '0.7'))
+    LLM_PRELOAD = os.getenv('LLM_PRELOAD', 'true').lower() == 'true'  # 服务启动后在后台预加载LLM
+    LLM_WARMUP = os.getenv('LLM_WARMUP', 'true').lower() == 'true'    # 加载后执行一次预热生成
+    TOKEN_BUDGET_ENABLED = os.getenv('TOKEN_BUDGET_ENABLED', 'true').lower() == 'true'  # 按窗口裁剪上下文并分配max_tokens
+    PROMPT_SAFETY_MARGIN = int(os.getenv('PROMPT_SAFETY_MARGIN', '32'))
+    MIN_OUTPUT_TOKENS = int(os.getenv('MIN_OUTPUT_TOKENS', '32'))
+    ENABLE_PREFIX_CACHING = os.getenv('ENABLE_PREFIX_CACHING', 'true').lower() == 'true'  # 自动前缀缓存，复用共享提示词的KV
+    
+    # 生成请求动态批处理：时间窗口内到达的请求合并后一起送入vLLM异步引擎
+    LLM_BATCHING_ENABLED = os.getenv('LLM_BATCHING_ENABLED', 'true').lower() == 'true'
+    LLM_MAX_BATCH_SIZE = int(os.getenv('LLM_MAX_BATCH_SIZE', '16'))
+    LLM_BATCH_WAIT_MS = float(os.getenv('LLM_BATCH_WAIT_MS', '10'))
+    
+    # LLM响应缓存（SQLite，键为模型路径+提示词+采样参数）
+    RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+    RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', './data/response_cache.sqlite3')
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))
+    RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '86400'))
+
+    # 工作流：协调员同时派发业务专家和技术专家并行执行，结果合并后交给项目经理
+    WORKFLOW_PARALLEL_EXPERTS = os.getenv('WORKFLOW_PARALLEL_EXPERTS', 'true').lower() == 'true'
+    # 协调员路由：任务向量与各专家示例任务的原型向量比较，置信度不足时回退关键词规则
+    ROUTER_ENABLED = os.getenv('ROUTER_ENABLED', 'true').lower() == 'true'
+    ROUTER_MIN_CONFIDENCE = float(os.getenv('ROUTER_MIN_CONFIDENCE', '0.5'))
+    # 协调员的叙述性分析：inline（先生成分析再路由）/ background（与专家并行生成）/ off（不生成）
+    COORDINATOR_ANALYSIS = os.getenv('COORDINATOR_ANALYSIS', 'background')
+    # 工作流检查点：每步完成后写入SQLite，失败或进程重启后按线程ID续跑，已完成的节点不再执行
+    WORKFLOW_CHECKPOINT_ENABLED = os.getenv('WORKFLOW_CHECKPOINT_ENABLED', 'true').lower() == 'true'
+    WORKFLOW_CHECKPOINT_PATH = os.getenv('WORKFLOW_CHECKPOINT_PATH', './data/workflow_checkpoints.sqlite3')
+    WORKFLOW_CHECKPOINT_TTL = float(os.getenv('WORKFLOW_CHECKPOINT_TTL', '86400'))          # 秒
+    WORKFLOW_CHECKPOINT_MAX_THREADS = int(os.getenv('WORKFLOW_CHECKPOINT_MAX_THREADS', '1000'))
+    WORKFLOW_CHECKPOINT_GC_INTERVAL = float(os.getenv('WORKFLOW_CHECKPOINT_GC_INTERVAL', '300'))
+    # 延迟追踪：检索、重排、生成及各工作流节点记录耗时/批大小/token数并写入Prometheus直方图（/metrics）；
+    # 关闭时单个请求仍可通过 include_timings 强制记录
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+    # 任务队列：POST /api/task 立即返回任务ID，由有界工作池执行，GET /api/task/{id} 查询状态与结果
+    # JOB_BROKER=memory（单进程）/ sqlite（多个工作进程共享同一个数据库文件）；JOB_WORKERS=0 时本进程只接收任务
+    JOB_BROKER = os.getenv('JOB_BROKER', 'memory')
+    JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', './data/job_queue.sqlite3')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+    JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '1000'))              # 排队任务上限，超过时拒绝提交
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.5'))         # 秒
+    JOB_LEASE_TIMEOUT = float(os.getenv('JOB_LEASE_TIMEOUT', '600'))         # 秒，超过未心跳的任务视为工作进程失联
+    JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '2'))
+    JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '86400'))             # 秒，已结束任务的保留时间
 
 config = Config()
\ No newline at end of file
@@ -1,6 +1,6 @@
 # init_demo_data.py
 from config import Config
-from rag.vector_store import MilvusVectorStore
+from rag.vector_store import create_vector_store
 import time
 
 def initialize_demo_data():
@@ -27,13 +27,11 @@ def initialize_demo_data():
     
     print("📋 演示文档准备完成")
     
-    vector_store = MilvusVectorStore(config)
+    vector_store = create_vector_store(config)
     
     try:
         # 检查当前集合状态
-        from pymilvus import utility
-        collections = utility.list_collections()
-        print(f"📊 现有集合: {collections}")
+        print(f"📊 当前集合: {vector_store.get_collection_info()}")
         
         # 创建集合（会自动检测维度）
         print("🔄 创建集合...")
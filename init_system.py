@@ -1,6 +1,6 @@
 # init_system.py
 from config import Config
-from rag.vector_store import MilvusVectorStore
+from rag.vector_store import create_vector_store
 import os
 
 def initialize_system():
@@ -8,11 +8,10 @@ def initialize_system():
     config = Config()
 
     print("🚀 开始初始化系统...")
-    vector_store = MilvusVectorStore(config)
+    vector_store = create_vector_store(config)
     
     # 检查集合是否存在，如果不存在则创建
-    from pymilvus import utility
-    if not utility.has_collection(config.COLLECTION_NAME):
+    if not vector_store.has_collection():
         print("📁 创建向量集合...")
         vector_store.create_collection()
     else:
@@ -46,7 +45,7 @@ def initialize_system():
 def check_data():
     """检查数据是否已存在"""
     config = Config()
-    vector_store = MilvusVectorStore(config)
+    vector_store = create_vector_store(config)
     
     try:
         # 尝试搜索测试数据
@@ -6,9 +6,20 @@ User:       zhl
 Details:       
 """
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import Optional
 from workflow.orchestrator import WorkflowOrchestrator
+from agents.llm_wrapper import get_llm, is_llm_loaded, preload_llm
+from agents.token_budget import peek_token_budget
+from model_registry import get_model_registry
+from services.job_queue import COMPLETED, JobQueueFull, JobWorkerPool, create_job_broker, default_worker_id
+from tracing import render_metrics, start_trace
 from config import Config
+import asyncio
+import threading
+import json
+import sys
 import uvicorn
 
 app = FastAPI(title="多Agent协同任务系统", version="1.0.0")
@@ -17,44 +28,204 @@ app = FastAPI(title="多Agent协同任务系统", version="1.0.0")
 class TaskRequest(BaseModel):
     task: str
     user_id: str = "default"
+    # 工作流检查点线程ID，传入中断运行的ID可从中断处续跑；提交任务时默认使用任务ID
+    thread_id: Optional[str] = None
+    # 返回本次请求的分阶段耗时明细（未开启全局追踪时也会记录本次请求）
+    include_timings: bool = False
 
 
 class TaskResponse(BaseModel):
     task_id: str
+    # queued / running / completed / failed；运行中 results 为已完成Agent的部分结果
     status: str
-    results: dict
-    final_output: str
+    results: dict = {}
+    final_output: str = ""
+    timings: Optional[dict] = None
+    error: Optional[str] = None
 
 
 # 全局实例
 config = Config()
 orchestrator = WorkflowOrchestrator(config)
+job_broker = create_job_broker(config)
+_quick_service = None
+_quick_service_lock = threading.Lock()
+
+
+def get_quick_service():
+    """快速响应服务首次使用时才初始化（会加载BGE检索器）"""
+    global _quick_service
+    with _quick_service_lock:
+        if _quick_service is None:
+            from services.quick_response import QuickResponseService
+            _quick_service = QuickResponseService(config)
+        return _quick_service
+
+
+def format_sse(event: dict) -> str:
+    """格式化为Server-Sent Events消息"""
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def run_task_job(job_id: str, payload: dict, report_progress) -> dict:
+    """执行一个已提交的任务：运行工作流，每完成一批Agent上报部分结果"""
+    include_timings = payload.get("include_timings", False)
+    with start_trace("api.task", force=include_timings) as trace:
+        result = await orchestrator.execute_workflow_async(
+            payload["task"],
+            thread_id=payload.get("thread_id") or job_id,
+            on_progress=report_progress
+        )
+
+        # 生成最终输出
+        final_output = await generate_final_output(result)
+
+    job_result = {"results": result["results"], "final_output": final_output}
+    if include_timings and trace.recording:
+        job_result["timings"] = {"trace": trace.to_dict(), "summary": trace.summary()}
+    return job_result
+
+
+job_pool = JobWorkerPool.from_config(job_broker, run_task_job, config)
+
+
+@app.on_event("startup")
+async def preload_models():
+    """后台预加载LLM，服务先启动、首个请求无需等待整个加载过程"""
+    if config.LLM_PRELOAD:
+        preload_llm(background=True)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_pool.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_pool.stop()
 
 
 @app.post("/api/task", response_model=TaskResponse)
 async def create_task(request: TaskRequest):
-    """创建并执行新任务"""
+    """提交任务：立即返回任务ID，由工作池执行，通过 GET /api/task/{task_id} 查询"""
+    payload = {
+        "task": request.task,
+        "user_id": request.user_id,
+        "thread_id": request.thread_id,
+        "include_timings": request.include_timings
+    }
     try:
-        result = orchestrator.execute_workflow(request.task)
+        job_id = await asyncio.to_thread(job_broker.submit, payload, config.JOB_MAX_PENDING)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    job_pool.notify()
+    return TaskResponse(task_id=job_id, status="queued")
 
-        # 生成最终输出
-        final_output = await generate_final_output(result)
 
+@app.get("/api/task/{task_id}", response_model=TaskResponse)
+async def get_task(task_id: str):
+    """查询任务状态：运行中返回已完成Agent的部分结果，完成后返回最终结果"""
+    job = await asyncio.to_thread(job_broker.get, task_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {task_id}")
+    if job["status"] == COMPLETED:
+        result = job["result"]
         return TaskResponse(
-            task_id=f"task_{hash(request.task)}",
-            status="completed",
+            task_id=task_id,
+            status=job["status"],
             results=result["results"],
-            final_output=final_output
+            final_output=result["final_output"],
+            timings=result.get("timings")
         )
+    return TaskResponse(task_id=task_id, status=job["status"], results=job["partial"] or {}, error=job["error"])
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/task/stream")
+async def stream_task(request: TaskRequest):
+    """流式执行任务（SSE）：按Agent逐段推送生成的文本
+    
+    本次运行登记为任务队列中的运行中任务，返回的task_id可通过 GET /api/task/{task_id} 查询
+    """
+    worker_id = f"{default_worker_id()}/stream"
+    payload = {"task": request.task, "user_id": request.user_id, "stream": True}
+    job_id = await asyncio.to_thread(job_broker.submit_running, payload, worker_id)
+
+    async def report_progress(partial: dict):
+        await asyncio.to_thread(job_broker.update_partial, job_id, worker_id, partial)
+
+    async def event_source():
+        finished = False
+        heartbeat = job_pool.track(job_id, worker_id)
+        try:
+            yield format_sse({"event": "task", "task_id": job_id})
+            async for event in orchestrator.astream_workflow(request.task, on_progress=report_progress):
+                if event["event"] == "done":
+                    event["task_id"] = job_id
+                    event["final_output"] = await generate_final_output(event)
+                    await asyncio.to_thread(job_broker.complete, job_id, worker_id,
+                                            {"results": event["results"], "final_output": event["final_output"]})
+                    finished = True
+                yield format_sse(event)
+        except Exception as e:
+            await asyncio.to_thread(job_broker.fail, job_id, worker_id, str(e))
+            finished = True
+            yield format_sse({"event": "error", "task_id": job_id, "detail": str(e)})
+        finally:
+            heartbeat.cancel()
+            if not finished:
+                # 客户端断开时流式运行随之取消
+                await asyncio.to_thread(job_broker.fail, job_id, worker_id, "客户端断开连接，运行已取消")
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/api/quick/stream")
+async def stream_quick_response(request: TaskRequest):
+    """流式快速问答（SSE）：先推送检索来源，再推送回答文本"""
+    async def event_source():
+        try:
+            service = await asyncio.to_thread(get_quick_service)
+            async for event in service.stream_quick_response(request.task):
+                yield format_sse(event)
+        except Exception as e:
+            yield format_sse({"event": "error", "detail": str(e)})
+
+    return StreamingResponse(event_source(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 
 @app.get("/api/health")
 async def health_check():
     """健康检查"""
-    return {"status": "healthy", "service": "multi-agent-system"}
+    return {"status": "healthy", "service": "multi-agent-system", "llm_loaded": is_llm_loaded()}
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """运行时统计：LLM批处理队列、缓存命中率、提示词预算、工作流检查点、模型显存占用与任务队列"""
+    budget = peek_token_budget()
+    return {
+        "llm": get_llm().get_stats() if is_llm_loaded() else {},
+        "token_budget": budget.get_stats() if budget is not None else {},
+        "checkpoints": orchestrator.checkpointer.get_stats() if orchestrator.checkpointer is not None else {},
+        "models": get_model_registry().get_stats(),
+        "jobs": dict(job_broker.get_stats(), pool=job_pool.get_stats())
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus指标：各阶段耗时、批大小与token数直方图（需开启TRACING_ENABLED）"""
+    rendered = render_metrics()
+    if rendered is None:
+        return PlainTextResponse("prometheus_client 未安装", status_code=503)
+    content, content_type = rendered
+    return Response(content=content, media_type=content_type)
 
 
 async def generate_final_output(result: dict) -> str:
@@ -62,7 +233,7 @@ async def generate_final_output(result: dict) -> str:
     results = result["results"]
     output_parts = []
 
-    if "coordinator" in results:
+    if results.get("coordinator", {}).get("analysis"):
         output_parts.append(f"## 任务分析\n{results['coordinator']['analysis']}")
 
     if "business_expert" in results:
@@ -77,5 +248,19 @@ async def generate_final_output(result: dict) -> str:
     return "\n\n".join(output_parts)
 
 
+async def run_worker():
+    """独立工作进程：只执行任务，不提供HTTP接口（需 JOB_BROKER=sqlite 与API进程共享队列）"""
+    if config.JOB_BROKER != "sqlite":
+        print("⚠️ 进程内任务队列无法与API进程共享，独立工作进程请设置 JOB_BROKER=sqlite")
+    job_pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await job_pool.stop()
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if sys.argv[1:] == ["worker"]:
+        asyncio.run(run_worker())
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,138 @@
+# model_registry.py
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+
+def _module_bytes(obj) -> int:
+    """torch模块的参数与缓冲区字节数，非torch模块返回0"""
+    parameters = getattr(obj, 'parameters', None)
+    buffers = getattr(obj, 'buffers', None)
+    if not callable(parameters) or not callable(buffers):
+        return 0
+    try:
+        return sum(t.numel() * t.element_size() for t in list(parameters()) + list(buffers()))
+    except Exception:
+        return 0
+
+
+def estimate_model_bytes(model) -> int:
+    """估算模型占用：依次查看对象本身、元组元素以及 .model 属性链（封装类常把模型放在model属性上）"""
+    seen = set()
+    stack = list(model) if isinstance(model, tuple) else [model]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if obj is None or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size = _module_bytes(obj)
+        if size:
+            total += size
+        else:
+            stack.append(getattr(obj, 'model', None))
+    return total
+
+
+def _gpu_allocated() -> int:
+    # 只在torch已被导入时查询，避免注册表本身触发torch导入
+    torch = sys.modules.get('torch')
+    try:
+        return torch.cuda.memory_allocated() if torch is not None and torch.cuda.is_available() else 0
+    except Exception:
+        return 0
+
+
+class ModelHandle:
+    __slots__ = ('key', 'model', 'lookups', 'memory_bytes', 'load_seconds', 'loaded_at')
+
+    def __init__(self, key: Tuple, model, memory_bytes: int, load_seconds: float):
+        self.key = key
+        self.model = model
+        self.lookups = 1  # get_or_load返回该实例的次数，仅用于统计
+        self.memory_bytes = memory_bytes
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+
+
+class ModelRegistry:
+    """进程内共享实例注册表：同一 (类型, 路径, dtype, device) 只加载一份，各服务共享
+
+    除模型外，向量库（连同其BM25索引和本地向量矩阵）也经此共享。get_or_load 在首次
+    请求时调用loader加载，同一个键的并发首次请求等待同一次加载；共享实例随进程存活，
+    不做卸载（各服务没有独立的生命周期）。
+    """
+
+    def __init__(self):
+        self._handles: Dict[Tuple, ModelHandle] = {}
+        self._load_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(kind: str, model_path: str, dtype: str = 'float16', device: str = 'auto') -> Tuple:
+        # 本地路径统一为绝对路径；URI、模型仓库名等原样使用
+        if model_path and os.path.exists(model_path):
+            model_path = os.path.abspath(model_path)
+        return (kind, model_path or '', dtype, device)
+
+    def get_or_load(self, kind: str, model_path: str, loader: Callable[[], Any],
+                    dtype: str = 'float16', device: str = 'auto',
+                    estimate: Callable[[Any], int] = None):
+        """返回共享实例，不存在时用loader加载；加载失败时异常原样抛出，由调用方回退
+
+        estimate 用于估算非模型实例的内存占用（如向量库，其loader内部加载的模型已单独登记）。
+        """
+        key = self.make_key(kind, model_path, dtype, device)
+        with self._lock:
+            handle = self._handles.get(key)
+            if handle is not None:
+                handle.lookups += 1
+                return handle.model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                handle = self._handles.get(key)
+                if handle is not None:
+                    handle.lookups += 1
+                    return handle.model
+            start = time.time()
+            gpu_before = _gpu_allocated()
+            model = loader()
+            if estimate is not None:
+                memory_bytes = estimate(model)
+            else:
+                # 能直接统计参数时以参数为准，否则（如vLLM引擎）取加载前后的显存差
+                memory_bytes = estimate_model_bytes(model) or max(_gpu_allocated() - gpu_before, 0)
+            handle = ModelHandle(key, model, memory_bytes, time.time() - start)
+            with self._lock:
+                self._handles[key] = handle
+        print(f"📦 已注册共享实例: {kind} ({model_path})，约 {memory_bytes / 2**20:.0f} MB，"
+              f"加载耗时 {handle.load_seconds:.1f}s")
+        return model
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            handles = list(self._handles.values())
+        models = [{
+            'kind': h.key[0],
+            'model_path': h.key[1],
+            'dtype': h.key[2],
+            'device': h.key[3],
+            'lookups': h.lookups,
+            'memory_mb': h.memory_bytes / 2**20,
+            'load_seconds': h.load_seconds
+        } for h in handles]
+        return {
+            'models': models,
+            'total_memory_mb': sum(m['memory_mb'] for m in models)
+        }
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    return _registry
@@ -0,0 +1,138 @@
+# rag/chunker.py
+import hashlib
+import re
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+# 句子：到中英文句末标点（含紧随的引号/括号）、英文句点+空白或换行为止
+_SENTENCE_PATTERN = re.compile(
+    r'[^。！？!?；;\n]+?(?:[。！？!?；;]+[”’」』）)"\']*|\.(?=\s)|\n+|$)|[。！？!?；;\n]+',
+    re.S
+)
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """按句子边界切分，返回每个句子在原文中的 (start, end) 偏移"""
+    spans = []
+    for match in _SENTENCE_PATTERN.finditer(text):
+        start, end = match.span()
+        if text[start:end].strip():
+            spans.append((start, end))
+    return spans
+
+
+class TokenChunker:
+    """按token预算切分文档：优先在句子边界切分，相邻块之间保留重叠
+
+    token数由嵌入模型的tokenizer计算，保证每块都在嵌入模型的截断长度之内。
+    超出预算的单个长句按token窗口硬切。
+    """
+
+    def __init__(self, tokenizer, chunk_tokens: int = 256, overlap_tokens: int = 32):
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens必须小于chunk_tokens")
+        self.tokenizer = tokenizer
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _count_tokens(self, texts: List[str]) -> List[int]:
+        encoded = self.tokenizer(texts, add_special_tokens=False)
+        return [len(ids) for ids in encoded['input_ids']]
+
+    def _split_long_sentence(self, text: str, start: int, end: int) -> List[Tuple[int, int, int]]:
+        """把超长句子按token窗口切开，返回 (start, end, token数)"""
+        sentence = text[start:end]
+        step = self.chunk_tokens - self.overlap_tokens
+        try:
+            offsets = self.tokenizer(
+                sentence, add_special_tokens=False, return_offsets_mapping=True
+            )['offset_mapping']
+        except Exception:
+            # 慢速tokenizer不支持offset，按字符比例近似切分
+            total = self._count_tokens([sentence])[0]
+            chars_per_token = max(len(sentence) / max(total, 1), 1e-6)
+            offsets = [(int(i * chars_per_token), int((i + 1) * chars_per_token)) for i in range(total)]
+
+        pieces = []
+        for token_start in range(0, len(offsets), step):
+            window = offsets[token_start:token_start + self.chunk_tokens]
+            piece_start = start + window[0][0]
+            piece_end = start + window[-1][1] if token_start + self.chunk_tokens < len(offsets) else end
+            pieces.append((piece_start, piece_end, len(window)))
+            if token_start + self.chunk_tokens >= len(offsets):
+                break
+        return pieces
+
+    def chunk(self, text: str, metadata: Dict = None) -> List[Tuple[str, Dict]]:
+        """切分单个文档，返回 [(chunk_text, chunk_metadata)]"""
+        metadata = dict(metadata or {})
+        parent_id = str(metadata.get('doc_id') or hashlib.sha1(text.encode('utf-8')).hexdigest()[:16])
+
+        spans = split_sentences(text)
+        if not spans:
+            return []
+        counts = self._count_tokens([text[s:e] for s, e in spans])
+
+        # 展开为不超过预算的句子单元
+        units = []
+        for (start, end), count in zip(spans, counts):
+            if count > self.chunk_tokens:
+                units.extend(self._split_long_sentence(text, start, end))
+            else:
+                units.append((start, end, count))
+
+        # 贪心装箱，新块开头回带上一块末尾不超过overlap预算的句子
+        windows = []
+        current = []
+        current_tokens = 0
+        for unit in units:
+            if current and current_tokens + unit[2] > self.chunk_tokens:
+                windows.append(current)
+                overlap = []
+                overlap_tokens = 0
+                for prev in reversed(current):
+                    if overlap_tokens + prev[2] > self.overlap_tokens or overlap_tokens + prev[2] + unit[2] > self.chunk_tokens:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_tokens += prev[2]
+                current, current_tokens = overlap, overlap_tokens
+            current.append(unit)
+            current_tokens += unit[2]
+        if current:
+            windows.append(current)
+
+        chunks = []
+        for index, window in enumerate(windows):
+            start, end = window[0][0], window[-1][1]
+            # 去掉首尾空白，偏移随之调整，保证 text[start:end] 就是块内容
+            while start < end and text[start].isspace():
+                start += 1
+            while end > start and text[end - 1].isspace():
+                end -= 1
+            chunk_metadata = dict(metadata)
+            chunk_metadata.update({
+                'parent_id': parent_id,
+                'chunk_index': index,
+                'num_chunks': len(windows),
+                'start_offset': start,
+                'end_offset': end,
+                'num_tokens': sum(unit[2] for unit in window)
+            })
+            chunks.append((text[start:end], chunk_metadata))
+        return chunks
+
+    def chunk_records(self, records: Iterable[Tuple[str, Dict]]) -> Iterator[Tuple[str, Dict]]:
+        """流式切分 (text, metadata) 记录"""
+        for text, metadata in records:
+            yield from self.chunk(text, metadata)
+
+
+def maybe_chunk_records(records: Iterable[Tuple[str, Dict]], embedding_model, config) -> Iterable[Tuple[str, Dict]]:
+    """按配置在写入前切分文档，未启用时原样返回"""
+    if not config.CHUNKING_ENABLED:
+        return records
+    chunker = TokenChunker(
+        embedding_model.tokenizer,
+        chunk_tokens=min(config.CHUNK_TOKENS, config.EMBEDDING_MAX_LENGTH),
+        overlap_tokens=config.CHUNK_OVERLAP_TOKENS
+    )
+    return chunker.chunk_records(records)
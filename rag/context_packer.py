@@ -0,0 +1,181 @@
+# rag/context_packer.py
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from rag.chunker import split_sentences
+from rag.lexical_index import tokenize
+
+# 句子过多的文档（未切块的长文档）不存句子向量
+MAX_STORED_SENTENCES = 32
+
+
+def content_sentences(content: str) -> List[str]:
+    """切分句子并去掉空句，写入与压缩时使用同一切分，保证句子向量按位置对应"""
+    sentences = []
+    for start, end in split_sentences(content):
+        sentence = content[start:end].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def encode_with_sentence_vectors(embedding_model, texts: List[str], sentence_vectors) -> np.ndarray:
+    """写入时块与其句子在同一次编码中完成，句子向量存入旁路存储，返回块向量
+
+    编码失败时退回只编码块（与原写入路径一致），本批不存句子向量，压缩时使用词重叠打分。
+    """
+    sentence_lists = [content_sentences(text) for text in texts]
+    sentence_lists = [sentences if len(sentences) <= MAX_STORED_SENTENCES else [] for sentences in sentence_lists]
+    flat = [sentence for sentences in sentence_lists for sentence in sentences]
+    if not flat:
+        return embedding_model.encode(texts)
+    try:
+        vectors = np.asarray(embedding_model.encode(list(texts) + flat, raise_errors=True), dtype=np.float32)
+    except Exception as e:
+        print(f"⚠️ 句子向量编码失败，本批文档不存句子向量: {e}")
+        return embedding_model.encode(texts)
+
+    items, offset = [], len(texts)
+    for text, sentences in zip(texts, sentence_lists):
+        if sentences:
+            items.append((text, vectors[offset:offset + len(sentences)]))
+            offset += len(sentences)
+    try:
+        sentence_vectors.put_many(items)
+    except Exception as e:
+        print(f"⚠️ 写入句子向量失败: {e}")
+    return vectors[:len(texts)]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """按查询压缩RAG上下文：去掉近重复块，按与任务的相似度挑选句子，装入token预算
+
+    句子向量在写入时存入旁路存储（SentenceVectorStore），请求路径上只编码查询
+    （检索时已编码过，通常命中嵌入缓存）。任一候选块没有存储的句子向量或查询编码失败时，改用词重叠打分。
+    """
+
+    def __init__(self, count_tokens: Callable[[str], int], embedding_model=None, sentence_vectors=None,
+                 dedup_threshold: float = 0.8):
+        self.count_tokens = count_tokens
+        self.embedding_model = embedding_model
+        self.sentence_vectors = sentence_vectors
+        self.dedup_threshold = dedup_threshold
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'tokens_before': 0, 'tokens_after': 0, 'duplicates_removed': 0,
+                      'vector_scored': 0}
+
+    def _deduplicate(self, rag_results: List[Dict]) -> List[Dict]:
+        """按检索排名保留，与已保留块的词集合Jaccard相似度超过阈值的视为近重复"""
+        kept, kept_tokens = [], []
+        for result in rag_results:
+            tokens = set(tokenize(result['content']))
+            if any(_jaccard(tokens, other) >= self.dedup_threshold for other in kept_tokens):
+                continue
+            kept.append(result)
+            kept_tokens.append(tokens)
+        return kept
+
+    def _stored_vectors(self, documents: List[Dict], sentence_counts: List[int]) -> Optional[np.ndarray]:
+        """所有候选块都有与句子数一致的存储向量时，按句子顺序拼接返回"""
+        if self.sentence_vectors is None or self.embedding_model is None:
+            return None
+        try:
+            stored = self.sentence_vectors.get_many([document['content'] for document in documents])
+        except Exception as e:
+            print(f"⚠️ 读取句子向量失败: {e}")
+            return None
+        if any(vectors is None or len(vectors) != count for vectors, count in zip(stored, sentence_counts)):
+            return None
+        return np.concatenate(stored) if stored else None
+
+    def _score_sentences(self, query: str, sentences: List[str],
+                         stored_vectors: Optional[np.ndarray]) -> np.ndarray:
+        if stored_vectors is not None:
+            try:
+                query_vector = np.asarray(self.embedding_model.encode([query], raise_errors=True)[0], dtype=np.float32)
+                scores = _normalize(stored_vectors) @ _normalize(query_vector)
+                with self._lock:
+                    self.stats['vector_scored'] += 1
+                return scores
+            except Exception as e:
+                print(f"⚠️ 查询编码失败，改用词重叠打分: {e}")
+        query_tokens = set(tokenize(query))
+        return np.array([
+            len(query_tokens & set(tokenize(sentence))) / (len(query_tokens) or 1)
+            for sentence in sentences
+        ], dtype=np.float32)
+
+    def pack(self, query: str, rag_results: List[Dict], max_tokens: int) -> Dict:
+        """返回 {'results': 压缩后的检索结果（结构不变，content为入选句子）, 'report': 统计}"""
+        tokens_before = sum(self.count_tokens(result['content']) for result in rag_results)
+        deduped = self._deduplicate(rag_results)
+
+        # 句子单元：(文档序号, 句子序号, 文本)
+        units = []
+        documents, sentence_counts = [], []
+        for doc_index, result in enumerate(deduped):
+            sentences = content_sentences(result['content'])
+            units.extend((doc_index, sentence_index, sentence) for sentence_index, sentence in enumerate(sentences))
+            if sentences:
+                documents.append(result)
+                sentence_counts.append(len(sentences))
+
+        selected = set()
+        tokens_after = 0
+        if units:
+            scores = self._score_sentences(query, [unit[2] for unit in units],
+                                           self._stored_vectors(documents, sentence_counts))
+            for position in np.argsort(-scores, kind='stable'):
+                cost = self.count_tokens(units[position][2])
+                if tokens_after + cost > max_tokens:
+                    continue
+                selected.add(int(position))
+                tokens_after += cost
+
+        # 入选句子按原文顺序拼回各自文档，保持可读性和提示词的确定性
+        sentences_by_doc = {}
+        for position in sorted(selected):
+            doc_index, _, sentence = units[position]
+            sentences_by_doc.setdefault(doc_index, []).append(sentence)
+        packed = []
+        for doc_index, result in enumerate(deduped):
+            if doc_index in sentences_by_doc:
+                packed_result = dict(result)
+                packed_result['content'] = ''.join(sentences_by_doc[doc_index])
+                packed.append(packed_result)
+
+        report = {
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'tokens_saved': max(tokens_before - tokens_after, 0),
+            'duplicates_removed': len(rag_results) - len(deduped),
+            'sentences_total': len(units),
+            'sentences_kept': len(selected)
+        }
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['tokens_before'] += tokens_before
+            self.stats['tokens_after'] += tokens_after
+            self.stats['duplicates_removed'] += report['duplicates_removed']
+        return {'results': packed, 'report': report}
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats['tokens_saved'] = stats['tokens_before'] - stats['tokens_after']
+        stats['saved_ratio'] = stats['tokens_saved'] / stats['tokens_before'] if stats['tokens_before'] else 0.0
+        return stats
@@ -0,0 +1,169 @@
+# rag/cross_encoder.py
+import torch
+from typing import Dict, List, Tuple
+
+from model_registry import get_model_registry
+from tracing import current_span, traced
+
+
+def ensure_pad_token(tokenizer, model=None) -> bool:
+    """确保tokenizer有可用的pad_token，并同步到模型配置
+
+    Qwen等decoder结构的分类模型在batch>1时依赖 model.config.pad_token_id
+    定位每条序列的最后一个有效token。返回是否新增了token（需要resize词表）。
+    """
+    added = False
+    if tokenizer.pad_token is None:
+        if getattr(tokenizer, 'eos_token', None) is not None:
+            tokenizer.pad_token = tokenizer.eos_token
+        elif getattr(tokenizer, 'unk_token', None) is not None:
+            tokenizer.pad_token = tokenizer.unk_token
+        else:
+            tokenizer.add_special_tokens({'pad_token': '[PAD]'})
+            added = True
+        print(f"✅ 设置pad_token为: {tokenizer.pad_token}")
+
+    if tokenizer.pad_token_id is None:
+        tokenizer.pad_token_id = tokenizer.eos_token_id if tokenizer.eos_token_id is not None else 0
+
+    if model is not None:
+        if added and len(tokenizer) != model.config.vocab_size:
+            print("🔄 调整模型词汇表大小...")
+            model.resize_token_embeddings(len(tokenizer))
+        if getattr(model.config, 'pad_token_id', None) is None:
+            model.config.pad_token_id = tokenizer.pad_token_id
+
+    return added
+
+
+def load_cross_encoder(model_path: str):
+    """返回进程内共享的 (tokenizer, 模型)，所有Reranker封装共用同一份权重"""
+    def _load():
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        model = AutoModelForSequenceClassification.from_pretrained(
+            model_path,
+            torch_dtype=torch.float16,
+            device_map="auto",
+            trust_remote_code=True
+        )
+        # 共享前统一修复pad_token，之后各打分引擎的修复都是空操作
+        ensure_pad_token(tokenizer, model)
+        return tokenizer, model
+    return get_model_registry().get_or_load('cross_encoder', model_path, _load)
+
+
+class CrossEncoderScorer:
+    """批量交叉编码打分引擎，供所有Reranker共用
+
+    - 先不padding地分词，按token长度排序后分批，每批只补齐到批内最长
+    - 每批带正确的attention_mask；缺失的mask/token_type_ids会被补齐
+    - 单标签输出用sigmoid，双标签输出取softmax正例概率
+    - 某一批推理失败时退化为逐条打分，单条仍失败则给默认分
+    """
+
+    def __init__(self, model, tokenizer, max_length: int = 512, batch_size: int = 16,
+                 default_score: float = 0.5):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.default_score = default_score
+        ensure_pad_token(tokenizer, model)
+
+    def rerank(self, query: str, documents: List[str]) -> List[Dict]:
+        """对文档打分并按分数降序返回 {'document', 'score', 'rank'}"""
+        if not documents:
+            return []
+        scores = self.score_pairs([(query, doc) for doc in documents])
+        results = [
+            {'document': doc, 'score': score, 'rank': i}
+            for i, (doc, score) in enumerate(zip(documents, scores))
+        ]
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results
+
+    def rerank_many(self, queries: List[str], documents_lists: List[List[str]]) -> List[List[Dict]]:
+        """多个查询的候选一起打分（跨查询按长度分批），按查询拆回各自的排序结果"""
+        pairs = [(query, doc) for query, docs in zip(queries, documents_lists) for doc in docs]
+        scores = self.score_pairs(pairs)
+
+        all_results = []
+        offset = 0
+        for docs in documents_lists:
+            results = [
+                {'document': doc, 'score': score, 'rank': i}
+                for i, (doc, score) in enumerate(zip(docs, scores[offset:offset + len(docs)]))
+            ]
+            results.sort(key=lambda x: x['score'], reverse=True)
+            all_results.append(results)
+            offset += len(docs)
+        return all_results
+
+    @traced("rerank.score_pairs")
+    def score_pairs(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """为任意 (query, document) 对打分，返回与输入顺序一致的分数列表"""
+        if not pairs:
+            return []
+
+        try:
+            encoded = self.tokenizer(
+                [query for query, _ in pairs],
+                [doc for _, doc in pairs],
+                padding=False,
+                truncation=True,
+                max_length=self.max_length
+            )
+        except Exception as e:
+            print(f"❌ 分词失败: {e}")
+            return [self.default_score] * len(pairs)
+        order = sorted(range(len(pairs)), key=lambda i: len(encoded['input_ids'][i]))
+        current_span().set(
+            pairs=len(pairs),
+            batch_size=min(self.batch_size, len(pairs)),
+            input_tokens=sum(len(ids) for ids in encoded['input_ids'])
+        )
+
+        scores = [self.default_score] * len(pairs)
+        for start in range(0, len(order), self.batch_size):
+            indices = order[start:start + self.batch_size]
+            try:
+                batch_scores = self._score_batch(encoded, indices)
+            except Exception as e:
+                print(f"⚠️ 批量打分失败，改为逐条处理: {e}")
+                batch_scores = [self._score_one(encoded, i) for i in indices]
+            for i, score in zip(indices, batch_scores):
+                scores[i] = score
+        return scores
+
+    def _score_one(self, encoded, index: int) -> float:
+        try:
+            return self._score_batch(encoded, [index])[0]
+        except Exception as e:
+            print(f"❌ 处理文档 {index} 失败: {e}")
+            return self.default_score
+
+    def _score_batch(self, encoded, indices: List[int]) -> List[float]:
+        features = {key: [encoded[key][i] for i in indices] for key in encoded.keys()}
+        inputs = self.tokenizer.pad(features, padding=True, return_tensors="pt")
+        inputs = self._fix_inputs(inputs)
+        inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+
+        with torch.inference_mode():
+            logits = self.model(**inputs).logits.float()
+        return self._logits_to_scores(logits).cpu().tolist()
+
+    def _fix_inputs(self, inputs):
+        """补齐attention_mask，仅对有token_type词表的模型补token_type_ids"""
+        inputs = dict(inputs)
+        if 'attention_mask' not in inputs:
+            inputs['attention_mask'] = (inputs['input_ids'] != self.tokenizer.pad_token_id).long()
+        if 'token_type_ids' not in inputs and getattr(self.model.config, 'type_vocab_size', 0) > 1:
+            inputs['token_type_ids'] = torch.zeros_like(inputs['input_ids'])
+        return inputs
+
+    @staticmethod
+    def _logits_to_scores(logits):
+        if logits.shape[-1] == 1:
+            return torch.sigmoid(logits.squeeze(-1))
+        return torch.softmax(logits, dim=-1)[:, 1]
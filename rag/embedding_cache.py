@@ -0,0 +1,440 @@
+# rag/embedding_cache.py
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台：不做跨进程加锁，只适合单进程使用
+    fcntl = None
+
+from tracing import current_span, traced
+
+
+class EmbeddingCache:
+    """两级嵌入缓存：内存LRU + 磁盘memmap向量文件
+
+    磁盘层由三个文件组成：
+    - vectors.f32：float32向量矩阵（np.memmap，按行存储）
+    - index.jsonl：追加写的 key -> 行号 索引
+    - meta.json：模型指纹、向量维度和当前容量
+    不同模型指纹使用不同的子目录。同一目录可被多个进程（API、Streamlit、初始化脚本）共用：
+    写入时持有 lock 文件的排他锁，先重放其他进程追加的索引再分配行；读取磁盘行时持有共享锁并
+    同样先同步索引，因此不会读到被其他进程覆盖的行。每个实例在存活期间持有 inuse 文件的共享锁，
+    旧指纹目录只在没有任何进程使用时才会被清理。
+    """
+
+    INITIAL_ROWS = 1024
+
+    def __init__(self, cache_dir: str, fingerprint: Dict, memory_size: int = 10000, max_disk_rows: int = 200000):
+        self.fingerprint = fingerprint
+        self.namespace = hashlib.sha1(
+            json.dumps(fingerprint, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+        self.cache_dir = cache_dir
+        self.namespace_dir = os.path.join(cache_dir, self.namespace)
+        self.memory_size = memory_size
+        self.max_disk_rows = max_disk_rows
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._lock_file = None
+        self._inuse_file = None
+        self._vectors = None
+        self._capacity = 0
+        self.dim = None
+        self._clear_index_state()
+
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+
+        if self.max_disk_rows > 0:
+            self._open_disk_tier()
+
+    # ---------- 磁盘层 ----------
+
+    def _open_disk_tier(self):
+        """打开当前指纹对应的磁盘缓存，并清理无人使用的旧指纹目录"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._inuse_file = self._hold_namespace()
+            self._lock_file = open(self._path('lock'), 'a+')
+            self._remove_unused_namespaces()
+
+            with self._file_lock(exclusive=True):
+                meta = self._read_meta()
+                # 没有meta时其他文件不可能有效（首次写入前先写meta）
+                if meta is None or meta.get('fingerprint') != self.fingerprint:
+                    self._reset_disk_files()
+                self._sync_disk_state()
+            print(f"✅ 加载嵌入磁盘缓存: {len(self._disk_index)} 条")
+
+        except Exception as e:
+            print(f"⚠️ 嵌入磁盘缓存不可用，仅使用内存缓存: {e}")
+            self.max_disk_rows = 0
+            self._vectors = None
+
+    def _hold_namespace(self):
+        """持有本指纹目录 inuse 文件的共享锁直到进程退出，防止目录被其他进程清理"""
+        for _ in range(3):
+            os.makedirs(self.namespace_dir, exist_ok=True)
+            inuse = open(self._path('inuse'), 'a+')
+            if fcntl is None:
+                return inuse
+            fcntl.flock(inuse, fcntl.LOCK_SH)
+            try:
+                # 加锁前目录可能恰好被清理，确认锁住的仍是当前路径上的文件
+                if os.stat(self._path('inuse')).st_ino == os.fstat(inuse.fileno()).st_ino:
+                    return inuse
+            except OSError:
+                pass
+            inuse.close()
+        raise RuntimeError("无法锁定嵌入缓存目录")
+
+    def _remove_unused_namespaces(self):
+        """删除其他指纹的目录，仅当能拿到其 inuse 文件的排他锁（即没有进程在用）时"""
+        if fcntl is None:
+            return
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name == self.namespace or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, 'inuse'), 'a+') as inuse:
+                    fcntl.flock(inuse, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    shutil.rmtree(path, ignore_errors=True)
+                print(f"🗑️ 嵌入模型配置已变化，清理旧缓存: {name}")
+            except OSError:
+                continue  # 仍有进程在使用
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool):
+        """跨进程的读写锁（调用方需已持有线程锁或处于初始化阶段）"""
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.namespace_dir, name)
+
+    def _read_meta(self) -> Optional[Dict]:
+        try:
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self):
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'fingerprint': self.fingerprint,
+                'dim': self.dim,
+                'capacity': self._capacity
+            }, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    def _clear_index_state(self):
+        self._disk_index = {}      # key -> 行号
+        self._row_keys = [None] * self._capacity  # 行号 -> key（用于环形覆盖时移除旧索引）
+        self._next_row = 0
+        self._index_lines = 0
+        self._index_offset = 0     # 已重放到的索引文件位置
+        self._index_inode = None
+
+    def _reset_disk_files(self):
+        """删除磁盘文件（需持有排他锁），其他进程下次同步时发现文件消失会清空各自的索引"""
+        for name in ('vectors.f32', 'index.jsonl', 'meta.json'):
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._vectors = None
+        self._capacity = 0
+        self._clear_index_state()
+
+    def _map_vectors(self, capacity: int):
+        if self._vectors is not None:
+            self._vectors.flush()
+            del self._vectors
+        self._vectors = np.memmap(self._path('vectors.f32'), dtype=np.float32, mode='r+',
+                                  shape=(capacity, self.dim))
+        self._row_keys.extend([None] * (capacity - self._capacity))
+        self._capacity = capacity
+
+    def _sync_disk_state(self):
+        """与磁盘文件对齐（需持有文件锁）：容量被其他进程扩大时重新映射，并重放新追加的索引"""
+        meta = self._read_meta()
+        if meta is None:
+            if self._capacity:
+                self._vectors = None
+                self._capacity = 0
+                self._clear_index_state()
+            return
+        self.dim = meta['dim']
+        if meta['capacity'] != self._capacity:
+            if meta['capacity'] < self._capacity:
+                # 文件被重置后重建，已有行号全部失效
+                self._vectors = None
+                self._capacity = 0
+                self._clear_index_state()
+            self._map_vectors(meta['capacity'])
+
+        try:
+            stat = os.stat(self._path('index.jsonl'))
+        except OSError:
+            if self._index_inode is not None:
+                self._clear_index_state()
+            return
+        if stat.st_ino != self._index_inode or stat.st_size < self._index_offset:
+            # 索引被压缩重写或重建，从头重放
+            self._clear_index_state()
+            self._index_inode = stat.st_ino
+        if stat.st_size > self._index_offset:
+            self._replay_index()
+
+    def _replay_index(self):
+        """从上次的位置继续重放追加写索引，后写入的记录覆盖先前占用同一行的记录"""
+        with open(self._path('index.jsonl'), 'rb') as f:
+            f.seek(self._index_offset)
+            data = f.read()
+        complete = data.rfind(b'\n') + 1
+        for line in data[:complete].splitlines():
+            self._index_lines += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # 忽略进程中断时写了一半的行
+            row = record['row']
+            if row >= self._capacity:
+                continue
+            old_key = self._row_keys[row]
+            if old_key is not None and self._disk_index.get(old_key) == row:
+                del self._disk_index[old_key]
+            self._row_keys[row] = record['key']
+            self._disk_index[record['key']] = row
+            self._next_row = max(self._next_row, record['seq'] + 1)
+        self._index_offset += complete
+
+    def _ensure_capacity(self, rows: int):
+        """按需倍增memmap文件容量，不超过max_disk_rows（需持有排他锁）"""
+        if rows <= self._capacity:
+            return
+        new_capacity = max(self.INITIAL_ROWS, self._capacity)
+        while new_capacity < rows:
+            new_capacity *= 2
+        new_capacity = min(new_capacity, self.max_disk_rows)
+
+        if self._vectors is not None:
+            self._vectors.flush()
+        with open(self._path('vectors.f32'), 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._map_vectors(new_capacity)
+        self._write_meta()
+
+    def _disk_put_many(self, items: List):
+        """批量写入磁盘层，满了之后按写入顺序环形覆盖最旧的行"""
+        if self.max_disk_rows <= 0 or not items:
+            return
+        with self._file_lock(exclusive=True):
+            # 先重放其他进程的写入，行号分配基于全局的写入序号
+            self._sync_disk_state()
+            if self.dim is None:
+                self.dim = int(items[0][1].shape[0])
+            lines = []
+            for key, vector in items:
+                if key in self._disk_index:
+                    continue
+                seq = self._next_row
+                row = seq % self.max_disk_rows
+                self._ensure_capacity(row + 1)
+
+                old_key = self._row_keys[row]
+                if old_key is not None:
+                    self._disk_index.pop(old_key, None)
+                    self.stats['disk_evictions'] += 1
+
+                self._vectors[row] = vector
+                self._row_keys[row] = key
+                self._disk_index[key] = row
+                self._next_row += 1
+                lines.append(json.dumps({'key': key, 'row': row, 'seq': seq}))
+
+            if lines:
+                # 先落盘向量，再追加索引，保证索引指向的行一定已写入
+                self._vectors.flush()
+                with open(self._path('index.jsonl'), 'ab') as f:
+                    f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                    self._index_offset = f.tell()
+                self._index_inode = os.stat(self._path('index.jsonl')).st_ino
+                self._index_lines += len(lines)
+                self._maybe_compact_index()
+
+    def _maybe_compact_index(self):
+        """索引文件行数远超有效条目时重写，避免无限增长（需持有排他锁）"""
+        if self._index_lines < 2 * self.max_disk_rows:
+            return
+        tmp_path = self._path('index.jsonl.tmp')
+        last_seq = self._next_row - 1
+        lines = 0
+        with open(tmp_path, 'wb') as f:
+            for row, key in enumerate(self._row_keys):
+                if key is not None:
+                    # 该行最近一次被写入时的序号
+                    seq = last_seq - (last_seq - row) % self.max_disk_rows
+                    f.write((json.dumps({'key': key, 'row': row, 'seq': seq}) + '\n').encode('utf-8'))
+                    lines += 1
+            offset = f.tell()
+        os.replace(tmp_path, self._path('index.jsonl'))
+        self._index_lines = lines
+        self._index_offset = offset
+        self._index_inode = os.stat(self._path('index.jsonl')).st_ino
+
+    # ---------- 对外接口 ----------
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        return self.get_many([key])[0]
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询；内存未命中的键在一次共享锁内同步索引后从磁盘读取"""
+        with self._lock:
+            vectors = [None] * len(keys)
+            disk_lookups = []
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    vectors[i] = vector
+                else:
+                    disk_lookups.append(i)
+
+            if disk_lookups and self.max_disk_rows > 0:
+                try:
+                    with self._file_lock(exclusive=False):
+                        self._sync_disk_state()
+                        for i in disk_lookups:
+                            row = self._disk_index.get(keys[i])
+                            if row is not None:
+                                vectors[i] = np.array(self._vectors[row])
+                except Exception as e:
+                    print(f"⚠️ 读取嵌入磁盘缓存失败: {e}")
+
+            for i in disk_lookups:
+                if vectors[i] is None:
+                    self.stats['misses'] += 1
+                else:
+                    self._memory_put(keys[i], vectors[i])
+                    self.stats['disk_hits'] += 1
+            return vectors
+
+    def put_many(self, items: List):
+        """写入 (key, vector) 列表"""
+        if not items:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(items[0][1].shape[0])
+            for key, vector in items:
+                self._memory_put(key, vector)
+            try:
+                self._disk_put_many(items)
+            except Exception as e:
+                print(f"⚠️ 写入嵌入磁盘缓存失败: {e}")
+
+    def _memory_put(self, key: str, vector: np.ndarray):
+        if self.memory_size <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self.stats['memory_evictions'] += 1
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+            stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = len(self._disk_index)
+            return stats
+
+
+class CachedEmbeddingModel:
+    """带内容寻址缓存的嵌入模型，接口与QwenEmbeddingModel一致"""
+
+    def __init__(self, model, cache_dir: str, memory_size: int = 10000, max_disk_rows: int = 200000):
+        self.model = model
+        fingerprint = {
+            'model_path': os.path.abspath(model.model_path),
+            'pooling': model.pooling,
+            'normalize': model.normalize,
+            'max_length': model.max_length
+        }
+        self.cache = EmbeddingCache(cache_dir, fingerprint, memory_size, max_disk_rows)
+
+    def __getattr__(self, name):
+        # tokenizer、batch_size等属性直接透传给底层模型
+        return getattr(self.model, name)
+
+    @staticmethod
+    def _text_key(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @traced("embedding.cached_encode")
+    def encode(self, texts: list, batch_size: int = None, raise_errors: bool = False):
+        """编码文本为向量，命中缓存的文本不再经过模型；raise_errors=True 时编码失败直接抛出"""
+        if isinstance(texts, str):
+            texts = [texts]
+
+        keys = [self._text_key(text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = OrderedDict()  # key -> 输入中的位置列表（同一次调用内去重）
+
+        for i, (key, vector) in enumerate(zip(keys, self.cache.get_many(keys))):
+            if vector is not None:
+                vectors[i] = vector
+            else:
+                missing.setdefault(key, []).append(i)
+
+        current_span().set(texts=len(texts), cache_misses=len(missing))
+        if missing:
+            miss_texts = [texts[positions[0]] for positions in missing.values()]
+            try:
+                miss_vectors = self.model._encode_batched(miss_texts, batch_size or self.model.batch_size)
+            except Exception as e:
+                if raise_errors:
+                    raise
+                print(f"❌ 编码失败: {e}")
+                # 备选随机向量不写入缓存
+                return np.random.randn(len(texts), self.cache.dim or 1024).astype(np.float32)
+
+            self.cache.put_many(list(zip(missing.keys(), miss_vectors)))
+            for positions, vector in zip(missing.values(), miss_vectors):
+                for i in positions:
+                    vectors[i] = vector
+
+        if not vectors:
+            return np.zeros((0, self.cache.dim or 1024), dtype=np.float32)
+        return np.stack(vectors).astype(np.float32, copy=False)
+
+    def get_stats(self) -> Dict:
+        return self.cache.get_stats()
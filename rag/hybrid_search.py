@@ -0,0 +1,83 @@
+# rag/hybrid_search.py
+from typing import Dict, List
+
+from rag.lexical_index import exact_terms, tokenize
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict]], k: int = 60, limit: int = None) -> List[Dict]:
+    """倒数排名融合：按content去重，分数为 Σ 1/(k + rank)，保留各路结果中的字段"""
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            key = result['content']
+            if key not in fused:
+                fused[key] = dict(result)
+                fused[key]['rrf_score'] = 0.0
+            else:
+                for field, value in result.items():
+                    fused[key].setdefault(field, value)
+            fused[key]['rrf_score'] += 1.0 / (k + rank + 1)
+
+    merged = sorted(fused.values(), key=lambda x: x['rrf_score'], reverse=True)
+    return merged[:limit] if limit else merged
+
+
+def _lexical_only_hit(query: str, lexical_results: List[Dict], margin: float) -> bool:
+    """查询包含精确词（电话、邮箱、编号），首条BM25结果全部命中且得分明显领先第二条时，无需向量检索"""
+    terms = exact_terms(query)
+    if not terms or not lexical_results:
+        return False
+    if len(lexical_results) > 1 and lexical_results[0]['bm25_score'] < margin * lexical_results[1]['bm25_score']:
+        return False
+    top_tokens = set(tokenize(lexical_results[0]['content']))
+    return all(term in top_tokens for term in terms)
+
+
+def _fuse(dense_results: List[Dict], lexical_results: List[Dict], top_k: int, rrf_k: int) -> List[Dict]:
+    fused = reciprocal_rank_fusion([dense_results, lexical_results], k=rrf_k, limit=top_k)
+    # 只由BM25召回的候选没有向量距离，取本次最差的向量距离，避免在距离加权中占便宜
+    distances = [result['distance'] for result in dense_results if 'distance' in result]
+    if distances:
+        worst = max(distances)
+        for result in fused:
+            result.setdefault('distance', worst)
+    return fused
+
+
+def hybrid_search(query: str, vector_store, top_k: int = 10) -> List[Dict]:
+    """稠密向量 + BM25 混合召回，RRF融合后返回top_k候选"""
+    lexical_index = getattr(vector_store, 'lexical_index', None)
+    if lexical_index is None:
+        return vector_store.similarity_search(query, k=top_k)
+
+    config = vector_store.config
+    lexical_results = vector_store.lexical_search(query, k=top_k)
+    if config.LEXICAL_ONLY_ENABLED and _lexical_only_hit(query, lexical_results, config.LEXICAL_ONLY_MARGIN):
+        print(f"⚡ 精确词命中BM25索引，跳过向量检索 ({len(lexical_results)} 个结果)")
+        return lexical_results
+
+    dense_results = vector_store.similarity_search(query, k=top_k)
+    return _fuse(dense_results, lexical_results, top_k, config.RRF_K)
+
+
+def hybrid_search_batch(queries: List[str], vector_store, top_k: int = 10) -> List[List[Dict]]:
+    """批量混合召回：精确词命中的查询只走BM25，其余查询一次批量向量检索"""
+    lexical_index = getattr(vector_store, 'lexical_index', None)
+    if lexical_index is None:
+        return vector_store.similarity_search_batch(queries, k=top_k)
+
+    config = vector_store.config
+    lexical_lists = [vector_store.lexical_search(query, k=top_k) for query in queries]
+    results = [None] * len(queries)
+    dense_indices = []
+    for i, (query, lexical_results) in enumerate(zip(queries, lexical_lists)):
+        if config.LEXICAL_ONLY_ENABLED and _lexical_only_hit(query, lexical_results, config.LEXICAL_ONLY_MARGIN):
+            results[i] = lexical_results
+        else:
+            dense_indices.append(i)
+
+    if dense_indices:
+        dense_lists = vector_store.similarity_search_batch([queries[i] for i in dense_indices], k=top_k)
+        for i, dense_results in zip(dense_indices, dense_lists):
+            results[i] = _fuse(dense_results, lexical_lists[i], top_k, config.RRF_K)
+    return results
@@ -0,0 +1,63 @@
+# rag/ingestion.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+
+def iter_record_batches(records: Iterable[Tuple[str, Dict]], batch_size: int) -> Iterator[Tuple[List[str], List[Dict]]]:
+    """把 (text, metadata) 记录流切分为批次，不在内存中保留整个语料"""
+    iterator = iter(records)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        metadatas = [metadata if metadata is not None else {} for _, metadata in batch]
+        yield texts, metadatas
+
+
+def pipelined_ingest(records: Iterable[Tuple[str, Dict]],
+                     encode_fn: Callable,
+                     insert_fn: Callable,
+                     batch_size: int,
+                     progress_every: int = 1) -> Dict:
+    """流水线写入：主线程编码第N+1批的同时，后台线程写入第N批
+
+    同一时刻内存中最多只有两批数据，语料规模不影响内存占用。
+    返回写入统计（文档数、批次数、耗时、吞吐）。
+    """
+    start_time = time.perf_counter()
+    stats = {'documents': 0, 'batches': 0, 'elapsed': 0.0, 'docs_per_sec': 0.0}
+
+    def _collect(future):
+        stats['documents'] += future.result()
+        stats['batches'] += 1
+        stats['elapsed'] = time.perf_counter() - start_time
+        stats['docs_per_sec'] = stats['documents'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+        if progress_every and stats['batches'] % progress_every == 0:
+            print(f"📥 已写入 {stats['documents']} 条 ({stats['batches']} 批)，"
+                  f"吞吐 {stats['docs_per_sec']:.1f} docs/s")
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest") as executor:
+        pending = None
+        try:
+            for texts, metadatas in iter_record_batches(records, batch_size):
+                embeddings = encode_fn(texts)
+                if pending is not None:
+                    _collect(pending)
+                pending = executor.submit(insert_fn, texts, embeddings, metadatas)
+            if pending is not None:
+                _collect(pending)
+                pending = None
+        finally:
+            # 出错时也要等后台写入结束，已成功写入的部分计入统计
+            if pending is not None:
+                try:
+                    _collect(pending)
+                except Exception:
+                    pass
+
+    stats['elapsed'] = time.perf_counter() - start_time
+    stats['docs_per_sec'] = stats['documents'] / stats['elapsed'] if stats['elapsed'] > 0 else 0.0
+    return stats
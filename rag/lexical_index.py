@@ -0,0 +1,135 @@
+# rag/lexical_index.py
+import math
+import re
+import threading
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 连续的字母数字串整体保留（电话、邮箱、产品编号等精确词），中文按字切分
+_TOKEN_PATTERN = re.compile(r'[a-z0-9](?:[a-z0-9@._\-]*[a-z0-9])?|[\u4e00-\u9fff]+')
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+# 需要精确匹配的词，只认明确的标识符形态（年份、普通数字、v100这类短型号不算）：
+# 邮箱；电话（7位以上连续数字或 区号-号码 形式）；字母与至少3位数字混合、长度6以上的编号
+_EXACT_TERM_PATTERN = re.compile(
+    r'^[^@\s]+@[^@\s]+\.[a-z]+$'
+    r'|^(?:\d{7,}|\d{3,4}-\d{7,8}|\d{3}-\d{4}-\d{4})$'
+    r'|^(?=(?:[^\d]*\d){3})(?=.*[a-z])[a-z0-9][a-z0-9._\-]{5,}$'
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """中文感知分词：中文输出单字+双字n-gram，英文/数字串整体输出"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group(0)
+        if _CJK_PATTERN.fullmatch(piece):
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+    return tokens
+
+
+def exact_terms(text: str) -> List[str]:
+    """提取查询中需要精确匹配的词"""
+    return [token for token in tokenize(text) if _EXACT_TERM_PATTERN.match(token)]
+
+
+class LexicalIndex:
+    """增量维护的BM25倒排索引
+
+    每个词的倒排表是两个紧凑数组：文档号 array('I') 与词频 array('H')，
+    打分时零拷贝转换为NumPy数组做向量化累加。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._vocab = {}          # term -> term_id
+        self._doc_ids = []        # term_id -> array('I')
+        self._term_freqs = []     # term_id -> array('H')
+        self._doc_lengths = array('I')
+        self._total_length = 0
+        self.contents = []
+        self.metadatas = []
+        self._lock = threading.RLock()
+
+    @property
+    def num_documents(self) -> int:
+        return len(self._doc_lengths)
+
+    def clear(self):
+        with self._lock:
+            self.__init__(self.k1, self.b)
+
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None):
+        """追加文档，文档号按写入顺序递增"""
+        if metadatas is None:
+            metadatas = [{}] * len(documents)
+        with self._lock:
+            for content, metadata in zip(documents, metadatas):
+                doc_id = len(self._doc_lengths)
+                tokens = tokenize(content)
+                for term, freq in Counter(tokens).items():
+                    term_id = self._vocab.get(term)
+                    if term_id is None:
+                        term_id = len(self._doc_ids)
+                        self._vocab[term] = term_id
+                        self._doc_ids.append(array('I'))
+                        self._term_freqs.append(array('H'))
+                    self._doc_ids[term_id].append(doc_id)
+                    self._term_freqs[term_id].append(min(freq, 65535))
+                self._doc_lengths.append(len(tokens))
+                self._total_length += len(tokens)
+                self.contents.append(content)
+                self.metadatas.append(metadata)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """BM25检索，返回 [(文档号, 分数)]，按分数降序"""
+        query_terms = Counter(tokenize(query))
+        with self._lock:
+            num_docs = len(self._doc_lengths)
+            if not query_terms or num_docs == 0:
+                return []
+
+            doc_lengths = np.frombuffer(self._doc_lengths, dtype=np.uint32).astype(np.float32)
+            avg_length = self._total_length / num_docs
+            length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / avg_length)
+
+            scores = np.zeros(num_docs, dtype=np.float32)
+            for term, query_freq in query_terms.items():
+                term_id = self._vocab.get(term)
+                if term_id is None:
+                    continue
+                ids = np.frombuffer(self._doc_ids[term_id], dtype=np.uint32)
+                tfs = np.frombuffer(self._term_freqs[term_id], dtype=np.uint16).astype(np.float32)
+                df = len(ids)
+                idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+                # 同一词在一篇文档的倒排表中只出现一次，可直接花式索引累加
+                scores[ids] += query_freq * idf * tfs * (self.k1 + 1) / (tfs + length_norm[ids])
+
+        candidates = np.flatnonzero(scores)
+        if candidates.size == 0:
+            return []
+        if candidates.size > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in candidates]
+
+    def search_documents(self, query: str, k: int = 5) -> List[Dict]:
+        """BM25检索，返回与similarity_search相同结构的结果（带bm25_score，无distance）"""
+        hits = self.search(query, k)
+        with self._lock:
+            return [
+                {
+                    'content': self.contents[doc_id],
+                    'metadata': self.metadatas[doc_id],
+                    'bm25_score': score
+                }
+                for doc_id, score in hits
+            ]
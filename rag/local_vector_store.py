@@ -0,0 +1,424 @@
+# rag/local_vector_store.py
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List
+
+import numpy as np
+from config import Config
+from rag.ingestion import pipelined_ingest
+from rag.chunker import maybe_chunk_records
+from rag.context_packer import encode_with_sentence_vectors
+from rag.sentence_vector_store import create_sentence_vector_store
+from rag.retrieval_cache import bump_collection_version, get_collection_version
+from rag.lexical_index import LexicalIndex
+from tracing import current_span, traced
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+
+class LocalCollection:
+    """进程内向量集合：连续的向量矩阵 + 文档内容/元数据
+
+    磁盘布局（每个集合一个目录）：
+    - meta.json：维度、存储精度
+    - vectors.bin：按行追加写的原始向量
+    - records.jsonl：与向量逐行对应的 content / metadata
+    - hnsw.bin：HNSW索引（仅hnsw模式）
+    """
+
+    # float16矩阵分块转换为float32后再做矩阵乘，兼顾内存占用和BLAS速度
+    SEARCH_BLOCK_ROWS = 65536
+
+    def __init__(self, path: str, dim: int, dtype: str = 'float32', index_type: str = 'flat',
+                 hnsw_m: int = 16, hnsw_ef_construction: int = 200, hnsw_ef_search: int = 64):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+
+        self.contents = []
+        self.metadatas = []
+        self._vectors = np.empty((0, dim), dtype=self.dtype)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._size = 0
+        self._hnsw = None
+        self._hnsw_dirty = False
+        self._lock = threading.RLock()
+
+        if self.index_type == 'hnsw' and hnswlib is None:
+            print("⚠️ 未安装hnswlib，本地向量库回退为精确检索模式")
+            self.index_type = 'flat'
+
+    @property
+    def num_entities(self) -> int:
+        return self._size
+
+    # ---------- 持久化 ----------
+
+    @classmethod
+    def create(cls, path: str, dim: int, **kwargs) -> "LocalCollection":
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+        collection = cls(path, dim, **kwargs)
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'dim': dim, 'dtype': collection.dtype.name}, f)
+        open(os.path.join(path, 'vectors.bin'), 'wb').close()
+        open(os.path.join(path, 'records.jsonl'), 'w', encoding='utf-8').close()
+        return collection
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "LocalCollection":
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        kwargs['dtype'] = meta['dtype']
+        collection = cls(path, meta['dim'], **kwargs)
+
+        with open(os.path.join(path, 'records.jsonl'), 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        vectors = np.fromfile(os.path.join(path, 'vectors.bin'), dtype=collection.dtype)
+        vectors = vectors.reshape(-1, collection.dim)
+
+        # 以两者中较短的为准，丢弃进程中断时未写完整的尾部记录
+        size = min(len(records), vectors.shape[0])
+        collection._append(vectors[:size],
+                           [r['content'] for r in records[:size]],
+                           [r['metadata'] for r in records[:size]])
+        collection._load_or_build_hnsw()
+        return collection
+
+    def _persist(self, vectors: np.ndarray, contents: List[str], metadatas: List[Dict]):
+        # 先写向量再写记录，load时按较短的一方对齐
+        with open(os.path.join(self.path, 'vectors.bin'), 'ab') as f:
+            f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+        with open(os.path.join(self.path, 'records.jsonl'), 'a', encoding='utf-8') as f:
+            for content, metadata in zip(contents, metadatas):
+                f.write(json.dumps({'content': content, 'metadata': metadata}, ensure_ascii=False) + '\n')
+
+    # ---------- 写入 ----------
+
+    def insert(self, vectors: np.ndarray, contents: List[str], metadatas: List[Dict]):
+        with self._lock:
+            self._persist(vectors, contents, metadatas)
+            start = self._size
+            self._append(vectors, contents, metadatas)
+            if self.index_type == 'hnsw':
+                self._hnsw_add(vectors, start)
+                self._hnsw_dirty = True
+
+    def flush(self):
+        """把HNSW索引写回磁盘；一次写入流程结束时调用一次，而不是每批重写整个索引
+
+        进程在flush前中断时，load发现索引条数与向量不一致会重新构建。
+        """
+        with self._lock:
+            if self._hnsw is not None and self._hnsw_dirty:
+                self._hnsw.save_index(os.path.join(self.path, 'hnsw.bin'))
+                self._hnsw_dirty = False
+
+    def _append(self, vectors: np.ndarray, contents: List[str], metadatas: List[Dict]):
+        """写入内存矩阵，容量不足时倍增，保持矩阵连续"""
+        count = vectors.shape[0]
+        needed = self._size + count
+        if needed > self._vectors.shape[0]:
+            capacity = max(1024, self._vectors.shape[0])
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty((capacity, self.dim), dtype=self.dtype)
+            grown[:self._size] = self._vectors[:self._size]
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown_norms[:self._size] = self._norms[:self._size]
+            self._vectors, self._norms = grown, grown_norms
+
+        stored = vectors.astype(self.dtype, copy=False)
+        self._vectors[self._size:needed] = stored
+        as_float = stored.astype(np.float32)
+        self._norms[self._size:needed] = np.einsum('ij,ij->i', as_float, as_float)
+        self.contents.extend(contents)
+        self.metadatas.extend(metadatas)
+        self._size = needed
+
+    # ---------- HNSW ----------
+
+    def _new_hnsw(self, capacity: int):
+        index = hnswlib.Index(space='l2', dim=self.dim)
+        index.init_index(max_elements=max(capacity, 1024), ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+        index.set_ef(self.hnsw_ef_search)
+        return index
+
+    def _hnsw_add(self, vectors: np.ndarray, start: int):
+        if self._hnsw is None:
+            self._hnsw = self._new_hnsw(self._vectors.shape[0])
+        if self._size > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(self._vectors.shape[0])
+        ids = np.arange(start, start + vectors.shape[0])
+        self._hnsw.add_items(vectors.astype(np.float32, copy=False), ids)
+
+    def _load_or_build_hnsw(self):
+        if self.index_type != 'hnsw':
+            return
+        index_path = os.path.join(self.path, 'hnsw.bin')
+        if os.path.exists(index_path):
+            try:
+                index = hnswlib.Index(space='l2', dim=self.dim)
+                index.load_index(index_path, max_elements=max(self._vectors.shape[0], 1024))
+                if index.get_current_count() == self._size:
+                    index.set_ef(self.hnsw_ef_search)
+                    self._hnsw = index
+                    return
+            except Exception as e:
+                print(f"⚠️ HNSW索引加载失败，将重新构建: {e}")
+        print(f"🔄 构建HNSW索引 ({self._size} 条向量)...")
+        self._hnsw = None
+        if self._size:
+            self._hnsw_add(self._vectors[:self._size], 0)
+            self._hnsw.save_index(index_path)
+
+    # ---------- 检索 ----------
+
+    def search(self, query_vectors: np.ndarray, k: int):
+        """返回每个查询的 (行号数组, 平方L2距离数组)，与Milvus L2度量一致"""
+        query_vectors = np.atleast_2d(np.asarray(query_vectors, dtype=np.float32))
+        with self._lock:
+            k = min(k, self._size)
+            if k <= 0:
+                return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+                        for _ in range(query_vectors.shape[0])]
+            if self.index_type == 'hnsw' and self._hnsw is not None:
+                self._hnsw.set_ef(max(self.hnsw_ef_search, k))
+                labels, distances = self._hnsw.knn_query(query_vectors, k=k)
+                return list(zip(labels.astype(np.int64), distances))
+            return self._exact_search(query_vectors, k)
+
+    def _exact_search(self, query_vectors: np.ndarray, k: int):
+        """精确检索：||x||² + ||q||² - 2·x·q，一次矩阵乘覆盖全部查询"""
+        matrix = self._vectors[:self._size]
+        if self.dtype == np.float32:
+            dots = matrix @ query_vectors.T
+        else:
+            dots = np.empty((self._size, query_vectors.shape[0]), dtype=np.float32)
+            for start in range(0, self._size, self.SEARCH_BLOCK_ROWS):
+                block = matrix[start:start + self.SEARCH_BLOCK_ROWS].astype(np.float32)
+                dots[start:start + block.shape[0]] = block @ query_vectors.T
+
+        query_norms = np.einsum('ij,ij->i', query_vectors, query_vectors)
+        distances = self._norms[:self._size, None] + query_norms[None, :] - 2 * dots
+        np.maximum(distances, 0, out=distances)
+
+        results = []
+        for column in range(query_vectors.shape[0]):
+            column_distances = distances[:, column]
+            if k < self._size:
+                top = np.argpartition(column_distances, k - 1)[:k]
+            else:
+                top = np.arange(self._size)
+            top = top[np.argsort(column_distances[top])]
+            results.append((top, column_distances[top]))
+        return results
+
+
+class LocalVectorStore:
+    """进程内向量库，接口与MilvusVectorStore一致，可离线运行"""
+
+    def __init__(self, config: Config):
+        # 延迟导入，避免与rag.vector_store循环引用
+        from rag.vector_store import create_embedding_model
+
+        self.config = config
+        self.embedding_model = create_embedding_model(config)
+        self.collection = None
+        self.lexical_index = LexicalIndex(config.BM25_K1, config.BM25_B) if config.LEXICAL_INDEX_ENABLED else None
+        self.collection_path = os.path.join(config.LOCAL_STORE_DIR, config.COLLECTION_NAME)
+        self.sentence_vectors = create_sentence_vector_store(config, 'local')
+        self._version = get_collection_version(config)
+        self._refresh_lock = threading.Lock()
+        self._connect()
+
+    def _collection_options(self) -> Dict:
+        return {
+            'index_type': self.config.LOCAL_INDEX_TYPE,
+            'hnsw_m': self.config.HNSW_M,
+            'hnsw_ef_construction': self.config.HNSW_EF_CONSTRUCTION,
+            'hnsw_ef_search': self.config.HNSW_EF_SEARCH
+        }
+
+    def _connect(self):
+        """加载本地集合"""
+        try:
+            if self.has_collection():
+                collection = LocalCollection.load(self.collection_path, **self._collection_options())
+                lexical_index = None
+                if self.config.LEXICAL_INDEX_ENABLED:
+                    lexical_index = LexicalIndex(self.config.BM25_K1, self.config.BM25_B)
+                    lexical_index.add_documents(collection.contents, collection.metadatas)
+                # 构建完成后整体替换，重新加载期间的检索仍使用旧数据
+                self.collection, self.lexical_index = collection, lexical_index
+                print(f"✅ 本地集合 {self.config.COLLECTION_NAME} 已加载 "
+                      f"({self.collection.num_entities} 个实体, {self.collection.index_type})")
+            else:
+                print(f"⚠️ 本地集合 {self.config.COLLECTION_NAME} 不存在，将在需要时创建")
+        except Exception as e:
+            print(f"❌ 加载本地集合失败: {e}")
+            self.collection = None
+
+    @property
+    def version(self) -> int:
+        """集合版本号，写入或重建集合后递增，用于使检索缓存失效"""
+        return self.refresh()
+
+    def refresh(self) -> int:
+        """其他进程（如init_system.py）写入集合后版本文件变化，重新从磁盘加载集合和BM25索引"""
+        version = get_collection_version(self.config)
+        if version != self._version:
+            with self._refresh_lock:
+                if version != self._version:
+                    self._version = version
+                    print("🔄 本地集合已被其他进程更新，重新加载")
+                    self._connect()
+        return version
+
+    def _mark_own_write(self):
+        """本进程写入后递增版本；期间有其他进程写入（版本号不连续）时保留旧版本，由refresh重新加载"""
+        version = bump_collection_version(self.config)
+        if version == self._version + 1:
+            self._version = version
+
+    def has_collection(self) -> bool:
+        return os.path.exists(os.path.join(self.collection_path, 'meta.json'))
+
+    def create_collection(self):
+        """创建向量集合"""
+        try:
+            test_embedding = self.embedding_model.encode(["测试文本"])
+            embedding_dim = test_embedding.shape[1]
+            print(f"📐 Qwen3-Embedding维度: {embedding_dim}")
+
+            self.collection = LocalCollection.create(
+                self.collection_path,
+                embedding_dim,
+                dtype=self.config.LOCAL_VECTOR_DTYPE,
+                **self._collection_options()
+            )
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+            if self.sentence_vectors is not None:
+                self.sentence_vectors.clear()
+            self._mark_own_write()
+            print(f"✅ 成功创建本地集合: {self.config.COLLECTION_NAME} (维度: {embedding_dim})")
+
+        except Exception as e:
+            print(f"❌ 创建集合失败: {e}")
+            raise
+
+    def add_documents(self, documents: list, metadatas: list = None):
+        """添加文档到向量库"""
+        if metadatas is None:
+            metadatas = [{}] * len(documents)
+
+        stats = self.add_documents_stream(zip(documents, metadatas))
+        return stats is not None
+
+    def add_documents_stream(self, records, batch_size: int = None):
+        """流式写入 (text, metadata) 记录（按配置先切块），返回写入统计，失败返回None"""
+        if self.collection is None:
+            print("❌ 集合未初始化，请先创建集合")
+            return None
+
+        batch_size = batch_size or self.config.INGEST_BATCH_SIZE
+        print(f"🔄 使用Qwen3-Embedding流式生成嵌入向量 (批大小: {batch_size})...")
+
+        stats = None
+        try:
+            stats = pipelined_ingest(
+                maybe_chunk_records(records, self.embedding_model, self.config),
+                encode_fn=self._encode_batch,
+                insert_fn=self._insert_batch,
+                batch_size=batch_size
+            )
+            return stats
+
+        except Exception as e:
+            print(f"❌ 插入文档失败: {e}")
+            return None
+
+        finally:
+            # 无论成功与否，已插入的数据统一持久化索引并只递增一次版本，其他进程只需重新加载一次
+            try:
+                self.collection.flush()
+                self._mark_own_write()
+                if stats is not None:
+                    print(f"✅ 成功插入 {stats['documents']} 个文档，"
+                          f"耗时 {stats['elapsed']:.2f}s，吞吐 {stats['docs_per_sec']:.1f} docs/s")
+                print(f"📈 集合现在有 {self.collection.num_entities} 个实体")
+            except Exception as e:
+                print(f"⚠️ flush失败: {e}")
+
+    def _encode_batch(self, texts: list):
+        """编码一批块；启用句子向量时句子在同一次编码中完成，写入旁路存储"""
+        if self.sentence_vectors is None:
+            return self.embedding_model.encode(texts)
+        return encode_with_sentence_vectors(self.embedding_model, texts, self.sentence_vectors)
+
+    def _insert_batch(self, documents: list, embeddings, metadatas: list) -> int:
+        self.collection.insert(embeddings, documents, metadatas)
+        if self.lexical_index is not None:
+            self.lexical_index.add_documents(documents, metadatas)
+        return len(documents)
+
+    def lexical_search(self, query: str, k: int = 5):
+        """BM25关键词检索，不需要嵌入模型"""
+        self.refresh()
+        if self.collection is None or self.lexical_index is None:
+            return []
+        return self.lexical_index.search_documents(query, k)
+
+    def similarity_search(self, query: str, k: int = 5):
+        """相似性搜索"""
+        return self.similarity_search_batch([query], k=k)[0]
+
+    @traced("vector_store.search")
+    def similarity_search_batch(self, queries: list, k: int = 5):
+        """多查询相似性搜索：一次编码全部查询，一次矩阵乘得到所有距离"""
+        current_span().set(backend="local", batch_size=len(queries), k=k)
+        self.refresh()
+        if self.collection is None:
+            print("❌ 集合未初始化")
+            return [[] for _ in queries]
+        if not queries:
+            return []
+
+        try:
+            query_embeddings = self.embedding_model.encode(list(queries))
+
+            batch_results = []
+            for indices, distances in self.collection.search(query_embeddings, k):
+                batch_results.append([
+                    {
+                        'content': self.collection.contents[idx],
+                        'metadata': self.collection.metadatas[idx],
+                        'distance': float(distance)
+                    }
+                    for idx, distance in zip(indices, distances)
+                ])
+
+            print(f"✅ 搜索完成，找到 {sum(len(r) for r in batch_results)} 个结果")
+            return batch_results
+
+        except Exception as e:
+            print(f"❌ 搜索过程中出错: {e}")
+            return [[] for _ in queries]
+
+    def get_collection_info(self):
+        """获取集合信息"""
+        if self.collection is None:
+            return "集合未初始化"
+        return (f"本地集合: {self.config.COLLECTION_NAME}, 实体数量: {self.collection.num_entities}, "
+                f"索引: {self.collection.index_type}")
@@ -0,0 +1,114 @@
+# rag/rerank_policy.py
+import threading
+from typing import Dict, List
+
+
+class RerankPlan:
+    """单个查询的重排序计划"""
+
+    __slots__ = ('action', 'head', 'rerank_indices', 'dropped')
+
+    def __init__(self, action: str, head: List[int], rerank_indices: List[int], dropped: int = 0):
+        self.action = action                  # skip / band / full
+        self.head = head                      # 无需重排、直接置顶的候选下标（按距离升序）
+        self.rerank_indices = rerank_indices  # 需要交给cross-encoder的候选下标
+        self.dropped = dropped                # 因距离过远被截掉的候选数
+
+
+class AdaptiveRerankPolicy:
+    """根据向量距离分布按查询决定重排序范围
+
+    - cut：距离比最优结果差出 cut_margin 以上的尾部候选直接丢弃
+    - head：按距离排序后，与下一名间隔 ≥ skip_margin 的连续前缀视为已确定
+    - skip：确定的前缀已覆盖 rerank_k（或只剩一个候选），完全跳过重排序
+    - band：只对确定前缀之后的模糊区间重排序
+    - full：没有明显领先者，或候选缺少向量距离（如纯BM25命中），全部重排序
+    """
+
+    def __init__(self, enabled: bool = True, skip_margin: float = 0.15, cut_margin: float = 0.5):
+        self.enabled = enabled
+        self.skip_margin = skip_margin
+        self.cut_margin = cut_margin
+        self._lock = threading.Lock()
+        self.stats = {
+            'skip': 0,
+            'band': 0,
+            'full': 0,
+            'candidates_total': 0,
+            'candidates_reranked': 0,
+            'candidates_dropped': 0
+        }
+
+    def plan(self, vector_results: List[Dict], rerank_k: int) -> RerankPlan:
+        plan = self._plan(vector_results, rerank_k)
+        with self._lock:
+            self.stats[plan.action] += 1
+            self.stats['candidates_total'] += len(vector_results)
+            self.stats['candidates_reranked'] += len(plan.rerank_indices)
+            self.stats['candidates_dropped'] += plan.dropped
+        return plan
+
+    def _plan(self, vector_results: List[Dict], rerank_k: int) -> RerankPlan:
+        all_indices = list(range(len(vector_results)))
+        if not self.enabled or len(vector_results) < 2 or \
+                any('distance' not in result for result in vector_results):
+            return RerankPlan('full', [], all_indices)
+
+        order = sorted(all_indices, key=lambda i: vector_results[i]['distance'])
+        best = vector_results[order[0]]['distance']
+        kept = [i for i in order if vector_results[i]['distance'] - best <= self.cut_margin]
+        dropped = len(order) - len(kept)
+
+        head = []
+        for position, index in enumerate(kept):
+            if position + 1 < len(kept):
+                gap = vector_results[kept[position + 1]]['distance'] - vector_results[index]['distance']
+            else:
+                gap = float('inf')
+            if gap < self.skip_margin:
+                break
+            head.append(index)
+
+        if len(head) >= min(rerank_k, len(kept)):
+            return RerankPlan('skip', kept[:rerank_k], [], dropped)
+        if head:
+            return RerankPlan('band', head, kept[len(head):], dropped)
+        return RerankPlan('full', [], kept, dropped)
+
+    def assemble(self, plan: RerankPlan, band_results: List[Dict], documents: List[str]) -> List[Dict]:
+        """把确定的前缀和模糊区间的重排结果拼成标准重排序输出
+
+        band_results 为对 plan.rerank_indices 对应文档的重排结果（rank为区间内下标），
+        返回 {'document', 'score', 'rank'} 列表，rank映射回原候选下标。
+        确定的前缀给满分1.0并排在最前，后续的距离加权仍保持其距离顺序。
+        """
+        results = [
+            {'document': documents[index], 'score': 1.0, 'rank': index, 'rerank_skipped': True}
+            for index in plan.head
+        ]
+        for item in band_results:
+            results.append({
+                'document': item['document'],
+                'score': item['score'],
+                'rank': plan.rerank_indices[item['rank']]
+            })
+        return results
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+        queries = stats['skip'] + stats['band'] + stats['full']
+        for action in ('skip', 'band', 'full'):
+            stats[f'{action}_rate'] = stats[action] / queries if queries else 0.0
+        stats['rerank_fraction'] = (
+            stats['candidates_reranked'] / stats['candidates_total'] if stats['candidates_total'] else 0.0
+        )
+        return stats
+
+
+def create_rerank_policy(config) -> AdaptiveRerankPolicy:
+    return AdaptiveRerankPolicy(
+        enabled=config.RERANK_POLICY_ENABLED,
+        skip_margin=config.RERANK_SKIP_MARGIN,
+        cut_margin=config.RERANK_CUT_MARGIN
+    )
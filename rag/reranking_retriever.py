@@ -0,0 +1,140 @@
+# rag/reranking_retriever.py
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+from rag.hybrid_search import hybrid_search, hybrid_search_batch
+from rag.rerank_policy import create_rerank_policy
+from rag.retrieval_cache import get_retrieval_cache, normalize_query
+
+
+class CachedRerankingRetriever(ABC):
+    """混合召回 + 按距离分布的选择性重排序 + 结果缓存，HybridRetriever与BGERetriever共用
+
+    子类在 __init__ 中调用 _init_pipeline 并设置 self.reranker，
+    提供 cache_namespace、reranker_label 和 _merge_results（各自的分数合并方式）。
+    """
+
+    cache_namespace = 'retriever'
+    reranker_label = 'Reranker'
+
+    def _init_pipeline(self, config):
+        self.config = config
+        self.reranker = None
+        self.cache = get_retrieval_cache(config)
+        self.rerank_policy = create_rerank_policy(config)
+
+    def _reranker_ready(self) -> bool:
+        return self.reranker is not None and getattr(self.reranker, 'model', None) is not None
+
+    def _cache_key(self, query: str, vector_store, top_k: int, rerank_k: int) -> tuple:
+        return (self.cache_namespace, vector_store.config.COLLECTION_NAME, normalize_query(query), top_k, rerank_k)
+
+    def retrieve(self, query: str, vector_store, top_k: int = 10, rerank_k: int = 5) -> List[Dict]:
+        """混合检索与重排序（结果缓存，集合写入后自动失效）"""
+        if self.cache is None or vector_store is None:
+            return self._retrieve(query, vector_store, top_k, rerank_k)
+
+        return self.cache.get_or_compute(
+            self._cache_key(query, vector_store, top_k, rerank_k),
+            vector_store.version,
+            lambda: self._retrieve(query, vector_store, top_k, rerank_k)
+        )
+
+    def retrieve_batch(self, queries: List[str], vector_store, top_k: int = 10, rerank_k: int = 5) -> List[List[Dict]]:
+        """批量检索：未命中缓存的查询一次向量搜索，候选一起重排序"""
+        if self.cache is None or vector_store is None:
+            return self._retrieve_batch(queries, vector_store, top_k, rerank_k)
+
+        keys = [self._cache_key(query, vector_store, top_k, rerank_k) for query in queries]
+        return self.cache.get_or_compute_many(
+            keys,
+            vector_store.version,
+            lambda missing: self._retrieve_batch([queries[i] for i in missing], vector_store, top_k, rerank_k)
+        )
+
+    def _retrieve(self, query: str, vector_store, top_k: int, rerank_k: int) -> List[Dict]:
+        """混合检索与重排序（不经过缓存）"""
+        try:
+            if vector_store is None or vector_store.collection is None:
+                print("⚠️ 向量库不可用，返回空结果")
+                return []
+
+            # 1. 向量 + BM25 混合召回
+            vector_results = hybrid_search(query, vector_store, top_k=top_k)
+
+            if not vector_results:
+                return []
+
+            # 如果没有reranker，直接返回混合召回结果
+            if not self._reranker_ready():
+                print("⚠️ 使用简化检索（无Reranker）")
+                return vector_results[:rerank_k]
+
+            # 2. 按向量距离分布决定重排序范围
+            documents = [result['content'] for result in vector_results]
+            plan = self.rerank_policy.plan(vector_results, rerank_k)
+
+            # 3. 只对模糊区间进行精排
+            band_results = []
+            if plan.rerank_indices:
+                print(f"🔄 使用{self.reranker_label}进行重排序 ({len(plan.rerank_indices)}/{len(documents)} 个候选)...")
+                band_results = self.reranker.rerank(query, [documents[j] for j in plan.rerank_indices])
+            else:
+                print("⚡ 向量检索结果区分度足够，跳过重排序")
+            reranked_results = self.rerank_policy.assemble(plan, band_results, documents)
+
+            # 4. 合并结果
+            final_results = self._merge_results(vector_results, reranked_results, rerank_k)
+
+            print(f"✅ 检索完成，返回 {len(final_results)} 个结果")
+            return final_results
+
+        except Exception as e:
+            print(f"❌ 检索过程中出错: {e}")
+            # 返回原始向量检索结果
+            return vector_results[:rerank_k] if 'vector_results' in locals() else []
+
+    def _retrieve_batch(self, queries: List[str], vector_store, top_k: int, rerank_k: int) -> List[List[Dict]]:
+        """批量混合检索与重排序（不经过缓存）"""
+        try:
+            if vector_store is None or vector_store.collection is None:
+                print("⚠️ 向量库不可用，返回空结果")
+                return [[] for _ in queries]
+
+            # 1. 混合召回（向量部分为一次nq>1的检索）
+            vector_results_list = hybrid_search_batch(queries, vector_store, top_k=top_k)
+
+            if not self._reranker_ready():
+                print("⚠️ 使用简化检索（无Reranker）")
+                return [results[:rerank_k] for results in vector_results_list]
+
+            # 2. 逐查询制定重排序计划，所有查询的模糊区间一起重排序
+            active = [i for i, results in enumerate(vector_results_list) if results]
+            plans = {i: self.rerank_policy.plan(vector_results_list[i], rerank_k) for i in active}
+            documents_lists = {i: [result['content'] for result in vector_results_list[i]] for i in active}
+            rerank_active = [i for i in active if plans[i].rerank_indices]
+            band_lists = {}
+            if rerank_active:
+                print(f"🔄 使用{self.reranker_label}批量重排序 ({len(rerank_active)}/{len(active)} 个查询)...")
+                band_lists = dict(zip(rerank_active, self.reranker.rerank_batch(
+                    [queries[i] for i in rerank_active],
+                    [[documents_lists[i][j] for j in plans[i].rerank_indices] for i in rerank_active]
+                )))
+
+            # 3. 按查询合并结果
+            final_results_list = [[] for _ in queries]
+            for i in active:
+                reranked_results = self.rerank_policy.assemble(plans[i], band_lists.get(i, []), documents_lists[i])
+                final_results_list[i] = self._merge_results(vector_results_list[i], reranked_results, rerank_k)
+            return final_results_list
+
+        except Exception as e:
+            print(f"❌ 批量检索过程中出错: {e}")
+            if 'vector_results_list' in locals():
+                return [results[:rerank_k] for results in vector_results_list]
+            return [[] for _ in queries]
+
+    @abstractmethod
+    def _merge_results(self, vector_results: List[Dict], reranked_results: List[Dict], rerank_k: int) -> List[Dict]:
+        """按各自的分数合并方式把重排序结果合并回召回结果"""
+        pass
@@ -0,0 +1,221 @@
+# rag/retrieval_cache.py
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # 非POSIX平台：版本文件不加锁
+    fcntl = None
+
+
+class CollectionVersion:
+    """持久化的集合版本号：写入集合的进程（API、init_system.py等）递增版本文件，
+    查询方按文件变化读取，因此其他进程的写入也能立即使检索缓存失效"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat_key = None
+        self._value = 0
+
+    def get(self) -> int:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 0
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if stat_key != self._stat_key:
+                self._value = self._read()
+                self._stat_key = stat_key
+            return self._value
+
+    def bump(self) -> int:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._lock, open(self.path + '.lock', 'a+') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            value = self._read() + 1
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(str(value))
+            os.replace(tmp_path, self.path)
+            self._stat_key = None
+            return value
+
+    def _read(self) -> int:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+
+_collection_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _collection_version(config) -> CollectionVersion:
+    path = os.path.join(config.COLLECTION_VERSION_DIR, f"{config.COLLECTION_NAME}.version")
+    with _versions_lock:
+        if path not in _collection_versions:
+            _collection_versions[path] = CollectionVersion(path)
+        return _collection_versions[path]
+
+
+def bump_collection_version(config) -> int:
+    """集合写入或重建后调用，所有进程的检索缓存随之失效"""
+    try:
+        return _collection_version(config).bump()
+    except OSError as e:
+        print(f"⚠️ 更新集合版本号失败: {e}")
+        return 0
+
+
+def get_collection_version(config) -> int:
+    return _collection_version(config).get()
+
+
+_TRAILING_PUNCT = re.compile(r'[\s?？!！。.,，;；:：~～]+$')
+
+
+def normalize_query(query: str) -> str:
+    """归一化查询：全半角统一、小写、压缩空白、去掉结尾标点"""
+    text = unicodedata.normalize('NFKC', query).lower()
+    text = ' '.join(text.split())
+    return _TRAILING_PUNCT.sub('', text)
+
+
+class _Entry:
+    __slots__ = ('value', 'version', 'expires_at')
+
+    def __init__(self, value, version: int, expires_at: float):
+        self.value = value
+        self.version = version
+        self.expires_at = expires_at
+
+
+class RetrievalCache:
+    """检索结果缓存：LRU + TTL + 集合版本校验 + 同key并发合并（防击穿）"""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'coalesced': 0, 'evictions': 0}
+
+    def get_or_compute(self, key: tuple, version: int, compute_fn: Callable[[], List[Dict]]) -> List[Dict]:
+        """命中直接返回；未命中时同一key只有一个线程执行compute_fn，其余线程等待其结果"""
+        while True:
+            with self._lock:
+                value = self._lookup(key, version)
+                if value is not None:
+                    return value
+                event = self._inflight.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    owner = True
+                else:
+                    self.stats['coalesced'] += 1
+                    owner = False
+
+            if owner:
+                try:
+                    result = compute_fn()
+                    # 空结果多半来自集合不可用或检索异常，不缓存
+                    if result:
+                        self._store(key, version, result)
+                    return result
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key, None)
+                    event.set()
+
+            event.wait()
+            with self._lock:
+                value = self._lookup(key, version, count=False)
+            if value is not None:
+                return value
+            # 计算方失败或结果未缓存，重新竞争执行权
+
+    def get_or_compute_many(self, keys: List[tuple], version: int,
+                            compute_fn: Callable[[List[int]], List[List[Dict]]]) -> List[List[Dict]]:
+        """批量版本：先逐个查缓存，未命中的下标一次性交给compute_fn计算并回填"""
+        results = [self.get(key, version) for key in keys]
+        missing = [i for i, value in enumerate(results) if value is None]
+        if missing:
+            computed = compute_fn(missing)
+            for i, value in zip(missing, computed):
+                results[i] = value
+                self.put(keys[i], version, value)
+        return results
+
+    def get(self, key: tuple, version: int) -> Optional[List[Dict]]:
+        with self._lock:
+            return self._lookup(key, version)
+
+    def put(self, key: tuple, version: int, value: List[Dict]):
+        if value:
+            self._store(key, version, value)
+
+    def _lookup(self, key: tuple, version: int, count: bool = True) -> Optional[List[Dict]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.stats['misses'] += 1
+            return None
+        if entry.version != version or entry.expires_at < time.monotonic():
+            del self._entries[key]
+            if count:
+                self.stats['stale'] += 1
+                self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(key)
+        if count:
+            self.stats['hits'] += 1
+        return [dict(item) for item in entry.value]
+
+    def _store(self, key: tuple, version: int, value: List[Dict]):
+        with self._lock:
+            self._entries[key] = _Entry([dict(item) for item in value], version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+            stats['size'] = len(self._entries)
+            return stats
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache(config) -> Optional[RetrievalCache]:
+    """进程内共享的检索缓存，未启用时返回None"""
+    global _default_cache
+    if not config.RETRIEVAL_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = RetrievalCache(config.RETRIEVAL_CACHE_SIZE, config.RETRIEVAL_CACHE_TTL)
+        return _default_cache
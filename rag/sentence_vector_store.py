@@ -0,0 +1,96 @@
+# rag/sentence_vector_store.py
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+
+def content_key(content: str) -> str:
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _quantize(vectors: np.ndarray) -> np.ndarray:
+    # 余弦相似度与向量长度无关，逐行按最大绝对值缩放到int8即可
+    scales = np.max(np.abs(vectors), axis=1, keepdims=True)
+    scales[scales == 0] = 1.0
+    return np.round(vectors / scales * 127).astype(np.int8)
+
+
+class SentenceVectorStore:
+    """块内句子向量的旁路存储（SQLite，键为块内容的哈希），不进入向量库的metadata
+
+    写入时与块向量一起编码后存入，上下文压缩时按检索结果的content取回；
+    检索结果、检索缓存、工作流检查点和返回给客户端的sources都不携带句子向量。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0}
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sentence_vectors ("
+            "key TEXT PRIMARY KEY, num_sentences INTEGER NOT NULL, vectors BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def put_many(self, items: List[Tuple[str, np.ndarray]]):
+        """items: [(块内容, 该块各句子的向量矩阵)]"""
+        rows = [(content_key(content), len(vectors), _quantize(np.asarray(vectors, dtype=np.float32)).tobytes())
+                for content, vectors in items if len(vectors)]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sentence_vectors (key, num_sentences, vectors) VALUES (?, ?, ?)", rows
+            )
+            self._conn.commit()
+            self.stats['writes'] += len(rows)
+
+    def get_many(self, contents: List[str]) -> List[Optional[np.ndarray]]:
+        """按块内容取回句子向量矩阵（float32），没有存储的位置为None"""
+        keys = [content_key(content) for content in contents]
+        with self._lock:
+            found = {}
+            for key in set(keys):
+                row = self._conn.execute(
+                    "SELECT num_sentences, vectors FROM sentence_vectors WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    found[key] = np.frombuffer(row[1], dtype=np.int8).reshape(row[0], -1).astype(np.float32)
+            hits = sum(1 for key in keys if key in found)
+            self.stats['hits'] += hits
+            self.stats['misses'] += len(keys) - hits
+        return [found.get(key) for key in keys]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM sentence_vectors")
+            self._conn.commit()
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+def create_sentence_vector_store(config: Config, backend: str) -> Optional[SentenceVectorStore]:
+    """启用上下文压缩和句子向量时，为该向量库的集合创建旁路存储"""
+    if not (config.CONTEXT_PACKING_ENABLED and config.CONTEXT_SENTENCE_VECTORS):
+        return None
+    try:
+        return SentenceVectorStore(
+            os.path.join(config.SENTENCE_VECTOR_DIR, f"{backend}_{config.COLLECTION_NAME}.sqlite3")
+        )
+    except Exception as e:
+        print(f"⚠️ 句子向量存储初始化失败，上下文压缩使用词重叠打分: {e}")
+        return None
@@ -25,4 +25,22 @@ class SimpleRetriever:
             
         except Exception as e:
             print(f"❌ 检索过程中出错: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def retrieve_batch(self, queries: List[str], vector_store, top_k: int = 5) -> List[List[Dict]]:
+        """批量简化检索 - 一次多查询向量搜索"""
+        try:
+            if vector_store is None or vector_store.collection is None:
+                print("⚠️ Milvus不可用，返回空结果")
+                return [[] for _ in queries]
+            
+            batch_results = vector_store.similarity_search_batch(queries, k=top_k)
+            for vector_results in batch_results:
+                vector_results.sort(key=lambda x: x.get('distance', 0))
+            
+            print(f"✅ 批量简化检索完成，{len(queries)} 个查询")
+            return batch_results
+            
+        except Exception as e:
+            print(f"❌ 检索过程中出错: {e}")
+            return [[] for _ in queries]
\ No newline at end of file
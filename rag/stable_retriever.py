@@ -1,17 +1,18 @@
 # rag/stable_retriever.py
-import torch
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
 from typing import List, Dict
 from config import Config
-import os
+from rag.cross_encoder import CrossEncoderScorer, load_cross_encoder
+from tracing import traced
 
 class StableReranker:
     """稳定版Reranker - 逐文档处理，避免批量问题"""
     
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, batch_size: int = 16):
         self.model_path = model_path
+        self.batch_size = batch_size
         self.model = None
         self.tokenizer = None
+        self.scorer = None
         self._load_model()
     
     def _load_model(self):
@@ -19,22 +20,11 @@ class StableReranker:
         try:
             print(f"🔄 加载Reranker模型从: {self.model_path}")
             
-            # 使用更简单的加载方式
-            self.tokenizer = AutoTokenizer.from_pretrained(
-                self.model_path,
-                trust_remote_code=True
-            )
-            
-            # 强制设置padding token
-            if self.tokenizer.pad_token is None:
-                self.tokenizer.pad_token = self.tokenizer.eos_token or '[PAD]'
+            # tokenizer与模型经模型注册表共享
+            self.tokenizer, self.model = load_cross_encoder(self.model_path)
             
-            self.model = AutoModelForSequenceClassification.from_pretrained(
-                self.model_path,
-                torch_dtype=torch.float16,
-                device_map="auto",
-                trust_remote_code=True
-            )
+            # 打分引擎负责设置padding token
+            self.scorer = CrossEncoderScorer(self.model, self.tokenizer, max_length=256, batch_size=self.batch_size)
             
             print("✅ Reranker模型加载完成")
             
@@ -42,56 +32,28 @@ class StableReranker:
             print(f"❌ 加载失败: {e}")
             self.model = None
             self.tokenizer = None
+            self.scorer = None
     
+    @traced()
     def rerank_serial(self, query: str, documents: List[str]) -> List[Dict]:
-        """串行重排序 - 最稳定的方法"""
+        """重排序 - 按长度分批打分，单批失败时打分引擎自动退化为逐条处理"""
         if not documents or self.model is None:
             return []
         
-        results = []
-        
-        for i, doc in enumerate(documents):
-            try:
-                # 对每个文档单独处理
-                pair = [query, doc]
-                
-                inputs = self.tokenizer(
-                    pair,
-                    padding='max_length',  # 使用固定长度padding
-                    truncation=True,
-                    max_length=256,  # 使用较短的序列长度
-                    return_tensors="pt"
-                )
-                
-                # 移动到设备
-                inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
-                
-                with torch.no_grad():
-                    outputs = self.model(**inputs)
-                    score = torch.softmax(outputs.logits, dim=1)[0, 1].item()
-                
-                results.append({
-                    'document': doc,
-                    'score': score,
-                    'rank': i
-                })
-                
-            except Exception as e:
-                print(f"❌ 处理文档 {i} 失败: {e}")
-                results.append({
-                    'document': doc,
-                    'score': 0.5,
-                    'rank': i
-                })
+        return self.scorer.rerank(query, documents)
+    
+    @traced()
+    def rerank_batch(self, queries: List[str], documents_lists: List[List[str]]) -> List[List[Dict]]:
+        """多个查询的候选一起批量打分"""
+        if self.model is None:
+            return [[] for _ in queries]
         
-        # 按分数排序
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results
+        return self.scorer.rerank_many(queries, documents_lists)
 
 class StableRetriever:
     def __init__(self, config: Config):
         self.config = config
-        self.reranker = StableReranker(config.RERANKER_MODEL_PATH) if config.RERANKER_MODEL_PATH else None
+        self.reranker = StableReranker(config.RERANKER_MODEL_PATH, batch_size=config.RERANK_BATCH_SIZE) if config.RERANKER_MODEL_PATH else None
     
     def retrieve(self, query: str, vector_store, top_k: int = 5) -> List[Dict]:
         """稳定版检索"""
@@ -102,7 +64,7 @@ class StableRetriever:
             # 向量检索
             vector_results = vector_store.similarity_search(query, k=top_k)
             
-            if not vector_results or self.reranker is None:
+            if not vector_results or self.reranker is None or self.reranker.model is None:
                 return vector_results[:top_k]
             
             # 重排序
@@ -110,16 +72,49 @@ class StableRetriever:
             reranked = self.reranker.rerank_serial(query, documents)
             
             # 合并结果
-            final_results = []
-            for item in reranked[:top_k]:
-                idx = item['rank']
-                if idx < len(vector_results):
-                    final_result = vector_results[idx].copy()
-                    final_result['rerank_score'] = item['score']
-                    final_results.append(final_result)
-            
-            return final_results
+            return self._merge_results(vector_results, reranked, top_k)
             
         except Exception as e:
             print(f"❌ 检索失败: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def retrieve_batch(self, queries: List[str], vector_store, top_k: int = 5) -> List[List[Dict]]:
+        """稳定版批量检索：一次多查询向量搜索，候选一起重排序"""
+        try:
+            if vector_store is None:
+                return [[] for _ in queries]
+            
+            vector_results_list = vector_store.similarity_search_batch(queries, k=top_k)
+            
+            # Reranker加载失败时直接返回向量结果，而不是空的重排序结果
+            if self.reranker is None or self.reranker.model is None:
+                return [results[:top_k] for results in vector_results_list]
+            
+            active = [i for i, results in enumerate(vector_results_list) if results]
+            reranked_lists = self.reranker.rerank_batch(
+                [queries[i] for i in active],
+                [[result['content'] for result in vector_results_list[i]] for i in active]
+            )
+            
+            final_results_list = [[] for _ in queries]
+            for i, reranked in zip(active, reranked_lists):
+                final_results_list[i] = self._merge_results(vector_results_list[i], reranked, top_k)
+            return final_results_list
+            
+        except Exception as e:
+            print(f"❌ 批量检索失败: {e}")
+            if 'vector_results_list' in locals():
+                return [results[:top_k] for results in vector_results_list]
+            return [[] for _ in queries]
+    
+    def _merge_results(self, vector_results: List[Dict], reranked: List[Dict], top_k: int) -> List[Dict]:
+        """把重排序分数合并回向量检索结果"""
+        final_results = []
+        for item in reranked[:top_k]:
+            idx = item['rank']
+            if idx < len(vector_results):
+                final_result = vector_results[idx].copy()
+                final_result['rerank_score'] = item['score']
+                final_results.append(final_result)
+        
+        return final_results
\ No newline at end of file
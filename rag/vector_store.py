@@ -3,14 +3,31 @@ from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Colle
 from transformers import AutoModel, AutoTokenizer
 import torch
 import numpy as np
+import os
+import time
 from config import Config
+from rag.embedding_cache import CachedEmbeddingModel
+from rag.ingestion import pipelined_ingest
+from rag.chunker import maybe_chunk_records
+from rag.context_packer import encode_with_sentence_vectors
+from rag.sentence_vector_store import create_sentence_vector_store
+from rag.retrieval_cache import bump_collection_version, get_collection_version
+from rag.lexical_index import LexicalIndex
+from model_registry import get_model_registry
+from tracing import current_span, traced
+import threading
 
 class QwenEmbeddingModel:
     """Qwen3-Embedding模型封装"""
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, batch_size: int = 32, max_length: int = 512):
         self.model_path = model_path
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.pooling = "mean"
+        self.normalize = True
         self.tokenizer = None
         self.model = None
+        self.last_stats = {}
         self._load_model()
     
     def _load_model(self):
@@ -36,42 +53,150 @@ class QwenEmbeddingModel:
         sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
         return sum_embeddings / sum_mask
     
-    def encode(self, texts: list):
-        """编码文本为向量"""
+    def encode(self, texts: list, batch_size: int = None, raise_errors: bool = False):
+        """编码文本为向量；raise_errors=True 时编码失败直接抛出，不返回随机向量"""
         if isinstance(texts, str):
             texts = [texts]
         
         try:
-            # 编码文本
-            inputs = self.tokenizer(
-                texts, 
-                padding=True, 
-                truncation=True, 
-                max_length=512, 
-                return_tensors="pt"
-            ).to(self.model.device)
-            
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            
-            # 使用均值池化获得文档级嵌入
-            embeddings = self._mean_pooling(outputs, inputs['attention_mask'])
-            
-            # 归一化（可选，但通常能提升检索效果）
-            embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
-            
-            return embeddings.cpu().numpy()
+            return self._encode_batched(texts, batch_size or self.batch_size)
             
         except Exception as e:
+            if raise_errors:
+                raise
             print(f"❌ 编码失败: {e}")
             # 返回随机向量作为备选
             return np.random.randn(len(texts), 1024).astype(np.float32)
+    
+    @traced("embedding.encode")
+    def _encode_batched(self, texts: list, batch_size: int):
+        """按token长度分桶的微批编码，结果按输入顺序返回"""
+        if not texts:
+            return np.zeros((0, self.model.config.hidden_size), dtype=np.float32)
+        
+        start_time = time.perf_counter()
+        
+        # 先只分词不padding，得到每条文本的真实长度
+        encoded = self.tokenizer(
+            texts,
+            padding=False,
+            truncation=True,
+            max_length=self.max_length
+        )
+        input_ids = encoded['input_ids']
+        attention_mask = encoded['attention_mask']
+        
+        # 按长度排序，长度相近的文本进入同一批次，减少padding浪费
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]))
+        
+        embeddings = None
+        padded_tokens = 0
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                indices = order[start:start + batch_size]
+                
+                # 动态padding：只补齐到当前批次内的最长文本
+                inputs = self.tokenizer.pad(
+                    {
+                        'input_ids': [input_ids[i] for i in indices],
+                        'attention_mask': [attention_mask[i] for i in indices]
+                    },
+                    padding=True,
+                    return_tensors="pt"
+                ).to(self.model.device)
+                padded_tokens += inputs['input_ids'].numel()
+                
+                outputs = self.model(**inputs)
+                
+                # 使用均值池化获得文档级嵌入
+                batch_embeddings = self._mean_pooling(outputs, inputs['attention_mask'])
+                
+                # 归一化（可选，但通常能提升检索效果）
+                batch_embeddings = torch.nn.functional.normalize(batch_embeddings, p=2, dim=1)
+                batch_embeddings = batch_embeddings.float().cpu().numpy()
+                
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                # 写回原始位置，保证输出顺序与输入一致
+                embeddings[indices] = batch_embeddings
+        
+        elapsed = time.perf_counter() - start_time
+        real_tokens = sum(len(ids) for ids in input_ids)
+        self.last_stats = {
+            'num_texts': len(texts),
+            'num_batches': (len(texts) + batch_size - 1) // batch_size,
+            'elapsed': elapsed,
+            'docs_per_sec': len(texts) / elapsed if elapsed > 0 else 0.0,
+            'padding_ratio': 1 - real_tokens / padded_tokens if padded_tokens else 0.0
+        }
+        current_span().set(texts=len(texts), batch_size=min(batch_size, len(texts)), input_tokens=real_tokens)
+        if len(texts) > 1:
+            print(f"⚡ 编码 {len(texts)} 条文本，"
+                  f"耗时 {elapsed:.2f}s，吞吐 {self.last_stats['docs_per_sec']:.1f} docs/s，"
+                  f"padding占比 {self.last_stats['padding_ratio']:.1%}")
+        
+        return embeddings
+
+def create_embedding_model(config: Config):
+    """获取进程内共享的嵌入模型（经模型注册表，所有向量库和服务共用一份）"""
+    return get_model_registry().get_or_load(
+        'embedding', config.EMBEDDING_MODEL_PATH, lambda: _load_embedding_model(config)
+    )
+
+def _load_embedding_model(config: Config):
+    """按配置创建嵌入模型，启用缓存时包一层内容寻址缓存"""
+    model = QwenEmbeddingModel(
+        config.EMBEDDING_MODEL_PATH,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        max_length=config.EMBEDDING_MAX_LENGTH
+    )
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return model
+    return CachedEmbeddingModel(
+        model,
+        cache_dir=config.EMBEDDING_CACHE_DIR,
+        memory_size=config.EMBEDDING_CACHE_MEMORY_SIZE,
+        max_disk_rows=config.EMBEDDING_CACHE_DISK_SIZE
+    )
+
+def create_vector_store(config: Config):
+    """获取进程内共享的向量库：milvus（远程Zilliz）或 local（进程内NumPy/HNSW）
+    
+    工作流和各服务共用同一个实例，BM25索引和本地向量矩阵只构建一份。
+    """
+    if config.VECTOR_STORE_BACKEND == "local":
+        location = os.path.join(config.LOCAL_STORE_DIR, config.COLLECTION_NAME)
+    else:
+        location = f"{config.MILVUS_URI}#{config.COLLECTION_NAME}"
+    return get_model_registry().get_or_load(
+        f"vector_store:{config.VECTOR_STORE_BACKEND}", location,
+        lambda: _load_vector_store(config),
+        estimate=_vector_store_bytes
+    )
+
+def _load_vector_store(config: Config):
+    if config.VECTOR_STORE_BACKEND == "local":
+        from rag.local_vector_store import LocalVectorStore
+        return LocalVectorStore(config)
+    return MilvusVectorStore(config)
+
+def _vector_store_bytes(vector_store) -> int:
+    """本地向量库按向量矩阵估算内存，Milvus数据在远端记为0"""
+    vectors = getattr(getattr(vector_store, 'collection', None), '_vectors', None)
+    return int(getattr(vectors, 'nbytes', 0))
 
 class MilvusVectorStore:
     def __init__(self, config: Config):
         self.config = config
-        self.embedding_model = QwenEmbeddingModel(config.EMBEDDING_MODEL_PATH)
+        self.embedding_model = create_embedding_model(config)
         self.collection = None
+        self.lexical_index = LexicalIndex(config.BM25_K1, config.BM25_B) if config.LEXICAL_INDEX_ENABLED else None
+        self.sentence_vectors = create_sentence_vector_store(config, 'milvus')
+        self._lexical_ready = False
+        self._lexical_lock = threading.Lock()
+        self._version = None
+        self._num_entities = None
+        self._entities_checked_at = 0.0
         self._connect()
         
     def _connect(self):
@@ -99,6 +224,51 @@ class MilvusVectorStore:
             print(f"❌ 连接Milvus数据库失败: {e}")
             self.collection = None
     
+    @property
+    def version(self) -> tuple:
+        """集合版本，用于使检索缓存失效"""
+        return self.refresh()
+    
+    def _current_version(self) -> tuple:
+        """版本文件（任何进程写入后递增）+ 实体数（覆盖不共享版本文件的其他节点的写入，按间隔查询）"""
+        now = time.monotonic()
+        if self.collection is not None and now - self._entities_checked_at >= self.config.COLLECTION_VERSION_CHECK_INTERVAL:
+            try:
+                self._num_entities = self.collection.num_entities
+            except Exception:
+                pass
+            self._entities_checked_at = now
+        return (get_collection_version(self.config), self._num_entities)
+    
+    def refresh(self) -> tuple:
+        """检测其他进程对集合的写入：版本变化时下次BM25检索前从集合重建索引"""
+        version = self._current_version()
+        if version != self._version:
+            if self._version is not None and self.lexical_index is not None:
+                with self._lexical_lock:
+                    self.lexical_index = LexicalIndex(self.config.BM25_K1, self.config.BM25_B)
+                    self._lexical_ready = False
+                print("🔄 集合已被其他进程更新，BM25索引将重建")
+            self._version = version
+        return version
+    
+    def _mark_own_write(self):
+        """本进程写入后递增版本；本进程的BM25索引已增量更新，不需要重建
+        
+        期间有其他进程写入（版本号不是连续递增）时保留旧版本，由下一次refresh触发重建。
+        """
+        seen = self._version[0] if self._version is not None else get_collection_version(self.config)
+        if bump_collection_version(self.config) == seen + 1:
+            self._entities_checked_at = 0.0
+            self._version = self._current_version()
+    
+    def has_collection(self) -> bool:
+        """集合是否已存在"""
+        try:
+            return utility.has_collection(self.config.COLLECTION_NAME)
+        except Exception:
+            return False
+    
     def create_collection(self):
         """创建向量集合"""
         try:
@@ -131,6 +301,12 @@ class MilvusVectorStore:
             }
             self.collection.create_index("embedding", index_params)
             self.collection.load()
+            if self.lexical_index is not None:
+                self.lexical_index.clear()
+                self._lexical_ready = True
+            if self.sentence_vectors is not None:
+                self.sentence_vectors.clear()
+            self._mark_own_write()
             
             print(f"✅ 成功创建集合: {self.config.COLLECTION_NAME} (维度: {embedding_dim})")
             
@@ -140,82 +316,157 @@ class MilvusVectorStore:
     
     def add_documents(self, documents: list, metadatas: list = None):
         """添加文档到向量库"""
-        if self.collection is None:
-            print("❌ 集合未初始化，请先创建集合")
-            return False
-            
         if metadatas is None:
             metadatas = [{}] * len(documents)
         
+        stats = self.add_documents_stream(zip(documents, metadatas))
+        return stats is not None
+    
+    def add_documents_stream(self, records, batch_size: int = None):
+        """流式写入 (text, metadata) 记录
+        
+        启用切分时先按token预算切块，父文档id和偏移写入metadata。
+        按批编码，编码下一批的同时插入上一批；向量以float32矩阵直接传给Milvus，
+        不做 .tolist() 转换；所有批次写完后只flush一次。返回写入统计，失败返回None。
+        """
+        if self.collection is None:
+            print("❌ 集合未初始化，请先创建集合")
+            return None
+        
+        batch_size = batch_size or self.config.INGEST_BATCH_SIZE
+        print(f"🔄 使用Qwen3-Embedding流式生成嵌入向量 (批大小: {batch_size})...")
+        
+        stats = None
         try:
-            # 生成嵌入向量
-            print("🔄 使用Qwen3-Embedding生成嵌入向量...")
-            embeddings = self.embedding_model.encode(documents)
-            
-            print(f"📐 嵌入矩阵形状: {embeddings.shape}")
-            print(f"📐 实际嵌入维度: {embeddings.shape[1]}")
-            
-            # 转换为列表格式
-            embeddings_list = embeddings.tolist()
-            
-            # 准备插入数据
-            entities = [
-                documents,  # content字段
-                embeddings_list, # embedding字段  
-                metadatas  # metadata字段
-            ]
-            
-            # 插入数据
-            print("🔄 插入数据到Milvus...")
-            insert_result = self.collection.insert(entities)
-            self.collection.flush()
-            
-            print(f"✅ 成功插入 {len(documents)} 个文档")
-            print(f"📈 集合现在有 {self.collection.num_entities} 个实体")
-            return True
+            stats = pipelined_ingest(
+                maybe_chunk_records(records, self.embedding_model, self.config),
+                encode_fn=self._encode_batch,
+                insert_fn=self._insert_batch,
+                batch_size=batch_size
+            )
+            return stats
             
         except Exception as e:
             print(f"❌ 插入文档失败: {e}")
-            return False
+            return None
+            
+        finally:
+            # 无论成功与否，已插入的数据统一flush一次
+            try:
+                self.collection.flush()
+                self._mark_own_write()
+                if stats is not None:
+                    print(f"✅ 成功插入 {stats['documents']} 个文档，"
+                          f"耗时 {stats['elapsed']:.2f}s，吞吐 {stats['docs_per_sec']:.1f} docs/s")
+                print(f"📈 集合现在有 {self.collection.num_entities} 个实体")
+            except Exception as e:
+                print(f"⚠️ flush失败: {e}")
+    
+    def _encode_batch(self, texts: list):
+        """编码一批块；启用句子向量时句子在同一次编码中完成，写入旁路存储"""
+        if self.sentence_vectors is None:
+            return self.embedding_model.encode(texts)
+        return encode_with_sentence_vectors(self.embedding_model, texts, self.sentence_vectors)
+    
+    def _insert_batch(self, documents: list, embeddings, metadatas: list) -> int:
+        """插入一批数据（列式），返回插入条数"""
+        # 先用已有数据建好BM25索引，再增量追加本批，保证两者一致
+        self._ensure_lexical_index()
+        entities = [
+            documents,  # content字段
+            np.ascontiguousarray(embeddings, dtype=np.float32),  # embedding字段
+            metadatas  # metadata字段
+        ]
+        self.collection.insert(entities)
+        if self.lexical_index is not None:
+            self.lexical_index.add_documents(documents, metadatas)
+        return len(documents)
+    
+    def _ensure_lexical_index(self):
+        """首次使用时从集合中全量拉取content构建BM25索引，之后随写入增量维护"""
+        if self.lexical_index is None or self._lexical_ready:
+            return
+        with self._lexical_lock:
+            if self._lexical_ready:
+                return
+            print("🔄 从集合构建BM25倒排索引...")
+            iterator = self.collection.query_iterator(
+                batch_size=1000,
+                output_fields=["content", "metadata"]
+            )
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    iterator.close()
+                    break
+                self.lexical_index.add_documents(
+                    [row['content'] for row in batch],
+                    [row.get('metadata') or {} for row in batch]
+                )
+            self._lexical_ready = True
+            print(f"✅ BM25索引构建完成: {self.lexical_index.num_documents} 个文档")
+    
+    def lexical_search(self, query: str, k: int = 5):
+        """BM25关键词检索，不需要嵌入模型"""
+        if self.collection is None or self.lexical_index is None:
+            return []
+        
+        try:
+            self.refresh()
+            self._ensure_lexical_index()
+            return self.lexical_index.search_documents(query, k)
+        except Exception as e:
+            print(f"❌ BM25检索出错: {e}")
+            return []
     
     def similarity_search(self, query: str, k: int = 5):
         """相似性搜索"""
+        return self.similarity_search_batch([query], k=k)[0]
+    
+    @traced("vector_store.search")
+    def similarity_search_batch(self, queries: list, k: int = 5):
+        """多查询相似性搜索：一次前向编码全部查询，一次nq>1的search，按查询返回结果列表"""
+        current_span().set(backend="milvus", batch_size=len(queries), k=k)
         if self.collection is None:
             print("❌ 集合未初始化")
+            return [[] for _ in queries]
+        if not queries:
             return []
             
         try:
             # 生成查询向量
-            query_embedding = self.embedding_model.encode([query])
-            query_embedding_list = query_embedding.tolist()
+            query_embeddings = self.embedding_model.encode(list(queries))
             
-            print(f"🔍 查询向量维度: {len(query_embedding_list[0])}")
+            print(f"🔍 查询向量维度: {query_embeddings.shape[1]} (查询数: {len(queries)})")
             
             # 执行搜索
             search_params = {"metric_type": "L2", "params": {"ef": 32}}
             
             results = self.collection.search(
-                data=query_embedding_list,
+                data=query_embeddings.tolist(),
                 anns_field="embedding",
                 param=search_params,
                 limit=k,
                 output_fields=["content", "metadata"]
             )
             
-            search_results = []
-            for hit in results[0]:
-                search_results.append({
-                    'content': hit.entity.get('content'),
-                    'metadata': hit.entity.get('metadata', {}),
-                    'distance': hit.distance
-                })
+            batch_results = []
+            for hits in results:
+                search_results = []
+                for hit in hits:
+                    search_results.append({
+                        'content': hit.entity.get('content'),
+                        'metadata': hit.entity.get('metadata', {}),
+                        'distance': hit.distance
+                    })
+                batch_results.append(search_results)
             
-            print(f"✅ 搜索完成，找到 {len(search_results)} 个结果")
-            return search_results
+            print(f"✅ 搜索完成，找到 {sum(len(r) for r in batch_results)} 个结果")
+            return batch_results
             
         except Exception as e:
             print(f"❌ 搜索过程中出错: {e}")
-            return []
+            return [[] for _ in queries]
 
     def get_collection_info(self):
         """获取集合信息"""
@@ -1,5 +1,5 @@
 # services/concise_response.py
-from rag.vector_store import MilvusVectorStore
+from rag.vector_store import create_vector_store
 from rag.bge_retriever import BGERetriever
 from rag.simple_retriever import SimpleRetriever
 from agents.llm_wrapper import get_llm
@@ -11,8 +11,7 @@ class ConciseResponseService:
     
     def __init__(self, config: Config):
         self.config = config
-        self.vector_store = MilvusVectorStore(config)
-        self.llm = get_llm()
+        self.vector_store = create_vector_store(config)
         
         # 使用检索器
         try:
@@ -21,6 +20,11 @@ class ConciseResponseService:
             print(f"⚠️ BGE检索器失败，使用简化版: {e}")
             self.retriever = SimpleRetriever(config)
     
+    @property
+    def llm(self):
+        """首次生成时才加载LLM"""
+        return get_llm()
+    
     def generate_quick_response(self, query: str) -> dict:  # 统一方法名
         """生成简洁回答"""
         try:
@@ -71,10 +75,10 @@ class ConciseResponseService:
         if self._is_simple_fact(query):
             return self._answer_simple_fact(query, context)
         
-        prompt = f"""问题：{query}
-信息：{context}
+        prompt = f"""直接回答，不要解释。最多2句话。
 
-直接回答，不要解释。最多2句话。"""
+信息：{context}
+问题：{query}"""
 
         response = self.llm.generate(prompt)
         return self._force_concise(response)
@@ -100,10 +104,11 @@ class ConciseResponseService:
             return '北京市海淀区'
         
         # 如果直接提取失败，使用LLM但强制简短
-        prompt = f"""信息：{context}
-问题：{query}
+        prompt = f"""直接给出答案，只写结果，不要任何其他文字。
 
-直接给出答案，只写结果，不要任何其他文字："""
+信息：{context}
+问题：{query}
+答案："""
         
         response = self.llm.generate(prompt)
         return self._extract_answer_only(response)
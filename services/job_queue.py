@@ -0,0 +1,501 @@
+# services/job_queue.py
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import Config
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED_STATUSES = (COMPLETED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """排队任务数达到上限"""
+
+
+def new_job_id() -> str:
+    return "job_" + uuid.uuid4().hex
+
+
+def default_worker_id() -> str:
+    """主机名 + 进程号，多节点多进程时可区分任务由谁执行"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _json_default(value):
+    # 结果中可能含numpy标量/数组（检索距离等）
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    return str(value)
+
+
+def _dumps(value) -> Optional[str]:
+    return None if value is None else json.dumps(value, ensure_ascii=False, default=_json_default)
+
+
+def _loads(text: Optional[str]):
+    return None if text is None else json.loads(text)
+
+
+class JobBroker:
+    """任务代理接口：提交、领取、上报进度与结果、查询
+
+    领取任务时记录执行者（worker_id）并计一次尝试；执行期间定期心跳，
+    心跳超时的任务由 requeue_stale 重新排队（超过尝试次数或不可重试则标记失败）。
+    complete / fail / update_partial 只对仍由该执行者持有的任务生效，
+    避免失联后又恢复的工作进程覆盖重新执行的结果。
+    """
+
+    def submit(self, payload: Dict[str, Any], max_pending: int = 0) -> str:
+        raise NotImplementedError
+
+    def submit_running(self, payload: Dict[str, Any], worker_id: str) -> str:
+        """登记一个由调用方自行执行的任务（如SSE流式运行），直接处于运行中，不进入队列
+
+        这类任务不可重试：调用方失联后客户端已不在，心跳超时直接标记失败，不会被工作进程重新执行。
+        """
+        raise NotImplementedError
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        raise NotImplementedError
+
+    def update_partial(self, job_id: str, worker_id: str, partial: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        raise NotImplementedError
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        raise NotImplementedError
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def requeue_stale(self, lease_timeout: float, max_attempts: int) -> int:
+        raise NotImplementedError
+
+    def cleanup(self, max_age: float) -> int:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class MemoryJobBroker(JobBroker):
+    """进程内任务代理（默认）：只能由本进程的工作池执行，重启后任务丢失"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._queue = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, payload: Dict[str, Any], max_pending: int = 0) -> str:
+        job_id = new_job_id()
+        with self._lock:
+            if max_pending and len(self._queue) >= max_pending:
+                raise JobQueueFull(f"排队任务已达上限 {max_pending}")
+            self._jobs[job_id] = {
+                'id': job_id, 'status': QUEUED, 'payload': payload, 'partial': None, 'result': None,
+                'error': None, 'attempts': 0, 'worker_id': None, 'created_at': time.time(),
+                'started_at': None, 'finished_at': None, 'heartbeat_at': None, 'retryable': True
+            }
+            self._queue.append(job_id)
+        return job_id
+
+    def submit_running(self, payload: Dict[str, Any], worker_id: str) -> str:
+        job_id = new_job_id()
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id, 'status': RUNNING, 'payload': payload, 'partial': None, 'result': None,
+                'error': None, 'attempts': 1, 'worker_id': worker_id, 'created_at': now,
+                'started_at': now, 'finished_at': None, 'heartbeat_at': now, 'retryable': False
+            }
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            while self._queue:
+                job = self._jobs.get(self._queue.popleft())
+                if job is None or job['status'] != QUEUED:
+                    continue
+                now = time.time()
+                job.update(status=RUNNING, worker_id=worker_id, started_at=now, heartbeat_at=now,
+                           attempts=job['attempts'] + 1)
+                return dict(job)
+        return None
+
+    def _update_owned(self, job_id: str, worker_id: str, **fields) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] != RUNNING or job['worker_id'] != worker_id:
+                return False
+            job.update(fields)
+            return True
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        return self._update_owned(job_id, worker_id, heartbeat_at=time.time())
+
+    def update_partial(self, job_id: str, worker_id: str, partial: Dict[str, Any]) -> bool:
+        return self._update_owned(job_id, worker_id, partial=partial, heartbeat_at=time.time())
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        return self._update_owned(job_id, worker_id, status=COMPLETED, result=result, finished_at=time.time())
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_owned(job_id, worker_id, status=FAILED, error=error, finished_at=time.time())
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def requeue_stale(self, lease_timeout: float, max_attempts: int) -> int:
+        deadline = time.time() - lease_timeout
+        requeued = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] != RUNNING or job['heartbeat_at'] >= deadline:
+                    continue
+                if job['attempts'] >= max_attempts or not job['retryable']:
+                    job.update(status=FAILED, error="执行超时（工作进程失联）", finished_at=time.time())
+                else:
+                    job.update(status=QUEUED, worker_id=None)
+                    self._queue.append(job['id'])
+                requeued += 1
+        return requeued
+
+    def cleanup(self, max_age: float) -> int:
+        deadline = time.time() - max_age
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in FINISHED_STATUSES and job['finished_at'] < deadline]
+            for job_id in expired:
+                del self._jobs[job_id]
+        return len(expired)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'broker': 'memory', **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, COMPLETED, FAILED)}}
+
+
+class SqliteJobBroker(JobBroker):
+    """SQLite任务代理：多个工作进程（可在不同节点上，共享同一数据库文件）领取同一个队列
+
+    领取时在 BEGIN IMMEDIATE 事务中选出最早的排队任务并改为运行中，同一任务只会被一个进程领取。
+    跨节点共享时数据库文件所在的文件系统需要支持可靠的文件锁。
+    """
+
+    _COLUMNS = ('id', 'status', 'payload', 'partial', 'result', 'error', 'attempts', 'worker_id',
+                'created_at', 'started_at', 'finished_at', 'heartbeat_at', 'retryable')
+
+    def __init__(self, db_path: str):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conn().executescript(
+            """
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                partial TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker_id TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL,
+                retryable INTEGER NOT NULL DEFAULT 1
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at);
+            """
+        )
+        # 旧版本创建的数据库没有retryable列
+        columns = {row[1] for row in self._conn().execute("PRAGMA table_info(jobs)")}
+        if 'retryable' not in columns:
+            self._conn().execute("ALTER TABLE jobs ADD COLUMN retryable INTEGER NOT NULL DEFAULT 1")
+
+    def _conn(self) -> sqlite3.Connection:
+        # 每个线程各用一个连接（autocommit，需要原子性的地方显式开启事务）
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _row_to_job(self, row) -> Dict[str, Any]:
+        job = dict(zip(self._COLUMNS, row))
+        for key in ('payload', 'partial', 'result'):
+            job[key] = _loads(job[key])
+        job['retryable'] = bool(job['retryable'])
+        return job
+
+    def submit(self, payload: Dict[str, Any], max_pending: int = 0) -> str:
+        job_id = new_job_id()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if max_pending:
+                pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+                if pending >= max_pending:
+                    raise JobQueueFull(f"排队任务已达上限 {max_pending}")
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, QUEUED, _dumps(payload), time.time())
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id
+
+    def submit_running(self, payload: Dict[str, Any], worker_id: str) -> str:
+        job_id = new_job_id()
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, status, payload, attempts, worker_id, created_at, started_at, heartbeat_at, retryable) "
+            "VALUES (?, ?, ?, 1, ?, ?, ?, ?, 0)",
+            (job_id, RUNNING, _dumps(payload), worker_id, now, now, now)
+        )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, started_at = ?, heartbeat_at = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, worker_id, now, now, row[0])
+            )
+            job = conn.execute(f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (row[0],)).fetchone()
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return self._row_to_job(job)
+
+    def _update_owned(self, job_id: str, worker_id: str, assignments: str, params: tuple) -> bool:
+        cursor = self._conn().execute(
+            f"UPDATE jobs SET {assignments} WHERE id = ? AND status = ? AND worker_id = ?",
+            params + (job_id, RUNNING, worker_id)
+        )
+        return cursor.rowcount > 0
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        return self._update_owned(job_id, worker_id, "heartbeat_at = ?", (time.time(),))
+
+    def update_partial(self, job_id: str, worker_id: str, partial: Dict[str, Any]) -> bool:
+        return self._update_owned(job_id, worker_id, "partial = ?, heartbeat_at = ?", (_dumps(partial), time.time()))
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        return self._update_owned(job_id, worker_id, "status = ?, result = ?, finished_at = ?",
+                                  (COMPLETED, _dumps(result), time.time()))
+
+    def fail(self, job_id: str, worker_id: str, error: str) -> bool:
+        return self._update_owned(job_id, worker_id, "status = ?, error = ?, finished_at = ?",
+                                  (FAILED, error, time.time()))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def requeue_stale(self, lease_timeout: float, max_attempts: int) -> int:
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND (attempts >= ? OR retryable = 0)",
+                (FAILED, "执行超时（工作进程失联）", now, RUNNING, now - lease_timeout, max_attempts)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, now - lease_timeout)
+            ).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return failed + requeued
+
+    def cleanup(self, max_age: float) -> int:
+        return self._conn().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            FINISHED_STATUSES + (time.time() - max_age,)
+        ).rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {'broker': 'sqlite', **{status: counts.get(status, 0) for status in (QUEUED, RUNNING, COMPLETED, FAILED)}}
+
+
+def create_job_broker(config: Config) -> JobBroker:
+    """按配置创建任务代理，SQLite初始化失败时回退到进程内代理"""
+    if config.JOB_BROKER == 'sqlite':
+        try:
+            broker = SqliteJobBroker(config.JOB_QUEUE_PATH)
+            print(f"✅ 任务队列使用SQLite: {config.JOB_QUEUE_PATH}")
+            return broker
+        except Exception as e:
+            print(f"⚠️ SQLite任务队列初始化失败，使用进程内队列: {e}")
+    return MemoryJobBroker()
+
+
+JobHandler = Callable[[str, Dict[str, Any], Callable[[Dict[str, Any]], Awaitable]], Awaitable[Dict[str, Any]]]
+
+
+class JobWorkerPool:
+    """有界工作池：固定数量的协程从代理领取任务并执行，最多同时执行 workers 个任务
+
+    handler(job_id, payload, report_progress) 返回任务结果；report_progress(partial) 上报部分结果。
+    本进程提交任务后调用 notify 立即唤醒空闲工作者，其他进程提交的任务按 poll_interval 轮询领取。
+    另有一个维护协程定期重新排队心跳超时的任务、清理过期结果。
+    """
+
+    def __init__(self, broker: JobBroker, handler: JobHandler, workers: int = 4, poll_interval: float = 0.5,
+                 lease_timeout: float = 600, max_attempts: int = 2, result_ttl: float = 86400,
+                 worker_id: str = None):
+        self.broker = broker
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+        self.worker_id = worker_id or default_worker_id()
+        self._tasks = []
+        self._wakeup = None
+        self.stats = {'completed': 0, 'failed': 0, 'running': 0}
+
+    @classmethod
+    def from_config(cls, broker: JobBroker, handler: JobHandler, config: Config) -> 'JobWorkerPool':
+        return cls(
+            broker, handler,
+            workers=config.JOB_WORKERS,
+            poll_interval=config.JOB_POLL_INTERVAL,
+            lease_timeout=config.JOB_LEASE_TIMEOUT,
+            max_attempts=config.JOB_MAX_ATTEMPTS,
+            result_ttl=config.JOB_RESULT_TTL
+        )
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """在当前事件循环中启动工作者协程"""
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._maintain()))
+        print(f"🚀 任务工作池已启动: {self.workers} 个工作者 ({self.worker_id})")
+
+    async def stop(self):
+        """取消所有工作者；执行中的任务不再上报，心跳超时后由其他工作进程重新执行"""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _worker(self, index: int):
+        worker_id = f"{self.worker_id}/{index}"
+        while True:
+            # 先清除再领取：领取之后到来的通知不会丢失
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.broker.claim, worker_id)
+            except Exception as e:
+                print(f"⚠️ 领取任务失败: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(job, worker_id)
+
+    async def _execute(self, job: Dict[str, Any], worker_id: str):
+        job_id = job['id']
+
+        async def report_progress(partial: Dict[str, Any]):
+            await asyncio.to_thread(self.broker.update_partial, job_id, worker_id, partial)
+
+        heartbeat = self.track(job_id, worker_id)
+        self.stats['running'] += 1
+        try:
+            result = await self.handler(job_id, job['payload'], report_progress)
+            await asyncio.to_thread(self.broker.complete, job_id, worker_id, result)
+            self.stats['completed'] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ 任务执行失败 {job_id}: {e}")
+            await asyncio.to_thread(self.broker.fail, job_id, worker_id, str(e))
+            self.stats['failed'] += 1
+        finally:
+            self.stats['running'] -= 1
+            heartbeat.cancel()
+
+    def track(self, job_id: str, worker_id: str) -> asyncio.Task:
+        """为任务启动心跳（工作池执行的任务和调用方自行执行的流式任务共用），结束时由调用方取消"""
+        return asyncio.create_task(self._heartbeat(job_id, worker_id))
+
+    async def _heartbeat(self, job_id: str, worker_id: str):
+        while True:
+            await asyncio.sleep(self.lease_timeout / 3)
+            try:
+                await asyncio.to_thread(self.broker.heartbeat, job_id, worker_id)
+            except Exception as e:
+                print(f"⚠️ 任务心跳失败 {job_id}: {e}")
+
+    async def _maintain(self):
+        while True:
+            try:
+                requeued = await asyncio.to_thread(self.broker.requeue_stale, self.lease_timeout, self.max_attempts)
+                if requeued:
+                    print(f"♻️ 心跳超时的任务已重新排队或标记失败: {requeued} 个")
+                await asyncio.to_thread(self.broker.cleanup, self.result_ttl)
+            except Exception as e:
+                print(f"⚠️ 任务队列维护失败: {e}")
+            await asyncio.sleep(max(min(self.lease_timeout / 3, 60), self.poll_interval))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, workers=self.workers if self.running else 0, worker_id=self.worker_id)
@@ -1,5 +1,7 @@
 # services/quick_response.py
-from rag.vector_store import MilvusVectorStore
+import asyncio
+from typing import AsyncIterator
+from rag.vector_store import create_vector_store
 from rag.bge_retriever import BGERetriever
 from rag.simple_retriever import SimpleRetriever
 from agents.llm_wrapper import get_llm
@@ -10,8 +12,7 @@ class QuickResponseService:
     
     def __init__(self, config: Config):
         self.config = config
-        self.vector_store = MilvusVectorStore(config)
-        self.llm = get_llm()
+        self.vector_store = create_vector_store(config)
         
         # 优先使用BGE检索器
         try:
@@ -21,15 +22,16 @@ class QuickResponseService:
             print(f"⚠️ BGE检索器失败，使用简化版: {e}")
             self.retriever = SimpleRetriever(config)
     
+    @property
+    def llm(self):
+        """首次生成时才加载LLM"""
+        return get_llm()
+    
     def generate_quick_response(self, query: str) -> dict:
         """生成快速响应"""
         try:
             # 检索相关知识
-            if hasattr(self.retriever, 'retrieve'):
-                rag_results = self.retriever.retrieve(query, self.vector_store, top_k=5, rerank_k=3)
-            else:
-                # 简化检索器
-                rag_results = self.retriever.retrieve(query, self.vector_store, top_k=3)
+            rag_results = self._retrieve(query)
             
             # 构建上下文
             context = self._build_context(rag_results)
@@ -45,12 +47,44 @@ class QuickResponseService:
             }
             
         except Exception as e:
-            return {
-                'type': 'error',
-                'answer': f"抱歉，处理问题时出现错误: {str(e)}",
-                'sources': [],
-                'has_related_info': False
+            return self._error_response(e)
+    
+    async def stream_quick_response(self, query: str) -> AsyncIterator[dict]:
+        """流式生成快速响应：先产出检索来源，再逐段产出回答，最后产出后处理的完整回答"""
+        try:
+            rag_results = await asyncio.to_thread(self._retrieve, query)
+            yield {'event': 'sources', 'sources': rag_results}
+            
+            prompt = self._build_prompt(query, self._build_context(rag_results))
+            chunks = []
+            async for delta in self.llm.astream(prompt):
+                chunks.append(delta)
+                yield {'event': 'token', 'text': delta}
+            
+            answer = self._post_process_response(self.llm.clean_response(''.join(chunks)))
+            yield {
+                'event': 'done',
+                'type': 'quick_response',
+                'answer': answer,
+                'has_related_info': len(rag_results) > 0
             }
+            
+        except Exception as e:
+            yield dict(self._error_response(e), event='error')
+    
+    def _retrieve(self, query: str) -> list:
+        if hasattr(self.retriever, 'retrieve'):
+            return self.retriever.retrieve(query, self.vector_store, top_k=5, rerank_k=3)
+        # 简化检索器
+        return self.retriever.retrieve(query, self.vector_store, top_k=3)
+    
+    def _error_response(self, e: Exception) -> dict:
+        return {
+            'type': 'error',
+            'answer': f"抱歉，处理问题时出现错误: {str(e)}",
+            'sources': [],
+            'has_related_info': False
+        }
     
     def _build_context(self, rag_results: list) -> str:
         """构建上下文"""
@@ -71,55 +105,58 @@ class QuickResponseService:
     def _generate_answer(self, query: str, context: str) -> str:
         """生成回答 - 强制简洁版本"""
         
-        # 根据问题类型使用不同的提示词
-        if self._is_fact_query(query):
-            prompt = self._build_fact_prompt(query, context)
-        else:
-            prompt = self._build_general_prompt(query, context)
-        
-        response = self.llm.generate(prompt)
+        response = self.llm.generate(self._build_prompt(query, context))
         return self._post_process_response(response)
 
+    def _build_prompt(self, query: str, context: str) -> str:
+        """根据问题类型使用不同的提示词"""
+        if self._is_fact_query(query):
+            return self._build_fact_prompt(query, context)
+        return self._build_general_prompt(query, context)
+
     def _is_fact_query(self, query: str) -> bool:
         """判断是否是事实性查询"""
         fact_keywords = ['是谁', '是什么', '多少', '哪里', '什么时候', '电话', '邮箱', '地址']
         return any(keyword in query for keyword in fact_keywords)
 
+    # 提示词按"静态要求 → 参考信息 → 问题"排列，静态部分可命中vLLM前缀缓存
+    FACT_PROMPT_HEADER = """请直接回答以下问题，只给出事实信息，不要解释和分析。
+
+要求：
+1. 直接给出答案，不要开头语
+2. 只包含问题相关的具体信息
+3. 如果信息充分，直接回答
+4. 如果信息不足，只说"信息不足"
+5. 回答要简洁，不超过2句话"""
+
+    GENERAL_PROMPT_HEADER = """请基于参考信息简洁回答以下问题。
+
+要求：
+1. 直接回答问题核心
+2. 回答要简洁明了
+3. 不要重复信息
+4. 不要添加解释性内容
+5. 如果信息不足请说明"""
+
     def _build_fact_prompt(self, query: str, context: str) -> str:
         """构建事实性查询的提示词"""
-        return f"""请直接回答以下问题，只给出事实信息，不要解释和分析。
+        return f"""{self.FACT_PROMPT_HEADER}
 
-    参考信息：
-    {context}
+{context}
 
-    问题：{query}
+问题：{query}
 
-    要求：
-    1. 直接给出答案，不要开头语
-    2. 只包含问题相关的具体信息
-    3. 如果信息充分，直接回答
-    4. 如果信息不足，只说"信息不足"
-    5. 回答要简洁，不超过2句话
-
-    回答："""
+回答："""
 
     def _build_general_prompt(self, query: str, context: str) -> str:
         """构建一般性查询的提示词"""
-        return f"""请基于参考信息简洁回答以下问题。
-
-    参考信息：
-    {context}
+        return f"""{self.GENERAL_PROMPT_HEADER}
 
-    问题：{query}
+{context}
 
-    要求：
-    1. 直接回答问题核心
-    2. 回答要简洁明了
-    3. 不要重复信息
-    4. 不要添加解释性内容
-    5. 如果信息不足请说明
+问题：{query}
 
-    回答："""
+回答："""
 
     def _post_process_response(self, text: str) -> str:
         """后处理响应 - 强制简洁"""
@@ -0,0 +1,212 @@
+# tracing.py
+import asyncio
+import contextvars
+import functools
+import time
+from typing import Dict, Optional
+
+from config import Config
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+_config = Config()
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+if PROMETHEUS_AVAILABLE:
+    SPAN_DURATION = Histogram(
+        'span_duration_seconds', '各阶段耗时', ['span'],
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    )
+    SPAN_BATCH_SIZE = Histogram(
+        'span_batch_size', '各阶段的批大小', ['span'],
+        buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+    )
+    SPAN_TOKENS = Histogram(
+        'span_tokens', '各阶段处理的token数', ['span', 'kind'],
+        buckets=(16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+    )
+
+# 按这些属性名写入Prometheus直方图
+_TOKEN_ATTRIBUTES = ('prompt_tokens', 'output_tokens', 'input_tokens')
+
+
+class Span:
+    """一个计时区间，子区间挂在父区间下（跨线程池、异步任务通过contextvars传递）"""
+
+    __slots__ = ('name', 'attributes', 'start', 'duration', 'children')
+
+    recording = True
+
+    def __init__(self, name: str, attributes: Dict):
+        self.name = name
+        self.attributes = attributes
+        self.start = time.perf_counter()
+        self.duration = None
+        self.children = []
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self, origin: float = None) -> Dict:
+        """树形耗时明细，start_ms为相对根区间开始的偏移"""
+        origin = self.start if origin is None else origin
+        return {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round((self.duration or 0.0) * 1000, 3),
+            'attributes': self.attributes,
+            'children': [child.to_dict(origin) for child in sorted(self.children, key=lambda c: c.start)]
+        }
+
+    def summary(self) -> Dict[str, Dict]:
+        """按区间名汇总次数与总耗时（并行区间的耗时会重叠）"""
+        totals = {}
+        stack = list(self.children)
+        while stack:
+            span = stack.pop()
+            entry = totals.setdefault(span.name, {'count': 0, 'total_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] += (span.duration or 0.0) * 1000
+            stack.extend(span.children)
+        return {name: dict(entry, total_ms=round(entry['total_ms'], 3)) for name, entry in totals.items()}
+
+
+class _NoopSpan:
+    """关闭追踪时返回的空区间"""
+
+    __slots__ = ()
+    recording = False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _observe(span: Span):
+    if not PROMETHEUS_AVAILABLE or not _config.TRACING_ENABLED:
+        return
+    SPAN_DURATION.labels(span.name).observe(span.duration)
+    batch_size = span.attributes.get('batch_size')
+    if isinstance(batch_size, (int, float)):
+        SPAN_BATCH_SIZE.labels(span.name).observe(batch_size)
+    for key in _TOKEN_ATTRIBUTES:
+        value = span.attributes.get(key)
+        if isinstance(value, (int, float)):
+            SPAN_TOKENS.labels(span.name, key[:-len('_tokens')]).observe(value)
+
+
+class span:
+    """计时区间上下文管理器：with span("llm.generate", batch_size=4) as s: ... s.set(output_tokens=n)
+
+    TRACING_ENABLED关闭且当前没有强制开启的追踪（start_trace）时直接返回空区间，
+    只多一次ContextVar读取。
+    """
+
+    __slots__ = ('name', 'attributes', '_span', '_parent', '_token')
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self._span = None
+
+    def __enter__(self):
+        self._parent = _current_span.get()
+        if self._parent is None and not _config.TRACING_ENABLED:
+            return NOOP_SPAN
+        self._span = Span(self.name, self.attributes)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return False
+        self._span.duration = time.perf_counter() - self._span.start
+        if exc_type is not None:
+            self._span.attributes['error'] = exc_type.__name__
+        _current_span.reset(self._token)
+        if self._parent is not None:
+            self._parent.children.append(self._span)
+        _observe(self._span)
+        return False
+
+
+class start_trace(span):
+    """请求级根区间：force=True 时即使全局关闭追踪也记录本次请求的所有子区间"""
+
+    __slots__ = ('force',)
+
+    def __init__(self, name: str, force: bool = False, **attributes):
+        super().__init__(name, **attributes)
+        self.force = force
+
+    def __enter__(self):
+        self._parent = None
+        if not self.force and not _config.TRACING_ENABLED:
+            return NOOP_SPAN
+        self._span = Span(self.name, self.attributes)
+        self._token = _current_span.set(self._span)
+        return self._span
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def record_span(name: str, start: float, **attributes):
+    """记录一个已结束的区间（start为perf_counter值），挂到当前区间下
+
+    用于异步生成器等跨多次恢复执行的场景：不修改ContextVar，避免在其他上下文中reset。
+    """
+    parent = _current_span.get()
+    if parent is None and not _config.TRACING_ENABLED:
+        return
+    finished = Span(name, attributes)
+    finished.start = start
+    finished.duration = time.perf_counter() - start
+    if parent is not None:
+        parent.children.append(finished)
+    _observe(finished)
+
+
+def tracing_active() -> bool:
+    """当前上下文是否在记录区间（用于跳过只为追踪而做的额外计算）"""
+    return _current_span.get() is not None or _config.TRACING_ENABLED
+
+
+def traced(name: Optional[str] = None):
+    """装饰器：把函数调用包在一个区间里，支持同步与异步函数"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def run_in_executor(executor, func, *args):
+    """在线程池中执行并携带当前追踪上下文（loop.run_in_executor不会复制contextvars）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+def render_metrics():
+    """返回 (Prometheus文本, content_type)；未安装prometheus_client时返回None"""
+    if not PROMETHEUS_AVAILABLE:
+        return None
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,149 @@
+# workflow/checkpoint.py
+import asyncio
+import os
+import pickle
+import sqlite3
+import time
+import uuid
+from typing import Dict, Optional
+
+from langgraph.checkpoint.sqlite import JsonPlusSerializerCompat, SqliteSaver
+
+from config import Config
+
+
+class PickleCompatSerializer(JsonPlusSerializerCompat):
+    """状态中含numpy标量（检索距离等），JSON无法序列化，统一用pickle写入；读取兼容JSON格式"""
+
+    def dumps(self, obj) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def make_thread_id() -> str:
+    """每次运行一个新线程ID；续跑中断的运行需由调用方传回该ID"""
+    return "run_" + uuid.uuid4().hex
+
+
+class WorkflowCheckpointer(SqliteSaver):
+    """基于SQLite的LangGraph检查点存储
+
+    每个超步结束后写入一次检查点，失败或进程重启后用同一线程ID续跑，已完成的节点不再执行。
+    异步接口在线程中调用同步实现（单条SQLite读写很快，不依赖aiosqlite）。
+    另建threads表记录每个线程的最近写入时间，按存活时间和线程数上限定期清理。
+    """
+
+    def __init__(self, db_path: str, max_age: float = 86400, max_threads: int = 1000,
+                 gc_interval: float = 300):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        super().__init__(sqlite3.connect(db_path, check_same_thread=False), serde=PickleCompatSerializer())
+        self.db_path = db_path
+        self.max_age = max_age
+        self.max_threads = max_threads
+        self.gc_interval = gc_interval
+        self._last_gc = 0.0
+        self.stats = {'writes': 0, 'gc_runs': 0, 'threads_removed': 0}
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            PRAGMA synchronous=NORMAL;
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_threads_updated ON threads(updated_at);
+            """
+        )
+
+    def put(self, config, checkpoint, metadata):
+        # 先登记线程再写检查点，避免期间的清理把刚写入的检查点当作无主记录删除
+        with self.lock, self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO threads (thread_id, updated_at) VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time())
+            )
+            self.stats['writes'] += 1
+        saved = super().put(config, checkpoint, metadata)
+        self.maybe_gc()
+        return saved
+
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def aput(self, config, checkpoint, metadata):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata)
+
+    async def alist(self, config, *, before=None, limit=None):
+        for item in await asyncio.to_thread(lambda: list(self.list(config, before=before, limit=limit))):
+            yield item
+
+    async def asearch(self, metadata_filter, *, before=None, limit=None):
+        for item in await asyncio.to_thread(lambda: list(self.search(metadata_filter, before=before, limit=limit))):
+            yield item
+
+    def delete_thread(self, thread_id: str):
+        with self.lock, self.cursor() as cur:
+            cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+            cur.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+    def maybe_gc(self):
+        if time.time() - self._last_gc >= self.gc_interval:
+            self.gc()
+
+    def gc(self) -> int:
+        """删除超过存活时间的线程；仍超过线程数上限时按最近写入时间淘汰最旧的线程"""
+        self._last_gc = time.time()
+        with self.lock, self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM threads WHERE updated_at < ?", (time.time() - self.max_age,))
+            expired = [row[0] for row in cur.fetchall()]
+            cur.execute("SELECT COUNT(*) FROM threads")
+            overflow = cur.fetchone()[0] - len(expired) - self.max_threads
+            if overflow > 0:
+                cur.execute(
+                    "SELECT thread_id FROM threads WHERE updated_at >= ? ORDER BY updated_at LIMIT ?",
+                    (time.time() - self.max_age, overflow)
+                )
+                expired += [row[0] for row in cur.fetchall()]
+            # 没有threads记录的检查点（表创建之前写入的）一并清理
+            cur.execute("DELETE FROM checkpoints WHERE thread_id NOT IN (SELECT thread_id FROM threads)")
+            for thread_id in expired:
+                cur.execute("DELETE FROM checkpoints WHERE thread_id = ?", (thread_id,))
+                cur.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+            self.stats['gc_runs'] += 1
+            self.stats['threads_removed'] += len(expired)
+        if expired:
+            print(f"🧹 清理工作流检查点 {len(expired)} 个线程")
+        return len(expired)
+
+    def get_stats(self) -> Dict:
+        with self.lock, self.cursor(transaction=False) as cur:
+            cur.execute("SELECT COUNT(*) FROM threads")
+            threads = cur.fetchone()[0]
+            cur.execute("SELECT COUNT(*) FROM checkpoints")
+            checkpoints = cur.fetchone()[0]
+            stats = dict(self.stats)
+        stats['threads'] = threads
+        stats['checkpoints'] = checkpoints
+        return stats
+
+
+def create_checkpointer(config: Config) -> Optional[WorkflowCheckpointer]:
+    """按配置创建检查点存储，失败时返回None（不使用检查点）"""
+    if not config.WORKFLOW_CHECKPOINT_ENABLED:
+        return None
+    try:
+        checkpointer = WorkflowCheckpointer(
+            config.WORKFLOW_CHECKPOINT_PATH,
+            max_age=config.WORKFLOW_CHECKPOINT_TTL,
+            max_threads=config.WORKFLOW_CHECKPOINT_MAX_THREADS,
+            gc_interval=config.WORKFLOW_CHECKPOINT_GC_INTERVAL
+        )
+        checkpointer.gc()
+        return checkpointer
+    except Exception as e:
+        print(f"⚠️ 工作流检查点初始化失败，不使用检查点: {e}")
+        return None
@@ -1,19 +1,41 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
-from typing import Dict, Any, TypedDict
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypedDict, Annotated
 from agents.coordinator import CoordinatorAgent
 from agents.business_expert import BusinessExpertAgent  
 from agents.tech_expert import TechnicalExpertAgent
 from agents.project_manager import ProjectManagerAgent
-from rag.retriever import HybridRetriever
-from rag.vector_store import MilvusVectorStore
+from rag.vector_store import create_vector_store
+from rag.context_packer import ContextPacker
+from agents.token_budget import get_token_budget
+from agents.router import create_router
+from workflow.checkpoint import create_checkpointer, make_thread_id
 from config import Config
 from rag.simple_retriever import SimpleRetriever
+from tracing import run_in_executor, span, traced
+
+def merge_results(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    """并行节点各自写入自己的结果，按Agent名合并；同一Agent的结果字典按字段合并（后台分析补写analysis）"""
+    merged = dict(left or {})
+    for node, result in (right or {}).items():
+        if isinstance(merged.get(node), dict) and isinstance(result, dict):
+            merged[node] = dict(merged[node], **result)
+        else:
+            merged[node] = result
+    return merged
+
+def take_last(left: str, right: str) -> str:
+    """同一步内多个节点写入时取最后一个，避免并行写入冲突"""
+    return right
+
 class AgentState(TypedDict):
     task: str
-    current_agent: str
+    current_agent: Annotated[str, take_last]
     context: Dict[str, Any]
-    results: Dict[str, Any]
-    next_step: str
+    results: Annotated[Dict[str, Any], merge_results]
+    next_step: Annotated[str, take_last]
 
 class WorkflowOrchestrator:
     def __init__(self, config: Config):
@@ -32,119 +54,245 @@ class WorkflowOrchestrator:
             print(f"⚠️ 完整检索器初始化失败: {e}，使用简化版")
             self.retriever = SimpleRetriever(config)
             
-        self.vector_store = MilvusVectorStore(config)
+        self.vector_store = create_vector_store(config)
+        # 路由复用检索时计算的任务向量（经嵌入缓存命中），协调员不必先等LLM分析
+        self.coordinator.router = create_router(config, getattr(self.vector_store, 'embedding_model', None))
+        self.analysis_mode = config.COORDINATOR_ANALYSIS
+        # 异步执行时检索在有界线程池中运行，限制同时占用嵌入/重排序模型的请求数
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=config.RETRIEVAL_WORKERS, thread_name_prefix='retrieval'
+        )
+        # 所有Agent共享同一份压缩后的上下文
+        self.context_packer = None
+        if config.CONTEXT_PACKING_ENABLED:
+            self.context_packer = ContextPacker(
+                get_token_budget(config).counter.count,
+                embedding_model=getattr(self.vector_store, 'embedding_model', None),
+                sentence_vectors=getattr(self.vector_store, 'sentence_vectors', None),
+                dedup_threshold=config.CONTEXT_DEDUP_THRESHOLD
+            )
+        self.agents = {
+            "coordinator": self.coordinator,
+            "business_expert": self.business_expert,
+            "tech_expert": self.tech_expert,
+            "project_manager": self.project_manager
+        }
+        # 条件路由表：同时用于构建LangGraph和流式执行
+        if config.WORKFLOW_PARALLEL_EXPERTS:
+            self.routes = self._parallel_routes()
+        else:
+            self.routes = self._sequential_routes()
+        if self.analysis_mode == "background":
+            # 协调员分析作为旁路节点与首批专家同时运行，写回协调员结果的analysis字段
+            self.agents["coordinator_analysis"] = self.coordinator
+            self._coordinator_route, mapping = self.routes["coordinator"]
+            self.routes["coordinator"] = (self._route_with_analysis,
+                                          dict(mapping, coordinator_analysis="coordinator_analysis"))
+        # 检查点：节点完成后落盘，失败重试或进程重启后从最近的检查点续跑
+        self.checkpointer = create_checkpointer(config)
         self.graph = self._build_graph()
         
+    def _sequential_routes(self) -> Dict[str, Any]:
+        """串行模式：业务专家按需转交技术专家，再交给项目经理"""
+        return {
+            "coordinator": (self._route_from_coordinator, {
+                "business_expert": "business_expert",
+                "tech_expert": "tech_expert", 
+                "project_manager": "project_manager"
+            }),
+            "business_expert": (self._route_from_business, {
+                "technical_review": "tech_expert",
+                "project_planning": "project_manager",
+                "end": END
+            }),
+            "tech_expert": (self._route_from_tech, {
+                "project_planning": "project_manager",
+                "end": END
+            })
+        }
+        
+    def _parallel_routes(self) -> Dict[str, Any]:
+        """并行模式：协调员一次派发所需的全部专家，专家完成后汇合到项目经理"""
+        experts = {
+            "business_expert": "business_expert",
+            "tech_expert": "tech_expert",
+            "project_manager": "project_manager"
+        }
+        to_project_manager = {"project_planning": "project_manager"}
+        return {
+            "coordinator": (self._route_experts_parallel, experts),
+            "business_expert": (self._route_to_project_manager, to_project_manager),
+            "tech_expert": (self._route_to_project_manager, to_project_manager)
+        }
+        
     def _build_graph(self):
         """构建LangGraph工作流"""
         graph = StateGraph(AgentState)
         
-        # 添加节点
-        graph.add_node("coordinator", self._run_coordinator)
-        graph.add_node("business_expert", self._run_business_expert)
-        graph.add_node("tech_expert", self._run_tech_expert)
-        graph.add_node("project_manager", self._run_project_manager)
+        # 添加节点：invoke使用同步实现，ainvoke使用异步实现
+        graph.add_node("coordinator", RunnableLambda(self._run_coordinator, afunc=self._arun_coordinator))
+        graph.add_node("business_expert", RunnableLambda(self._run_business_expert, afunc=self._arun_business_expert))
+        graph.add_node("tech_expert", RunnableLambda(self._run_tech_expert, afunc=self._arun_tech_expert))
+        graph.add_node("project_manager", RunnableLambda(self._run_project_manager, afunc=self._arun_project_manager))
+        
+        if self.analysis_mode == "background":
+            graph.add_node("coordinator_analysis", RunnableLambda(
+                self._run_coordinator_analysis, afunc=self._arun_coordinator_analysis))
+            graph.add_edge("coordinator_analysis", END)
         
         # 设置入口点
         graph.set_entry_point("coordinator")
         
         # 定义条件路由
-        graph.add_conditional_edges(
-            "coordinator",
-            self._route_from_coordinator,
-            {
-                "business_expert": "business_expert",
-                "tech_expert": "tech_expert", 
-                "project_manager": "project_manager"
-            }
-        )
-        
-        graph.add_conditional_edges(
-            "business_expert",
-            self._route_from_business,
-            {
-                "technical_review": "tech_expert",
-                "project_planning": "project_manager",
-                "end": END
-            }
-        )
-        
-        graph.add_conditional_edges(
-            "tech_expert", 
-            self._route_from_tech,
-            {
-                "project_planning": "project_manager",
-                "end": END
-            }
-        )
+        for node, (route_fn, mapping) in self.routes.items():
+            graph.add_conditional_edges(node, route_fn, mapping)
         
         graph.add_edge("project_manager", END)
         
-        return graph.compile()
+        return graph.compile(checkpointer=self.checkpointer)
     
-    def _run_coordinator(self, state: AgentState) -> AgentState:
-        """运行协调员Agent"""
-        task = state["task"]
-        
-        # 初始化results字典
-        if "results" not in state:
-            state["results"] = {}
-            
-        # RAG检索
-        rag_context = self.retriever.retrieve(task, self.vector_store)
-        
+    def _build_coordinator_context(self, state: AgentState) -> Dict[str, Any]:
+        """RAG检索并构建各Agent共享的上下文"""
+        with span("retrieval") as trace:
+            rag_context = self.retriever.retrieve(state["task"], self.vector_store)
+            trace.set(results=len(rag_context or []))
         context = {
             "rag_context": rag_context,
-            "previous_results": state.get("results", {})
+            "previous_results": dict(state.get("results") or {})
         }
-        
-        result = self.coordinator.process_task(task, context)
-        state["results"]["coordinator"] = result
-        state["current_agent"] = "coordinator"
-        state["context"] = context
-        
+        if self.context_packer is not None and rag_context:
+            with span("context_packing") as trace:
+                packed = self.context_packer.pack(state["task"], rag_context, self.config.CONTEXT_MAX_TOKENS)
+                report = packed["report"]
+                trace.set(input_tokens=report['tokens_before'], output_tokens=report['tokens_after'])
+            print(f"🗜️ 上下文压缩: {report['tokens_before']} → {report['tokens_after']} tokens "
+                  f"(去重 {report['duplicates_removed']} 块，保留 {report['sentences_kept']}/{report['sentences_total']} 句)")
+            context["rag_context"] = packed["results"]
+            context["context_report"] = report
+        return context
+    
+    def _agent_context(self, state: AgentState) -> Dict[str, Any]:
+        """共享上下文 + 截至当前已完成的Agent结果"""
+        return dict(state["context"], previous_results=state["results"])
+    
+    def _result_update(self, node: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """节点只返回自己写入的字段，由状态reducer合并（并行节点互不覆盖）"""
+        if node == "coordinator_analysis":
+            return {"results": {"coordinator": {"analysis": result["analysis"]}}}
+        update = {"results": {node: result}, "current_agent": node}
+        if "next_step" in result:
+            update["next_step"] = result["next_step"]
+        return update
+    
+    def _apply_update(self, state: AgentState, update: Dict[str, Any]) -> AgentState:
+        """流式执行时按与图相同的reducer把节点输出合并进状态"""
+        for key, value in update.items():
+            if key == "results":
+                state["results"] = merge_results(state["results"], value)
+            else:
+                state[key] = value
         return state
+    
+    @traced("node.coordinator")
+    def _run_coordinator(self, state: AgentState) -> Dict[str, Any]:
+        """运行协调员Agent"""
+        context = self._build_coordinator_context(state)
+        if self.analysis_mode == "inline":
+            result = self.coordinator.process_task(state["task"], context)
+        else:
+            result = self.coordinator.route(state["task"], context)
+        update = self._result_update("coordinator", result)
+        update["context"] = context
+        return update
         
-    def _run_business_expert(self, state: AgentState) -> AgentState:
-        """运行业务专家Agent"""
-        task = state["task"]
-        context = state["context"]
-        
-        result = self.business_expert.process_task(task, context)
-        state["results"]["business_expert"] = result
-        state["current_agent"] = "business_expert"
-        state["next_step"] = result.get("next_step", "end")
+    @traced("node.coordinator_analysis")
+    def _run_coordinator_analysis(self, state: AgentState) -> Dict[str, Any]:
+        """生成协调员的叙述性分析（不影响路由）"""
+        result = self.coordinator.process_task(state["task"], state["context"])
+        return self._result_update("coordinator_analysis", result)
         
-        return state
+    @traced("node.business_expert")
+    def _run_business_expert(self, state: AgentState) -> Dict[str, Any]:
+        """运行业务专家Agent"""
+        result = self.business_expert.process_task(state["task"], self._agent_context(state))
+        return self._result_update("business_expert", result)
         
-    def _run_tech_expert(self, state: AgentState) -> AgentState:
+    @traced("node.tech_expert")
+    def _run_tech_expert(self, state: AgentState) -> Dict[str, Any]:
         """运行技术专家Agent""" 
-        task = state["task"]
-        context = state["context"]
-        
-        result = self.tech_expert.process_task(task, context)
-        state["results"]["tech_expert"] = result
-        state["current_agent"] = "tech_expert"
-        state["next_step"] = result.get("next_step", "end")
-        
-        return state
+        result = self.tech_expert.process_task(state["task"], self._agent_context(state))
+        return self._result_update("tech_expert", result)
         
-    def _run_project_manager(self, state: AgentState) -> AgentState:
+    @traced("node.project_manager")
+    def _run_project_manager(self, state: AgentState) -> Dict[str, Any]:
         """运行项目经理Agent"""
-        task = state["task"]
-        context = state["context"]
-        
-        result = self.project_manager.process_task(task, context)
-        state["results"]["project_manager"] = result
-        state["current_agent"] = "project_manager"
-        
-        return state
+        result = self.project_manager.process_task(state["task"], self._agent_context(state))
+        return self._result_update("project_manager", result)
         
     def _route_from_coordinator(self, state: AgentState) -> str:
         """从协调员路由"""
         result = state["results"]["coordinator"]
         return result["next_agent"]
         
+    async def _abuild_coordinator_context(self, state: AgentState) -> Dict[str, Any]:
+        return await run_in_executor(self.retrieval_executor, self._build_coordinator_context, state)
+    
+    async def _aroute(self, task: str, context: Dict[str, Any]) -> Dict[str, Any]:
+        """路由可能需要编码任务或首次构建原型，放在检索线程池中执行"""
+        return await run_in_executor(self.retrieval_executor, self.coordinator.route, task, context)
+    
+    @traced("node.coordinator")
+    async def _arun_coordinator(self, state: AgentState) -> Dict[str, Any]:
+        """异步运行协调员Agent"""
+        context = await self._abuild_coordinator_context(state)
+        if self.analysis_mode == "inline":
+            result = await self.coordinator.aprocess_task(state["task"], context)
+        else:
+            result = await self._aroute(state["task"], context)
+        update = self._result_update("coordinator", result)
+        update["context"] = context
+        return update
+        
+    @traced("node.coordinator_analysis")
+    async def _arun_coordinator_analysis(self, state: AgentState) -> Dict[str, Any]:
+        """异步生成协调员的叙述性分析"""
+        result = await self.coordinator.aprocess_task(state["task"], state["context"])
+        return self._result_update("coordinator_analysis", result)
+        
+    @traced("node.business_expert")
+    async def _arun_business_expert(self, state: AgentState) -> Dict[str, Any]:
+        """异步运行业务专家Agent"""
+        result = await self.business_expert.aprocess_task(state["task"], self._agent_context(state))
+        return self._result_update("business_expert", result)
+        
+    @traced("node.tech_expert")
+    async def _arun_tech_expert(self, state: AgentState) -> Dict[str, Any]:
+        """异步运行技术专家Agent"""
+        result = await self.tech_expert.aprocess_task(state["task"], self._agent_context(state))
+        return self._result_update("tech_expert", result)
+        
+    @traced("node.project_manager")
+    async def _arun_project_manager(self, state: AgentState) -> Dict[str, Any]:
+        """异步运行项目经理Agent"""
+        result = await self.project_manager.aprocess_task(state["task"], self._agent_context(state))
+        return self._result_update("project_manager", result)
+        
+    def _route_experts_parallel(self, state: AgentState) -> List[str]:
+        """并行模式下从协调员路由：需要技术评估的业务需求同时派发业务和技术专家"""
+        next_agent = state["results"]["coordinator"]["next_agent"]
+        if next_agent == "business_expert" and self.business_expert.needs_technical_review(state["task"]):
+            return ["business_expert", "tech_expert"]
+        return [next_agent]
+        
+    def _route_with_analysis(self, state: AgentState) -> List[str]:
+        """在原有协调员路由结果之外追加后台分析节点"""
+        targets = self._coordinator_route(state)
+        return (targets if isinstance(targets, list) else [targets]) + ["coordinator_analysis"]
+        
+    def _route_to_project_manager(self, state: AgentState) -> str:
+        """并行模式下专家完成后统一汇合到项目经理"""
+        return "project_planning"
+        
     def _route_from_business(self, state: AgentState) -> str:
         """从业务专家路由"""
         return state.get("next_step", "end")
@@ -153,9 +301,8 @@ class WorkflowOrchestrator:
         """从技术专家路由"""
         return state.get("next_step", "end")
         
-    def execute_workflow(self, task: str) -> Dict[str, Any]:
-        """执行工作流"""
-        initial_state = AgentState(
+    def _initial_state(self, task: str) -> AgentState:
+        return AgentState(
             task=task,
             current_agent="",
             context={},
@@ -163,9 +310,143 @@ class WorkflowOrchestrator:
             next_step=""
         )
         
-        final_state = self.graph.invoke(initial_state)
+    def _thread_config(self, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        """未指定thread_id时每次运行使用新的线程，不会复用其他运行的检查点"""
+        return {"configurable": {"thread_id": thread_id or make_thread_id()}}
+    
+    def _run_input(self, snapshot, task: str, run_config: Dict[str, Any]) -> Tuple[Optional[AgentState], Dict[str, Any]]:
+        """根据调用方指定线程的检查点决定本次运行的输入与线程
+        
+        没有检查点时从头开始；未完成时传None从中断处续跑；已完成的线程不复用旧结果，在新线程上重新执行。
+        """
+        if not snapshot.values.get("task"):
+            return self._initial_state(task), run_config
+        if not snapshot.next:
+            run_config = self._thread_config()
+            print(f"🔁 检查点线程已完成，重新执行（新线程: {run_config['configurable']['thread_id']}）")
+            return self._initial_state(task), run_config
+        finished = ", ".join(snapshot.values.get("results", {})) or "无"
+        print(f"♻️ 从检查点续跑（已完成: {finished}，待执行: {', '.join(snapshot.next)}）")
+        return None, run_config
+    
+    def execute_workflow(self, task: str, thread_id: Optional[str] = None) -> Dict[str, Any]:
+        """执行工作流；启用检查点时传入中断运行的thread_id可续跑，已完成的节点不再执行"""
+        if self.checkpointer is None:
+            return self._workflow_result(self.graph.invoke(self._initial_state(task)))
+        run_config = self._thread_config(thread_id)
+        graph_input = self._initial_state(task)
+        if thread_id:
+            graph_input, run_config = self._run_input(self.graph.get_state(run_config), task, run_config)
+        final_state = self.graph.invoke(graph_input, run_config)
+        return self._workflow_result(final_state, run_config)
+    
+    async def execute_workflow_async(self, task: str, thread_id: Optional[str] = None,
+                                     on_progress: Callable[[Dict[str, Any]], Awaitable] = None) -> Dict[str, Any]:
+        """异步执行工作流：检索在有界线程池中运行，LLM请求经批处理队列，不阻塞事件循环
+        
+        on_progress 在每个超步结束后以截至当前的各Agent结果调用（任务队列据此提供部分结果）
+        """
+        if self.checkpointer is None:
+            return self._workflow_result(await self._ainvoke_graph(self._initial_state(task), None, on_progress))
+        run_config = self._thread_config(thread_id)
+        graph_input = self._initial_state(task)
+        if thread_id:
+            graph_input, run_config = self._run_input(await self.graph.aget_state(run_config), task, run_config)
+        final_state = await self._ainvoke_graph(graph_input, run_config, on_progress)
+        return self._workflow_result(final_state, run_config)
+    
+    async def _ainvoke_graph(self, graph_input: Optional[AgentState], run_config: Optional[Dict[str, Any]],
+                             on_progress: Callable[[Dict[str, Any]], Awaitable] = None) -> AgentState:
+        """等价于graph.ainvoke，需要进度回调时逐个超步取状态"""
+        if on_progress is None:
+            return await self.graph.ainvoke(graph_input, run_config)
+        final_state = None
+        async for final_state in self.graph.astream(graph_input, run_config, stream_mode="values"):
+            await on_progress(dict(final_state.get("results") or {}))
+        return final_state
+    
+    def _workflow_result(self, final_state: AgentState, run_config: Dict[str, Any] = None) -> Dict[str, Any]:
         return {
+            "thread_id": run_config["configurable"]["thread_id"] if run_config else None,
             "task": final_state["task"],
             "results": final_state["results"],
-            "final_agent": final_state["current_agent"]
-        }
\ No newline at end of file
+            "final_agent": final_state["current_agent"],
+            "context_report": final_state["context"].get("context_report")
+        }
+    
+    def _next_nodes(self, state: AgentState, frontier: List[str]) -> List[str]:
+        """按路由表计算下一批节点，多个节点汇合到同一目标时只运行一次"""
+        next_nodes = []
+        for node in frontier:
+            if node not in self.routes:
+                continue
+            route_fn, mapping = self.routes[node]
+            targets = route_fn(state)
+            for target in (targets if isinstance(targets, list) else [targets]):
+                target = mapping[target]
+                if target != END and target not in next_nodes:
+                    next_nodes.append(target)
+        return next_nodes
+    
+    async def _astream_agent(self, node: str, task: str, context: Dict[str, Any], events: asyncio.Queue):
+        """运行单个Agent，把token和结束事件写入共享队列；无论成败最后写入None作为结束标记"""
+        try:
+            result = None
+            with span(f"node.{node}"):
+                if node == "coordinator" and self.analysis_mode != "inline":
+                    result = await self._aroute(task, context)
+                else:
+                    async for kind, payload in self.agents[node].astream_task(task, context):
+                        if kind == "token":
+                            await events.put({"event": "token", "agent": node, "text": payload})
+                        else:
+                            result = payload
+            await events.put({"event": "agent_end", "agent": node, "result": result})
+        finally:
+            await events.put(None)
+    
+    async def astream_workflow(self, task: str,
+                               on_progress: Callable[[Dict[str, Any]], Awaitable] = None) -> AsyncIterator[Dict[str, Any]]:
+        """流式执行工作流：按与图相同的路由运行Agent，同一批的并行专家交错产出token事件
+        
+        事件类型：agent_start / token / agent_end / done；on_progress 与 execute_workflow_async 相同，
+        每个Agent结束后以截至当前的结果调用
+        """
+        state = self._initial_state(task)
+        frontier = ["coordinator"]
+        while frontier:
+            for node in frontier:
+                yield {"event": "agent_start", "agent": node}
+            if "coordinator" in frontier:
+                state["context"] = await self._abuild_coordinator_context(state)
+            
+            context = self._agent_context(state)
+            events = asyncio.Queue()
+            running = [asyncio.create_task(self._astream_agent(node, task, context, events)) for node in frontier]
+            try:
+                remaining = len(running)
+                while remaining:
+                    event = await events.get()
+                    if event is None:
+                        remaining -= 1
+                        continue
+                    if event["event"] == "agent_end":
+                        self._apply_update(state, self._result_update(event["agent"], event["result"]))
+                        if on_progress is not None:
+                            await on_progress(dict(state["results"]))
+                    yield event
+                # 传播Agent执行中的异常
+                await asyncio.gather(*running)
+            finally:
+                for job in running:
+                    job.cancel()
+            
+            frontier = self._next_nodes(state, frontier)
+        
+        yield {
+            "event": "done",
+            "task": task,
+            "results": state["results"],
+            "final_agent": state["current_agent"],
+            "context_report": state["context"].get("context_report")
+        }